@@ -35,14 +35,23 @@ class BeaverConfig():
             # ignoring line with regex
             'ignoreline_regex': '',
 
+            # ignoring line with several regexes, one per line
+            'ignoreline_regexes': '',
+
             # buffered tokenization
             # we string-escape the delimiter later so that we can put escaped characters in our config file
             'delimiter': '\n',
             'size_limit': '',
 
+            # share of the read budget of the file relative to the other files
+            'weight': '1',
+
             # multiline events support. Default is disabled
             'multiline_regex_after': '',
             'multiline_regex_before': '',
+            # cap the lines and bytes of a single multi-line event, 0 for no cap
+            'multiline_max_lines': '0',
+            'multiline_max_bytes': '0',
 
             'message_format': '',
             'sincedb_write_interval': '15',
@@ -51,6 +60,10 @@ class BeaverConfig():
             'tags': '',
             'tail_lines': '0',
             'type': '',
+
+            # read the file through a memory map instead of buffered reads
+            'use_mmap': '0',
+
             # Redis specific namespace
             'redis_namespace': '',
 
@@ -154,8 +167,28 @@ class BeaverConfig():
             # consumer processes
             'number_of_consumer_processes': '1',
 
+            # producer processes, files are sharded across them
+            'number_of_producer_processes': '1',
+
             # interprocess queue max size before puts block
             'max_queue_size': '100',
+            # channel between the producers and the consumers: queue, or ring for a shared memory ring buffer
+            'ipc_channel': 'queue',
+            # how batches are spread across the consumers: shared for a single queue, or file for one queue
+            # per consumer, each file being shipped by a single consumer
+            'consumer_routing': 'shared',
+            # size in bytes of the shared memory ring buffer
+            'ring_buffer_size': '67108864',
+            # size in bytes of the shared registry of file metadata, 0 to send the metadata with every batch
+            'file_registry_size': '1048576',
+            # directory of the files batches are spilled to while the queue is filled past spill_high_water, empty to disable
+            'spill_path': '',
+            # fraction of max_queue_size past which batches are spilled
+            'spill_high_water': '0.9',
+            # max size in bytes of the spill files of a producer process, 0 for no limit
+            'spill_max_bytes': '1073741824',
+            # size in bytes past which a new spill file is started
+            'spill_segment_size': '16777216',
 
             # time in seconds before updating the file mapping
             'update_file_mapping_time': '',  # deprecated
@@ -170,12 +203,33 @@ class BeaverConfig():
             # time in seconds to wait on queue.get() block before raising Queue.Empty exception
             'wait_timeout': '5',
 
+            # max number of queued batches a consumer merges before calling the transport, 1 to disable
+            'queue_coalesce_max_items': '1',
+            # time in milliseconds a consumer waits for more batches to merge
+            'queue_coalesce_max_wait_ms': '0',
+
             # time in seconds to wait before each sending message
             'wait_before_send': '0.1',
 
+            # ship lines from the tailing process undecoded and decode them in the transport
+            'binary_pipeline': '0',
+
+            # processes reading the historical part of large files in parallel
+            'backfill_processes': '0',
+            # unread bytes above which a file is backfilled in parallel
+            'backfill_min_size': '67108864',
+            # bytes per backfill range
+            'backfill_chunk_size': '16777216',
+
+            # bytes of compressed data read at a time from .gz, .bz2 and .xz files
+            'decompress_buffer_size': '1048576',
+
             # path to sincedb sqlite db
             'sincedb_path': '',
 
+            # time in seconds between commits of pending sincedb updates
+            'sincedb_flush_interval': '1',
+
             # 0 for logstash version < 1.2, 1 for logstash >= 1.2
             'logstash_version': '',
 
@@ -234,6 +288,26 @@ class BeaverConfig():
 
             # Size in bytes that Tail process will load into memory and proccess at a time from file
             'file_read_blocksize': 4096,
+            # Reads grow up to this size while they return full blocks, and shrink back when they come back short
+            'file_read_max_blocksize': 1048576,
+            # Bytes read from a single file before moving on to the next one, 0 for no limit
+            'file_read_pass_budget': 8388608,
+
+            # how to notice file changes: poll, inotify, or auto to use inotify when available
+            'watch_backend': 'poll',
+            # longest time in seconds between two reads of an idle file when polling
+            'poll_max_interval': '1',
+            # longest time in seconds spent reading the rest of a rotated file before switching to the new one
+            'rotation_drain_timeout': '10',
+            # share of max_queue_size past which only the files of the highest weight are read, 0 to disable
+            'queue_pressure_threshold': '0.8',
+            # number of threads creating the tails of new files, 0 to create them one after the other
+            'tail_init_threads': '0',
+            # number of file handles kept open, the least recently active files are closed beyond it, 0 for no limit
+            'max_open_files': '0',
+
+            # time in seconds between logging the per-file read metrics, 0 to disable
+            'metrics_interval': '60',
 
             # If set, Tail processes will buffer data in memory until up to this many lines are read
             # or buffered_lines_max_size is reached, or buffered_lines_max_seconds is exceeded, whichever comes first.
@@ -271,12 +345,12 @@ class BeaverConfig():
             self._file_config[globname] = config
             for key in config:
                 self._logger.debug('Config: "{0}" => "{1}"'.format(key, config[key]))
+            self._globbed.append(globname)
         else:
             config = self._file_config.get(globname)
 
         for filename in globbed:
             self._files[filename] = config
-        self._globbed.append(globname)
 
     def getfilepaths(self):
         return self._files.keys()
@@ -362,7 +436,7 @@ class BeaverConfig():
                     config[key] = None
 
             require_bool = ['debug', 'daemonize', 'fqdn', 'rabbitmq_exchange_durable', 'rabbitmq_queue_durable',
-                            'rabbitmq_ha_queue', 'rabbitmq_ssl', 'tcp_ssl_enabled', 'tcp_ssl_verify']
+                            'rabbitmq_ha_queue', 'rabbitmq_ssl', 'tcp_ssl_enabled', 'tcp_ssl_verify', 'binary_pipeline']
 
             for key in require_bool:
                 config[key] = bool(int(config[key]))
@@ -370,6 +444,10 @@ class BeaverConfig():
             require_int = [
                 'max_failure',
                 'max_queue_size',
+                'ring_buffer_size',
+                'file_registry_size',
+                'spill_max_bytes',
+                'spill_segment_size',
                 'queue_timeout',
                 'rabbitmq_port',
                 'rabbitmq_timeout',
@@ -380,18 +458,30 @@ class BeaverConfig():
                 'tcp_port',
                 'udp_port',
                 'wait_timeout',
+                'queue_coalesce_max_items',
+                'queue_coalesce_max_wait_ms',
                 'zeromq_hwm',
                 'logstash_version',
                 'kafka_batch_n',
                 'kafka_batch_t',
                 'kafka_ack_timeout',
                 'number_of_consumer_processes',
+                'number_of_producer_processes',
                 'ignore_old_files_days',
                 'ignore_old_files_hours',
                 'ignore_old_files_minutes',
                 'buffered_lines_max_lines',
                 'buffered_lines_max_bytes',
-                'buffered_lines_max_seconds'
+                'buffered_lines_max_seconds',
+                'backfill_processes',
+                'backfill_min_size',
+                'backfill_chunk_size',
+                'decompress_buffer_size',
+                'file_read_blocksize',
+                'file_read_max_blocksize',
+                'file_read_pass_budget',
+                'max_open_files',
+                'tail_init_threads',
             ]
             for key in require_int:
                 if config[key] is not None:
@@ -401,6 +491,12 @@ class BeaverConfig():
                 'update_file_mapping_time',
                 'discover_interval',
                 'wait_before_send',
+                'sincedb_flush_interval',
+                'metrics_interval',
+                'poll_max_interval',
+                'rotation_drain_timeout',
+                'queue_pressure_threshold',
+                'spill_high_water',
             ]
 
             for key in require_float:
@@ -427,6 +523,9 @@ class BeaverConfig():
             if config.get('sincedb_path'):
                 config['sincedb_path'] = os.path.realpath(config.get('sincedb_path'))
 
+            if config.get('spill_path'):
+                config['spill_path'] = os.path.realpath(config.get('spill_path'))
+
             if config['zeromq_address'] and type(config['zeromq_address']) == str:
                 config['zeromq_address'] = [x.strip() for x in config.get('zeromq_address').split(',')]
 
@@ -519,7 +618,7 @@ class BeaverConfig():
             if not file_type:
                 config['type'] = 'file'
 
-            require_bool = ['debug', 'ignore_empty', 'ignore_truncate']
+            require_bool = ['debug', 'ignore_empty', 'ignore_truncate', 'use_mmap']
             for k in require_bool:
                 config[k] = bool(int(config[k]))
 
@@ -532,8 +631,12 @@ class BeaverConfig():
 
             if config['ignoreline_regex']:
                 config['ignoreline_regex'] = re.compile(config['ignoreline_regex'])
+            if config['ignoreline_regexes']:
+                config['ignoreline_regexes'] = [re.compile(pattern)
+                                                for pattern in config['ignoreline_regexes'].splitlines() if pattern]
 
-            require_int = ['sincedb_write_interval', 'stat_interval', 'tail_lines']
+            require_int = ['sincedb_write_interval', 'stat_interval', 'tail_lines',
+                           'multiline_max_lines', 'multiline_max_bytes', 'weight']
             for k in require_int:
                 config[k] = int(config[k])
 
@@ -5,9 +5,12 @@ import signal
 import time
 
 from beaver.config import BeaverConfig
+from beaver.file_registry import FileRegistry
+from beaver.ring_queue import RingQueue
 from beaver.run_queue import run_queue
 from beaver.ssh_tunnel import create_ssh_tunnel
 from beaver.utils import REOPEN_FILES, setup_custom_logger
+from beaver.worker.hash_ring import HashRing
 from beaver.worker.tail_manager import TailManager
 
 
@@ -19,17 +22,74 @@ def run(args=None):
     if beaver_config.get('logstash_version') not in [0, 1]:
         raise LookupError("Invalid logstash_version")
 
-    queue = multiprocessing.JoinableQueue(beaver_config.get('max_queue_size'))
-
-    manager_proc = None
+    if beaver_config.get('ipc_channel') not in ['queue', 'ring']:
+        raise LookupError("Invalid ipc_channel")
+
+    if beaver_config.get('consumer_routing') not in ['shared', 'file']:
+        raise LookupError("Invalid consumer_routing")
+
+    if beaver_config.get('ipc_channel') == 'ring':
+        largest_batch = max(beaver_config.get('backfill_chunk_size'), beaver_config.get('file_read_pass_budget'))
+        if not beaver_config.get('file_read_pass_budget') or largest_batch > beaver_config.get('ring_buffer_size') / 2:
+            logger.warning('ring_buffer_size is less than twice file_read_pass_budget or backfill_chunk_size: '
+                           'larger batches are split into several records, and lines larger than half '
+                           'of the ring are not shipped')
+
+    def create_queue():
+        if beaver_config.get('ipc_channel') == 'ring':
+            return RingQueue(beaver_config.get('ring_buffer_size'), beaver_config.get('max_queue_size'))
+
+        return multiprocessing.JoinableQueue(beaver_config.get('max_queue_size'))
+
+    # With file routing, every consumer has its own queue, and the batches of
+    # a file always go to the same queue so that they are shipped in order.
+    number_of_consumer_processes = int(beaver_config.get('number_of_consumer_processes'))
+    if beaver_config.get('consumer_routing') == 'file' and number_of_consumer_processes > 1:
+        queues = [create_queue() for _ in range(number_of_consumer_processes)]
+        consumer_ring = HashRing(number_of_consumer_processes)
+    else:
+        queues = [create_queue()]
+        consumer_ring = None
+
+    file_registry = None
+    if beaver_config.get('file_registry_size'):
+        file_registry = FileRegistry(beaver_config.get('file_registry_size'))
+
+    number_of_producer_processes = max(beaver_config.get('number_of_producer_processes') or 1, 1)
+    if number_of_producer_processes > 1 and not beaver_config.get('sincedb_path'):
+        logger.warning('number_of_producer_processes is set without sincedb_path: files taken over from '
+                       'a dead producer start at their start_position, and the lines written while they '
+                       'moved are not shipped')
+    manager_procs = [None] * number_of_producer_processes
+    shards_alive = multiprocessing.Array('b', number_of_producer_processes)
     termination_requested = multiprocessing.Event()
     ssh_tunnel = create_ssh_tunnel(beaver_config, logger=logger)
 
-    def queue_put(*args):
-        return queue.put(*args)
+    def queue_put(item, *args):
+        command, data = item
+        if consumer_ring is not None and command != 'callback':
+            # Every consumer needs the other commands.
+            for queue in queues:
+                queue.put(item, *args)
+            return
+
+        queue = queues[0]
+        if consumer_ring is not None:
+            queue = queues[consumer_ring.get(data['filename'])]
+
+        if file_registry is not None:
+            item = file_registry.pack(item)
+        try:
+            return queue.put(item, *args)
+        except ValueError, e:
+            # Only a ring refuses items, when a single line does not fit.
+            if command == 'callback':
+                logger.error('dropping a line of {0}: {1}'.format(data['filename'], e))
+            else:
+                logger.error('dropping {0} item: {1}'.format(command, e))
 
-    def queue_put_nowait(*args):
-        return queue.put_nowait(*args)
+    def queue_size():
+        return max(queue.qsize() for queue in queues)
 
     def request_shutdown(signalnum, frame):
         termination_requested.set()
@@ -41,18 +101,20 @@ def run(args=None):
             logger.info('Worker process cleanup in progress...')
 
     def cleanup():
-        try:
-            queue_put_nowait(("exit", ()))
-        except Queue.Full:
-            pass
-
-        if manager_proc is not None:
+        for queue in queues:
             try:
-                manager_proc.close()
-                manager_proc.join()
-            except RuntimeError:
+                queue.put_nowait(("exit", ()))
+            except Queue.Full:
                 pass
 
+        for manager_proc in manager_procs:
+            if manager_proc is not None:
+                try:
+                    manager_proc.close()
+                    manager_proc.join()
+                except RuntimeError:
+                    pass
+
         if ssh_tunnel is not None:
             logger.info("Closing ssh tunnel...")
             ssh_tunnel.close()
@@ -61,20 +123,24 @@ def run(args=None):
     signal.signal(signal.SIGINT, request_shutdown)
     signal.signal(signal.SIGQUIT, request_shutdown)
 
-    def create_queue_consumer():
-        process_args = (queue, beaver_config, logger)
+    def create_queue_consumer(consumer=0):
+        process_args = (queues[consumer % len(queues)], beaver_config, logger, file_registry)
         proc = multiprocessing.Process(target=run_queue, args=process_args)
 
         logger.info("Starting queue consumer")
         proc.start()
         return proc
 
-    def create_queue_producer():
+    def create_queue_producer(shard=0):
         return TailManager(
             beaver_config=beaver_config,
             queue_consumer_function=create_queue_consumer,
             callback=queue_put,
-            logger=logger
+            logger=logger,
+            shard=shard,
+            number_of_shards=number_of_producer_processes,
+            shards_alive=shards_alive,
+            queue_size=queue_size
         )
 
     last_start = None
@@ -85,14 +151,24 @@ def run(args=None):
             if REOPEN_FILES:
                 logger.debug("Detected non-linux platform. Files will be reopened for tailing")
 
-            if manager_proc is None or not manager_proc.is_alive():
-                logger.info('Starting worker...')
-                manager_proc = create_queue_producer()
-                manager_proc.start()
-                last_start = time.time()
-                logger.info('Working...')
-
-            if beaver_config.get('refresh_worker_process') and manager_proc.is_alive():
+            # When every shard is (re)started, all are flagged alive before any
+            # starts, so that none takes over the files of one still starting.
+            # Otherwise the other shards take over the files of a dead shard
+            # until its replacement flags itself alive, once it is ready.
+            restarting_all = not any(proc is not None and proc.is_alive() for proc in manager_procs)
+            for shard, manager_proc in enumerate(manager_procs):
+                if manager_proc is None or not manager_proc.is_alive():
+                    shards_alive[shard] = 1 if restarting_all else 0
+
+            for shard, manager_proc in enumerate(manager_procs):
+                if manager_proc is None or not manager_proc.is_alive():
+                    logger.info('Starting worker...')
+                    manager_procs[shard] = create_queue_producer(shard)
+                    manager_procs[shard].start()
+                    last_start = time.time()
+                    logger.info('Working...')
+
+            if beaver_config.get('refresh_worker_process') and all(proc.is_alive() for proc in manager_procs):
                 if last_start and beaver_config.get('refresh_worker_process') < time.time() - last_start:
                     logger.info('Worker has exceeded refresh limit. Terminating process...')
                     cleanup()
@@ -101,6 +177,8 @@ def run(args=None):
                 # And blocks SIGINT signals from getting through.
                 while not termination_requested.is_set():
                     time.sleep(0.5)
+                    if number_of_producer_processes > 1 and not all(proc.is_alive() for proc in manager_procs):
+                        break
 
         except KeyboardInterrupt:
             pass
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import marshal
+import mmap
+import multiprocessing
+import operator
+import struct
+
+_HEADER = struct.Struct('=I')
+
+# Keys of a callback batch that describe its file rather than its lines
+_METADATA_KEYS = ('fields', 'filename', 'format', 'ignore_empty', 'tags', 'type')
+_metadata = operator.itemgetter(*_METADATA_KEYS)
+
+
+class FileRegistry(object):
+    """Shared registry of the metadata of the tailed files
+
+    Producers register the metadata of a file (fields, filename, format,
+    ignore_empty, tags and type) once, and then send its batches of lines
+    as (file id, timestamp, lines) tuples instead of a dict repeating the
+    metadata. A file gets a new id only when its metadata changes.
+
+    The registry is an append-only log of marshalled metadata in an
+    anonymous shared memory map, created before the producers and the
+    consumers are forked. An id is the index of an entry in the log, so
+    entries never change once written: a consumer, including one respawned
+    later, decodes the entries it does not know yet when it meets an
+    unknown id, and keeps them for good. Identical metadata registered by
+    different producers gets the same id.
+
+    When the log is full, or the metadata cannot be marshalled, batches are
+    sent with their metadata as before.
+    """
+
+    def __init__(self, size):
+        self._capacity = size
+        self._buffer = mmap.mmap(-1, size)
+        self._length = multiprocessing.RawValue(ctypes.c_ulonglong, 0)
+        self._lock = multiprocessing.Lock()
+
+        # Per process view of the log
+        self._offset = 0
+        self._entries = []
+        self._ids = {}
+        # Per process ids of the files registered by this process
+        self._registered = {}
+
+    def pack(self, item):
+        """Returns a callback item with its metadata replaced by the file id"""
+        command, data = item
+        if command != 'callback' or not isinstance(data, dict):
+            return item
+
+        values = _metadata(data)
+        registered = self._registered.get(values[1])
+        if registered is None or registered[0] != values:
+            registered = (values, self._register(values))
+            self._registered[values[1]] = registered
+
+        if registered[1] is None:
+            return item
+
+        return command, (registered[1], data['timestamp'], data['lines'])
+
+    def unpack(self, item):
+        """Returns a callback item packed by pack with its metadata"""
+        command, data = item
+        if command != 'callback' or not isinstance(data, tuple):
+            return item
+
+        file_id, timestamp, lines = data
+        if file_id >= len(self._entries):
+            self._sync()
+
+        data = self._entries[file_id].copy()
+        data['timestamp'] = timestamp
+        data['lines'] = lines
+        return command, data
+
+    def __len__(self):
+        self._sync()
+        return len(self._entries)
+
+    def _register(self, values):
+        """Returns the id of the metadata, adding it to the log if needed,
+        or None if it cannot be added
+        """
+        try:
+            blob = marshal.dumps(values)
+        except ValueError:
+            return None
+
+        with self._lock:
+            self._sync()
+            file_id = self._ids.get(blob)
+            if file_id is not None:
+                return file_id
+
+            length = self._length.value
+            needed = _HEADER.size + len(blob)
+            if length + needed > self._capacity:
+                return None
+
+            _HEADER.pack_into(self._buffer, length, len(blob))
+            self._buffer[length + _HEADER.size:length + needed] = blob
+            self._length.value = length + needed
+            self._sync()
+
+        return self._ids[blob]
+
+    def _sync(self):
+        """Decodes the entries added to the log since the last call"""
+        length = self._length.value
+        while self._offset < length:
+            size, = _HEADER.unpack_from(self._buffer, self._offset)
+            start = self._offset + _HEADER.size
+            blob = self._buffer[start:start + size]
+            self._ids[blob] = len(self._entries)
+            self._entries.append(dict(zip(_METADATA_KEYS, marshal.loads(blob))))
+            self._offset = start + size
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import marshal
+import mmap
+import multiprocessing
+import cPickle as pickle
+import Queue
+import struct
+import time
+
+_HEADER = struct.Struct('=I')
+
+# Length of the record marking that the next record starts at the beginning of the ring
+_WRAP = 0xFFFFFFFF
+
+_MARSHAL = 'm'
+_PICKLE = 'p'
+
+
+def dumps(value):
+    """Marshals value, or pickles it if it cannot be marshalled"""
+    try:
+        return _MARSHAL + marshal.dumps(value)
+    except ValueError:
+        return _PICKLE + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(blob):
+    """Loads a value dumped by dumps"""
+    if blob[0] == _MARSHAL:
+        return marshal.loads(buffer(blob, 1))
+
+    return pickle.loads(blob[1:])
+
+
+def split_item(item):
+    """Returns the two halves of a callback or addglob item holding several
+    lines or paths, or None if it cannot be split
+    """
+    command, data = item
+    if command == 'addglob':
+        name, globbed = data
+        half = len(globbed) // 2
+        if not half:
+            return None
+        return [(command, (name, globbed[:half])), (command, (name, globbed[half:]))]
+
+    if command != 'callback':
+        return None
+
+    if isinstance(data, tuple):
+        # Packed by the FileRegistry
+        file_id, timestamp, lines = data
+        half = len(lines) // 2
+        if not half:
+            return None
+        return [(command, (file_id, timestamp, lines[:half])), (command, (file_id, timestamp, lines[half:]))]
+
+    half = len(data['lines']) // 2
+    if not half:
+        return None
+
+    pieces = []
+    for part in (slice(None, half), slice(half, None)):
+        piece = dict(data, lines=data['lines'][part])
+        if data.get('timestamps') is not None:
+            piece['timestamps'] = data['timestamps'][part]
+        pieces.append((command, piece))
+    return pieces
+
+
+class RingQueue(object):
+    """Queue of (command, data) items in a shared memory ring buffer
+
+    Items are written as length-prefixed records in an anonymous shared
+    memory map inherited by the forked producers and consumers, so an item
+    is copied once into the ring and once out of it, without a feeder
+    thread or a pipe. Records are marshalled, which is much cheaper than
+    pickling for the strings, lists and dicts making up a batch; other
+    items fall back to pickle. The metadata of the batches is left to the
+    FileRegistry, which replaces it by a file id before the item is put.
+
+    Write and read positions are shared counters. A writer only moves the
+    write position and a reader only moves the read position, each under
+    its own lock, so producers never wait for consumers and the other way
+    around; a semaphore counts the records ready to be read. Like a
+    multiprocessing queue, it holds at most maxsize items if maxsize is set.
+
+    A record takes at most half of the ring, so that it always fits once the
+    records before it are read. Larger batches are split into several
+    records, and a single line that does not fit raises ValueError.
+
+    Implements the subset of the multiprocessing.Queue interface used by
+    beaver: put, put_nowait, get, qsize, empty and full.
+    """
+
+    def __init__(self, size, maxsize=0):
+        self._capacity = size
+        self._maxsize = maxsize
+        self._buffer = mmap.mmap(-1, size)
+        # Bytes written, bytes read, records written, records read
+        self._positions = multiprocessing.RawArray(ctypes.c_ulonglong, 4)
+        self._write_lock = multiprocessing.Lock()
+        self._read_lock = multiprocessing.Lock()
+        self._items = multiprocessing.Semaphore(0)
+        self._slots = multiprocessing.BoundedSemaphore(maxsize) if maxsize else None
+
+    def put(self, item, block=True, timeout=None):
+        record = dumps(item)
+        if _HEADER.size + len(record) > self._capacity / 2:
+            pieces = split_item(item)
+            if pieces is None:
+                raise ValueError('record of {0} bytes does not fit in a ring buffer of {1} bytes'.format(
+                    len(record), self._capacity))
+
+            for piece in pieces:
+                self.put(piece, block, timeout)
+            return
+
+        deadline = None if timeout is None else time.time() + timeout
+        if self._slots is not None and not self._slots.acquire(block, timeout):
+            raise Queue.Full
+
+        delay = 0.001
+        while True:
+            with self._write_lock:
+                written = self._write(record)
+
+            if written:
+                break
+
+            if not block or (deadline is not None and time.time() >= deadline):
+                if self._slots is not None:
+                    self._slots.release()
+                raise Queue.Full
+
+            # The ring is full until a consumer catches up.
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        self._items.release()
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        if not self._items.acquire(block, timeout):
+            raise Queue.Empty
+
+        with self._read_lock:
+            record = self._read()
+
+        if self._slots is not None:
+            self._slots.release()
+
+        return loads(record)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self._positions[2] - self._positions[3]
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        if self._maxsize and self.qsize() >= self._maxsize:
+            return True
+
+        return self._capacity - (self._positions[0] - self._positions[1]) < _HEADER.size
+
+    def _write(self, record):
+        """Appends a record to the ring. Returns False if there is not enough room"""
+        write, read = self._positions[0], self._positions[1]
+        offset = write % self._capacity
+        needed = _HEADER.size + len(record)
+
+        skip = 0
+        if self._capacity - offset < needed:
+            skip = self._capacity - offset
+
+        if write + skip + needed - read > self._capacity:
+            return False
+
+        if skip:
+            if skip >= _HEADER.size:
+                _HEADER.pack_into(self._buffer, offset, _WRAP)
+            offset = 0
+
+        _HEADER.pack_into(self._buffer, offset, len(record))
+        self._buffer[offset + _HEADER.size:offset + needed] = record
+        self._positions[0] = write + skip + needed
+        self._positions[2] += 1
+        return True
+
+    def _read(self):
+        """Removes the next record from the ring. A record must be available"""
+        read = self._positions[1]
+        offset = read % self._capacity
+        if self._capacity - offset < _HEADER.size:
+            read += self._capacity - offset
+            offset = 0
+        else:
+            length, = _HEADER.unpack_from(self._buffer, offset)
+            if length == _WRAP:
+                read += self._capacity - offset
+                offset = 0
+
+        length, = _HEADER.unpack_from(self._buffer, offset)
+        record = self._buffer[offset + _HEADER.size:offset + _HEADER.size + length]
+        self._positions[1] = read + _HEADER.size + length
+        self._positions[3] += 1
+        return record
@@ -9,7 +9,60 @@ from beaver.transports.exception import TransportException
 from unicode_dammit import unicode_dammit
 
 
-def run_queue(queue, beaver_config, logger=None):
+def coalesce(items):
+    """Merges the lines of the callback items of a same file with the same
+    metadata into the first of them, keeping the order of the items. Items
+    are not merged across other commands. When the merged batches have
+    different timestamps, the merged item carries the timestamp of every
+    line in timestamps, next to its lines.
+    """
+    merged = []
+    batches = {}
+    for command, data in items:
+        if command != 'callback':
+            merged.append((command, data))
+            batches = {}
+            continue
+
+        key = (data.get('filename'), data.get('type'), data.get('format'), data.get('ignore_empty'))
+        batch = batches.get(key)
+        if batch is not None and batch.get('tags') == data.get('tags') and batch.get('fields') == data.get('fields'):
+            timestamps = batch.get('timestamps')
+            if timestamps is None and data.get('timestamp') != batch.get('timestamp'):
+                timestamps = batch['timestamps'] = [batch.get('timestamp')] * len(batch['lines'])
+            if timestamps is not None:
+                timestamps.extend([data.get('timestamp')] * len(data['lines']))
+            batch['lines'].extend(data['lines'])
+            continue
+
+        data['lines'] = list(data['lines'])
+        batches[key] = data
+        merged.append((command, data))
+
+    return merged
+
+
+def _drain(queue, item, max_items, max_wait):
+    """Returns item followed by the items taken from the queue within max_wait
+    seconds, up to max_items in all, stopping at the first command that is not
+    a callback
+    """
+    items = [item]
+    deadline = time.time() + max_wait
+    while len(items) < max_items and items[-1][0] == 'callback':
+        remaining = deadline - time.time()
+        try:
+            if remaining > 0:
+                items.append(queue.get(block=True, timeout=remaining))
+            else:
+                items.append(queue.get(block=False))
+        except Queue.Empty:
+            break
+
+    return items
+
+
+def run_queue(queue, beaver_config, logger=None, file_registry=None):
     signal.signal(signal.SIGTERM, signal.SIG_DFL)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
     signal.signal(signal.SIGQUIT, signal.SIG_DFL)
@@ -17,6 +70,8 @@ def run_queue(queue, beaver_config, logger=None):
     last_update_time = int(time.time())
     queue_timeout = beaver_config.get('queue_timeout')
     wait_timeout = beaver_config.get('wait_timeout')
+    coalesce_max_items = beaver_config.get('queue_coalesce_max_items') or 1
+    coalesce_max_wait = (beaver_config.get('queue_coalesce_max_wait_ms') or 0) / 1000.0
     count = 0
 
     transport = None
@@ -30,7 +85,7 @@ def run_queue(queue, beaver_config, logger=None):
                 logger.info('Transport connection issues, stopping queue')
                 break
 
-            command = None
+            items = []
             try:
                 if queue.full():
                     logger.error("Queue is full")
@@ -39,10 +94,21 @@ def run_queue(queue, beaver_config, logger=None):
                     if count == 1000:
                         logger.debug("Main consumer queue Size is: " + str(queue.qsize()))
                         count = 0
-                command, data = queue.get(block=True, timeout=wait_timeout)
-                if command == "callback":
+                items = [queue.get(block=True, timeout=wait_timeout)]
+                if items[0][0] == "callback":
                     last_update_time = int(time.time())
                     logger.debug('Last update time now {0}'.format(last_update_time))
+                    if coalesce_max_items > 1:
+                        items = _drain(queue, items[0], coalesce_max_items, coalesce_max_wait)
+
+                if file_registry is not None:
+                    items = [file_registry.unpack(item) for item in items]
+
+                if len(items) > 1:
+                    # Ship the batches waiting in the queue together, so
+                    # the transport sends fuller requests.
+                    items = coalesce(items)
+                    logger.debug('Coalesced into {0} batches'.format(len(items)))
             except Queue.Empty:
                 if not queue.empty():
                     logger.error('Recieved timeout from main consumer queue - stopping queue')
@@ -54,52 +120,64 @@ def run_queue(queue, beaver_config, logger=None):
                 logger.info('Queue timeout of "{0}" seconds exceeded, stopping queue'.format(queue_timeout))
                 break
 
-            if command == 'callback':
-                if data.get('ignore_empty', False):
-                    logger.debug('removing empty lines')
-                    lines = data['lines']
-                    new_lines = []
-                    for line in lines:
-                        message = unicode_dammit(line)
-                        if len(message) == 0:
-                            continue
-                        new_lines.append(message)
-                    data['lines'] = new_lines
-
-                if len(data['lines']) == 0:
-                    logger.debug('0 active lines sent from worker')
-                    continue
-
-                while True:
-                    try:
-                        transport.callback(**data)
-                        count += 1
-                        logger.debug("Number of transports: " + str(count))
-                        break
-                    except TransportException as e:
-                        failure_count = failure_count + 1
-                        if failure_count > beaver_config.get('max_failure'):
-                            failure_count = beaver_config.get('max_failure')
-
-                        sleep_time = beaver_config.get('respawn_delay') ** failure_count
-                        logger.info('Caught transport exception: %s', e)
-                        logger.info('Reconnecting in %d seconds' % sleep_time)
+            exit_requested = False
+            for command, data in items:
+                if command == 'callback':
+                    if data.get('ignore_empty', False):
+                        logger.debug('removing empty lines')
+                        lines = data['lines']
+                        timestamps = data.get('timestamps')
+                        new_lines = []
+                        new_timestamps = []
+                        for index, line in enumerate(lines):
+                            message = unicode_dammit(line)
+                            if len(message) == 0:
+                                continue
+                            new_lines.append(message)
+                            if timestamps is not None:
+                                new_timestamps.append(timestamps[index])
+                        data['lines'] = new_lines
+                        if timestamps is not None:
+                            data['timestamps'] = new_timestamps
 
+                    if len(data['lines']) == 0:
+                        logger.debug('0 active lines sent from worker')
+                        continue
+
+                    while True:
                         try:
-                            transport.invalidate()
-                            time.sleep(sleep_time)
-                            transport.reconnect()
-                            if transport.valid():
-                                failure_count = 0
-                                logger.info('Reconnected successfully')
-                        except KeyboardInterrupt:
-                            logger.info('User cancelled respawn.')
-                            transport.interrupt()
-                            sys.exit(0)
-            elif command == 'addglob':
-                beaver_config.addglob(*data)
-                transport.addglob(*data)
-            elif command == 'exit':
+                            transport.callback(**data)
+                            count += 1
+                            logger.debug("Number of transports: " + str(count))
+                            break
+                        except TransportException as e:
+                            failure_count = failure_count + 1
+                            if failure_count > beaver_config.get('max_failure'):
+                                failure_count = beaver_config.get('max_failure')
+
+                            sleep_time = beaver_config.get('respawn_delay') ** failure_count
+                            logger.info('Caught transport exception: %s', e)
+                            logger.info('Reconnecting in %d seconds' % sleep_time)
+
+                            try:
+                                transport.invalidate()
+                                time.sleep(sleep_time)
+                                transport.reconnect()
+                                if transport.valid():
+                                    failure_count = 0
+                                    logger.info('Reconnected successfully')
+                            except KeyboardInterrupt:
+                                logger.info('User cancelled respawn.')
+                                transport.interrupt()
+                                sys.exit(0)
+                elif command == 'addglob':
+                    beaver_config.addglob(*data)
+                    transport.addglob(*data)
+                elif command == 'exit':
+                    exit_requested = True
+                    break
+
+            if exit_requested:
                 break
     except KeyboardInterrupt:
         logger.debug('Queue Interruped')
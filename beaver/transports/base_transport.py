@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import codecs
 import datetime
+import itertools
+import re
 
 # priority: ujson > simplejson > jsonlib2 > json
 priority = ['ujson', 'simplejson', 'jsonlib2', 'json']
@@ -16,6 +19,10 @@ try:
 except ImportError:
     import msgpack_pure as msgpack
 
+from beaver.utils import decode_line
+
+NON_ASCII = re.compile('[\x80-\xff]')
+
 
 class BaseTransport(object):
 
@@ -28,6 +35,8 @@ class BaseTransport(object):
         self._beaver_config = beaver_config
         self._current_host = beaver_config.get('hostname')
         self._default_formatter = beaver_config.get('format', 'null')
+        self._encodings = {}
+        self._file_formatters = {}
         self._formatters = {}
         self._is_valid = True
         self._logger = logger
@@ -110,19 +119,49 @@ class BaseTransport(object):
     def addglob(self, globname, globbed):
         """Adds a set of globbed files to the attached beaver_config"""
         self._beaver_config.addglob(globname, globbed)
+        self._encodings.clear()
+        self._file_formatters.clear()
 
     def callback(self, filename, lines):
         """Processes a set of lines for a filename"""
         return True
 
+    def decode(self, filename, line):
+        """Decodes a line shipped undecoded by binary_pipeline with the file encoding"""
+        encoding = self._encodings.get(filename)
+        if encoding is None:
+            encoding = self._beaver_config.get_field('encoding', filename) or 'utf_8'
+            encoding = self._encodings[filename] = codecs.lookup(encoding).name
+
+        return decode_line(line, encoding)
+
+    def file_formatter(self, filename):
+        """Returns the (formatter, encrypter) names of a file, looked up once per file"""
+        names = self._file_formatters.get(filename)
+        if names is None:
+            formatter = self._beaver_config.get_field('format', filename)
+            if formatter not in self._formatters:
+                formatter = self._default_formatter
+
+            encrypter = self._beaver_config.get_field('encrypter', filename)
+            encrypter = encrypter or self._beaver_config.get('encrypter') or 'default'
+            names = self._file_formatters[filename] = (formatter, encrypter)
+
+        return names
+
     def format(self, filename, line, timestamp, **kwargs):
         """Returns a formatted log line"""
-        line = unicode(line.encode("utf-8").strip(), "utf-8", errors="ignore")
-        formatter = self._beaver_config.get_field('format', filename)
-        encrypter = self._beaver_config.get_field('encrypter', filename)
-        encrypter = encrypter or self._beaver_config.get('encrypter') or 'default'
-        if formatter not in self._formatters:
-            formatter = self._default_formatter
+        formatter, encrypter = self.file_formatter(filename)
+
+        if isinstance(line, unicode):
+            line = unicode(line.encode("utf-8").strip(), "utf-8", errors="ignore")
+        else:
+            line = line.strip()
+            if formatter == 'raw' and not NON_ASCII.search(line):
+                # Lines are only shipped as bytes for ASCII compatible
+                # encodings, so pure ASCII can be shipped without decoding.
+                return line
+            line = self.decode(filename, line)
 
         data = {
             self._fields.get('type'): kwargs.get('type'),
@@ -154,6 +193,17 @@ class BaseTransport(object):
 
         return timestamp
 
+    def timestamped_lines(self, lines, timestamp, kwargs):
+        """Returns the (line, timestamp) pairs of a batch. A batch merged from
+        several batches of a file by the consumer carries the timestamp of
+        each line in timestamps, which is removed from kwargs.
+        """
+        timestamps = kwargs.pop('timestamps', None)
+        if timestamps is None:
+            return itertools.izip(lines, itertools.repeat(timestamp))
+
+        return itertools.izip(lines, timestamps)
+
     def interrupt(self):
         """Allows keyboard interrupts to be
         handled properly by the transport
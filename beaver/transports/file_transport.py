@@ -21,7 +21,7 @@ class FileTransport(BaseTransport):
             del kwargs['timestamp']
 
         with open(self._filepath, 'a') as f:
-            for line in lines:
+            for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
                 f.write(self.format(filename, line, timestamp, **kwargs))
                 f.write('\n')
                 f.flush()
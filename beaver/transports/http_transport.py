@@ -54,7 +54,7 @@ class HttpTransport(BaseTransport):
             del kwargs['timestamp']
 
         try:
-            for line in lines:
+            for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
                 #escape any tab in the message field, assuming json payload
                 jsonline = self.format(filename, line, timestamp, **kwargs)
                 edata = jsonline.replace('\t', '\\t')
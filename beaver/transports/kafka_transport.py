@@ -55,7 +55,7 @@ class KafkaTransport(BaseTransport):
         if kwargs.get('timestamp', False):
             del kwargs['timestamp']
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             try:
                 import warnings
                 with warnings.catch_warnings():
@@ -50,7 +50,7 @@ class KinesisTransport(BaseTransport):
         message_batch = []
         message_batch_size = 0
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
 
             m = self.format(filename, line, timestamp, **kwargs)
             message_size = len(m)
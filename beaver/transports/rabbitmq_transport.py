@@ -154,7 +154,7 @@ class RabbitmqTransport(BaseTransport):
         timestamp = self.get_timestamp(**kwargs)
         if kwargs.get('timestamp', False):
             del kwargs['timestamp']
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             try:
                 import warnings
                 with warnings.catch_warnings():
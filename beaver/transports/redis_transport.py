@@ -98,7 +98,7 @@ class RedisTransport(BaseTransport):
         }
         callback_method = callback_map[data_type]
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             for namespace in namespaces:
                 callback_method(
                     namespace.strip(),
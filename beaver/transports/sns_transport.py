@@ -39,7 +39,7 @@ class SnsTransport(BaseTransport):
         if kwargs.get('timestamp', False):
             del kwargs['timestamp']
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             try:
                 self._connection.publish(self._topic_arn, self.format(filename, line, timestamp, **kwargs))
             except Exception, e:
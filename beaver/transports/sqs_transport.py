@@ -65,7 +65,7 @@ class SqsTransport(BaseTransport):
         message_batch_size = 0
         message_batch_size_max = 250000 # Max 256KiB but leave some headroom
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             if self._bulk_lines:
                	m = self.format(filename, line, timestamp, **kwargs)
                 message_size = getsizeof(m)
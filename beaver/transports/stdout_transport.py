@@ -14,5 +14,5 @@ class StdoutTransport(BaseTransport):
         if kwargs.get('timestamp', False):
             del kwargs['timestamp']
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             self._stdout.info(self.format(filename, line, timestamp, **kwargs))
@@ -25,7 +25,7 @@ class StompTransport(BaseTransport):
             del kwargs['timestamp']
         
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             try:
                 import warnings
                 with warnings.catch_warnings():
@@ -69,7 +69,7 @@ class TcpTransport(BaseTransport):
             del kwargs['timestamp']
 
         try:
-            for line in lines:
+            for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
                 self._sock.send(self.format(filename, line, timestamp, **kwargs) + "\n")
         except socket.error, e:
             self.invalidate()
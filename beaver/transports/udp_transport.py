@@ -18,5 +18,5 @@ class UdpTransport(BaseTransport):
         if kwargs.get('timestamp', False):
             del kwargs['timestamp']
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             self._sock.sendto(self.format(filename, line, timestamp, **kwargs), self._address)
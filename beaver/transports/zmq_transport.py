@@ -37,7 +37,7 @@ class ZmqTransport(BaseTransport):
         if kwargs.get('timestamp', False):
             del kwargs['timestamp']
 
-        for line in lines:
+        for line, timestamp in self.timestamped_lines(lines, timestamp, kwargs):
             self._pub.send(self.format(filename, line, timestamp, **kwargs))
 
     def interrupt(self):
@@ -14,9 +14,11 @@ import yaml
 import json
 
 import beaver
+from beaver.unicode_dammit import ENCODINGS
 
 MAGIC_BRACKETS = re.compile('({([^}]+)})')
 IS_GZIPPED_FILE = re.compile('.gz$')
+IS_COMPRESSED_FILE = re.compile(r'\.(gz|bz2|xz)$')
 REOPEN_FILES = 'linux' not in platform.platform().lower()
 CAN_DAEMONIZE = sys.platform != 'win32'
 
@@ -313,6 +315,32 @@ def _replace_all(path, replacements):
     return path
 
 
+def is_ascii_compatible(encoding):
+    """Returns whether ASCII text, delimiters included, is encoded as is by the encoding"""
+    try:
+        return u'\n\t\r az09'.encode(encoding or 'utf_8') == '\n\t\r az09'
+    except (LookupError, UnicodeError):
+        return False
+
+
+def decode_line(line, encoding):
+    """Decodes a raw line with encoding, falling back to the first of ENCODINGS
+    that decodes it, and replacing the undecodable bytes as a last resort
+    """
+    try:
+        return line.decode(encoding)
+    except UnicodeDecodeError:
+        pass
+
+    for fallback in ENCODINGS:
+        try:
+            return line.decode(fallback)
+        except UnicodeDecodeError:
+            pass
+
+    return line.decode(encoding, 'replace')
+
+
 def multiline_merge(lines, current_event, re_after, re_before):
     """ Merge multi-line events based.
 
@@ -344,3 +372,110 @@ def multiline_merge(lines, current_event, re_after, re_before):
             current_event.append(line)
 
     return events
+
+
+class MultilineMerger(object):
+    """ Block-at-a-time version of multiline_merge.
+
+        merge() takes all the lines decoded from a block and returns
+        the same events multiline_merge would, keeping the unfinished
+        event in current_event. re_before is applied to the whole block
+        in one map() call, and the result of re_after for the last line
+        of the current event is remembered, so every line is tested at
+        most once per expression, including across blocks.
+
+        A regular expression run over the joined block (finditer) is not
+        used because it cannot reproduce per-line match() results for
+        patterns able to match a newline.
+
+        max_lines and max_bytes cap the size of an event: a line that
+        would take the current event past either limit starts a new
+        event instead, so a runaway event is shipped in pieces. 0
+        disables a cap.
+    """
+
+    def __init__(self, current_event, re_after=None, re_before=None, max_lines=0, max_bytes=0):
+        self.current_event = current_event
+        self._after = re_after.match if re_after else None
+        self._before = re_before.match if re_before else None
+        self._max_lines = max_lines or 0
+        self._max_bytes = max_bytes or 0
+        self._event_bytes = 0
+        self._last_line = None
+        self._last_after = False
+
+    def merge(self, lines):
+        events = []
+        current_event = self.current_event
+        after = self._after
+        max_lines = self._max_lines
+        max_bytes = self._max_bytes
+
+        if self._before:
+            before_matches = map(self._before, lines)
+        else:
+            before_matches = [None] * len(lines)
+
+        for line, before_match in zip(lines, before_matches):
+            if not current_event:
+                self._event_bytes = 0
+
+            if before_match:
+                merge = True
+            elif after and current_event:
+                last_line = current_event[-1]
+                if last_line is not self._last_line:
+                    self._last_line = last_line
+                    self._last_after = after(last_line) is not None
+                merge = self._last_after
+            else:
+                merge = False
+
+            if merge and current_event and (
+                (max_lines and len(current_event) >= max_lines) or
+                (max_bytes and self._event_bytes + len(line) + 1 > max_bytes)
+            ):
+                merge = False
+
+            if merge:
+                if current_event:
+                    self._event_bytes += 1
+                current_event.append(line)
+                self._event_bytes += len(line)
+            else:
+                if current_event:
+                    events.append('\n'.join(current_event))
+                current_event.clear()
+                current_event.append(line)
+                self._event_bytes = len(line)
+
+        return events
+
+
+def ignoreline_filter(lines, patterns, counters):
+    """ Drop lines matching any of the ignore patterns.
+
+        Each line is tested once against the patterns, in order, and the
+        first matching pattern drops it. counters is a list parallel to
+        patterns; the counter of the matching pattern is incremented for
+        every dropped line.
+
+        This function return the list of lines that were kept.
+    """
+    if len(patterns) == 1:
+        search = patterns[0].search
+        kept = [line for line in lines if not search(line)]
+        counters[0] += len(lines) - len(kept)
+        return kept
+
+    searches = [pattern.search for pattern in patterns]
+    kept = []
+    for line in lines:
+        for index, search in enumerate(searches):
+            if search(line):
+                counters[index] += 1
+                break
+        else:
+            kept.append(line)
+
+    return kept
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+
+from beaver.utils import decode_line
+
+
+def split_ranges(filename, start, end, chunk_size, delimiter):
+    """Splits [start, end) of a file into ranges of about chunk_size bytes.
+
+    Every range but the last one ends right after a delimiter, so that no
+    line spans two ranges. The last range ends at end.
+    """
+    ranges = []
+    search_size = 64 * 1024
+    with io.open(filename, 'rb') as _file:
+        position = start
+        while end - position > chunk_size:
+            boundary = None
+            target = position + chunk_size
+            _file.seek(target, os.SEEK_SET)
+            while boundary is None and target < end:
+                # Overlap reads by the delimiter length so that a delimiter
+                # spanning two reads is still found.
+                data = _file.read(search_size)
+                if not data:
+                    break
+                index = data.find(delimiter)
+                if index != -1:
+                    boundary = target + index + len(delimiter)
+                else:
+                    target += max(len(data) - len(delimiter) + 1, 1)
+                    _file.seek(target, os.SEEK_SET)
+
+            if boundary is None or boundary >= end:
+                break
+
+            ranges.append((position, boundary))
+            position = boundary
+
+        ranges.append((position, end))
+
+    return ranges
+
+
+def read_range(filename, start, end, delimiter, encoding=None):
+    """Reads and splits the [start, end) range of a file, in a backfill process.
+
+    Returns an (offset, lines) tuple where offset is the position right after
+    the last complete line; a trailing partial line is left out. The lines are
+    kept as bytes when encoding is None.
+    """
+    with io.open(filename, 'rb') as _file:
+        _file.seek(start, os.SEEK_SET)
+        data = _file.read(end - start)
+
+    lines = data.split(delimiter)
+    partial = lines.pop()
+    offset = start + len(data) - len(partial)
+
+    if encoding:
+        lines = [decode_line(line, encoding) for line in lines]
+
+    return offset, lines
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import bz2
+import collections
+import io
+import os
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+def _gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _bz2_decompressor():
+    return bz2.BZ2Decompressor()
+
+
+def _xz_decompressor():
+    if lzma is None:
+        raise IOError('reading .xz files requires the lzma module (pip install backports.lzma)')
+
+    return lzma.LZMADecompressor()
+
+
+# Errors raised by the decompressors on corrupt data
+DECOMPRESSION_ERRORS = (zlib.error, IOError) + ((lzma.LZMAError,) if lzma is not None else ())
+
+
+class DecompressionError(IOError):
+    """Raised when the contents of a compressed file cannot be decompressed"""
+
+
+DECOMPRESSORS = {
+    '.gz': _gzip_decompressor,
+    '.bz2': _bz2_decompressor,
+    '.xz': _xz_decompressor,
+}
+
+
+def get_decompressor(filename):
+    """Returns the decompressor factory for a filename, or None if it is not compressed"""
+    return DECOMPRESSORS.get(os.path.splitext(filename)[1])
+
+
+class DecompressingReader(object):
+    """Read-only file object streaming the decompressed contents of a file
+
+    The compressed file is read buffer_size bytes at a time. Files made of
+    several gzip members or bz2/xz streams (as written by pigz, bgzip, pbzip2
+    or xz -T) are read through, and the start of every member is recorded as a
+    checkpoint: a (compressed offset, decompressed offset) pair from which
+    decompression can restart. Positions returned by tell() are offsets in the
+    decompressed data.
+    """
+
+    def __init__(self, filename, decompressor=None, buffer_size=1024 * 1024):
+        self._new_decompressor = decompressor or get_decompressor(filename)
+        self._buffer_size = buffer_size
+        self._file = io.open(filename, 'rb')
+        self._checkpoints = collections.deque([(0, 0)])
+        self._restart(0, 0)
+
+    def _restart(self, compressed_offset, offset):
+        self._file.seek(compressed_offset, os.SEEK_SET)
+        self._compressed_offset = compressed_offset
+        self._decompressor = self._new_decompressor()
+        self._buffer = ''
+        self._buffer_position = 0
+        self._offset = offset
+
+    def _start_member(self, compressed_offset, offset):
+        self._decompressor = self._new_decompressor()
+        if not self._checkpoints or self._checkpoints[-1][1] < offset:
+            self._checkpoints.append((compressed_offset, offset))
+
+    def _fill(self):
+        """Decompresses the next block of the file into the buffer.
+        Returns False at the end of the file, raises DecompressionError
+        on corrupt data.
+        """
+        data = self._file.read(self._buffer_size)
+        if not data:
+            return False
+
+        self._compressed_offset += len(data)
+        produced = len(self._buffer) - self._buffer_position
+        output = [self._buffer[self._buffer_position:]]
+        while data:
+            try:
+                chunk = self._decompressor.decompress(data)
+            except EOFError:
+                # The previous member ended exactly at the end of the last block
+                self._start_member(self._compressed_offset - len(data), self._offset + produced)
+                continue
+            except DECOMPRESSION_ERRORS, e:
+                raise DecompressionError('corrupt compressed data before byte {0}: {1}'.format(
+                    self._compressed_offset, e))
+
+            output.append(chunk)
+            produced += len(chunk)
+            data = self._decompressor.unused_data
+            if data:
+                self._start_member(self._compressed_offset - len(data), self._offset + produced)
+
+        self._buffer = ''.join(output)
+        self._buffer_position = 0
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) - self._buffer_position < size:
+            if not self._fill():
+                break
+
+        if size < 0:
+            size = len(self._buffer) - self._buffer_position
+
+        data = self._buffer[self._buffer_position:self._buffer_position + size]
+        self._buffer_position += len(data)
+        self._offset += len(data)
+        return data
+
+    def readline(self):
+        while True:
+            end = self._buffer.find('\n', self._buffer_position)
+            if end != -1:
+                return self.read(end + 1 - self._buffer_position)
+            if not self._fill():
+                return self.read()
+
+    def tell(self):
+        return self._offset
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._offset
+        elif whence == os.SEEK_END:
+            while self.read(self._buffer_size):
+                pass
+            offset += self._offset
+
+        if offset < self._offset:
+            compressed_offset, start = max([c for c in self._checkpoints if c[1] <= offset] or [(0, 0)])
+            self._restart(compressed_offset, start)
+
+        while self._offset < offset and self.read(min(offset - self._offset, self._buffer_size)):
+            pass
+
+        return self._offset
+
+    def checkpoint(self, offset=None):
+        """Returns the "<compressed offset>:<offset>" of the last member starting
+        at or before offset, the current position by default
+        """
+        if offset is None:
+            offset = self._offset
+
+        while len(self._checkpoints) > 1 and self._checkpoints[1][1] <= offset:
+            self._checkpoints.popleft()
+
+        compressed_offset, start = self._checkpoints[0]
+        if start > offset:
+            return None
+
+        return '{0}:{1}'.format(compressed_offset, start)
+
+    def restore(self, checkpoint):
+        """Restarts decompression at a checkpoint returned by checkpoint().
+        Returns False if the checkpoint is not usable.
+        """
+        try:
+            compressed_offset, offset = [int(value) for value in checkpoint.split(':', 1)]
+        except (AttributeError, ValueError):
+            return False
+
+        if compressed_offset > os.fstat(self._file.fileno()).st_size:
+            return False
+
+        self._checkpoints = collections.deque([(0, 0)])
+        if offset:
+            self._checkpoints.append((compressed_offset, offset))
+        self._restart(compressed_offset, offset)
+        return True
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
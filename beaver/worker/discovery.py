@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import re
+import stat
+import time
+
+from beaver.utils import expand_paths
+
+MAGIC_CHARACTERS = re.compile('[*?[]')
+
+# A directory modified this recently is listed again on the next pass, as
+# entries added within the same mtime tick would not change its mtime.
+MTIME_SETTLE_SECONDS = 2
+
+
+def _translate_segment(segment):
+    """Translates one path segment of a glob to a regular expression"""
+    i, n = 0, len(segment)
+    result = []
+    if MAGIC_CHARACTERS.match(segment):
+        # Like glob, wildcards do not match a leading dot
+        result.append(r'(?!\.)')
+
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            result.append('[^/]*')
+        elif c == '?':
+            result.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and segment[j] in '!^':
+                j += 1
+            if j < n and segment[j] == ']':
+                j += 1
+            while j < n and segment[j] != ']':
+                j += 1
+            if j >= n:
+                result.append(r'\[')
+            else:
+                chars = segment[i:j].replace('\\', r'\\')
+                if chars[0] in '!^':
+                    chars = '^' + chars[1:]
+                result.append('[{0}]'.format(chars))
+                i = j + 1
+        else:
+            result.append(re.escape(c))
+
+    return ''.join(result)
+
+
+def compile_glob(pattern):
+    """Returns (root, file regex, directory regex) for an absolute glob pattern.
+
+    root is the longest leading directory without wildcards. The file regex
+    matches the paths the glob matches, with glob2 semantics for "**" (zero
+    or more directories). The directory regex matches the directories under
+    root that may contain matches, so that other directories are not walked.
+    """
+    segments = pattern.split('/')
+    static = []
+    for segment in segments[:-1]:
+        if MAGIC_CHARACTERS.search(segment):
+            break
+        static.append(segment)
+    root = '/'.join(static) or '/'
+    magic = segments[len(static):]
+
+    file_regex = re.escape(root.rstrip('/'))
+    for segment in magic:
+        if segment == '**':
+            file_regex += r'(?:/(?!\.)[^/]*)*'
+        else:
+            file_regex += '/' + _translate_segment(segment)
+
+    directory_regex = ''
+    for segment in reversed(magic[:-1]):
+        if segment == '**':
+            directory_regex = '(?:/.*)?'
+        else:
+            directory_regex = '(?:/{0}{1})?'.format(_translate_segment(segment), directory_regex)
+    directory_regex = re.escape(root.rstrip('/')) + directory_regex
+
+    return root, file_regex, directory_regex
+
+
+def glob_matches(path, globs):
+    """Returns True if path is matched, and not excluded, by one of globs,
+    a {glob: exclude} dict
+    """
+    for name, exclude in globs.items():
+        for pattern in expand_paths(name) or []:
+            file_regex = compile_glob(os.path.abspath(pattern))[1]
+            if re.match('(?:{0})$'.format(file_regex), path) and not (exclude and re.search(exclude, path)):
+                return True
+
+    return False
+
+
+class GlobDiscovery(object):
+    """Finds the files matching a set of globs, relisting only the directories
+    whose mtime changed since the previous pass
+
+    All globs are compiled into a single file matcher and a single directory
+    matcher. Each pass stats the directories that may contain matches, but
+    only lists the ones that changed, so its cost grows with the number of
+    changed directories rather than with the number of files.
+    """
+
+    def __init__(self, globs):
+        self._globs = []
+        roots = set()
+        file_regexes = []
+        directory_regexes = []
+        for name, exclude in globs.items():
+            regexes = []
+            for pattern in expand_paths(name) or []:
+                root, file_regex, directory_regex = compile_glob(os.path.abspath(pattern))
+                roots.add(root)
+                regexes.append(file_regex)
+                file_regexes.append(file_regex)
+                directory_regexes.append(directory_regex)
+            self._globs.append((name, re.compile('(?:{0})$'.format('|'.join(regexes))),
+                                re.compile(exclude) if exclude else None))
+
+        self._file_matcher = re.compile('(?:{0})$'.format('|'.join(file_regexes)))
+        self._directory_matcher = re.compile('(?:{0})$'.format('|'.join(directory_regexes)))
+        self._roots = sorted(roots)
+        self._directories = {}
+
+    def discover(self, full=False):
+        """Returns a {glob: [paths]} dict of the matches found in the directories
+        that changed since the last pass, or of all matches if full is set
+        """
+        now = time.time()
+        found = []
+        directories = {}
+        visited = set()
+        stack = list(self._roots)
+        while stack:
+            directory = stack.pop()
+            try:
+                st = os.stat(directory)
+            except EnvironmentError, err:
+                if err.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    raise
+                continue
+
+            if (st.st_dev, st.st_ino) in visited or not stat.S_ISDIR(st.st_mode):
+                continue
+            visited.add((st.st_dev, st.st_ino))
+
+            key = (st.st_mtime, st.st_ino)
+            cached = self._directories.get(directory)
+            if cached and cached[0] == key and now - st.st_mtime > MTIME_SETTLE_SECONDS:
+                subdirectories, files = cached[1], cached[2]
+                if full:
+                    found.extend(files)
+            else:
+                subdirectories, files = self._list(directory)
+                found.extend(files)
+
+            directories[directory] = (key, subdirectories, files)
+            stack.extend(subdirectories)
+
+        self._directories = directories
+        return self._match(found)
+
+    def matches(self):
+        """Returns a {glob: [paths]} dict of all matches of the last pass, without
+        touching the filesystem
+        """
+        found = []
+        for key, subdirectories, files in self._directories.values():
+            found.extend(files)
+        return self._match(found)
+
+    def _match(self, found):
+        """Returns a {glob: [paths]} dict of the paths each glob matches"""
+        matches = {}
+        for name, regex, exclude in self._globs:
+            matches[name] = [path for path in found
+                             if regex.match(path) and not (exclude and exclude.search(path))]
+
+        return matches
+
+    def _list(self, directory):
+        """Returns the subdirectories that may hold matches, and the matching paths, of a directory"""
+        subdirectories = []
+        files = []
+        try:
+            names = os.listdir(directory)
+        except EnvironmentError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                raise
+            return subdirectories, files
+
+        prefix = directory.rstrip('/') + '/'
+        for name in names:
+            path = prefix + name
+            if self._file_matcher.match(path):
+                files.append(path)
+            if self._directory_matcher.match(path) and os.path.isdir(path):
+                subdirectories.append(path)
+
+        return subdirectories, files
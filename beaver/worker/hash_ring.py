@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import bisect
+import hashlib
+
+
+def _hash(key):
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys to shards
+
+    Every shard is placed replicas times on the ring. A key belongs to the
+    first alive shard found clockwise from its hash, so when a shard dies
+    only its keys move, and they move back when it comes back.
+    """
+
+    def __init__(self, shards, replicas=64):
+        self._points = sorted((_hash('{0}:{1}'.format(shard, replica)), shard)
+                              for shard in range(shards) for replica in range(replicas))
+        self._hashes = [point for point, _ in self._points]
+
+    def get(self, key, alive=None):
+        """Returns the shard owning key among the alive shards, all of them by default"""
+        if alive is not None and not alive:
+            return None
+
+        index = bisect.bisect(self._hashes, _hash(key))
+        for offset in range(len(self._points)):
+            shard = self._points[(index + offset) % len(self._points)][1]
+            if alive is None or shard in alive:
+                return shard
+
+        return None
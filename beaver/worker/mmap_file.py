@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import io
+import mmap
+import os
+
+
+class MmapFile(object):
+    """Read-only memory map over a growing log file
+
+    Exposes the subset of the file API used by Tail (read, readline, seek,
+    tell, fileno, close) plus readlines(delimiter), which scans the mapped
+    bytes for the delimiter and returns each complete line as a single slice
+    of the map. Partial lines stay in the map until their delimiter arrives,
+    so there is no intermediate buffer to split and re-join.
+
+    The map is refreshed against fstat() before every read: it is re-created
+    when the file grew and dropped when the file shrank, leaving the
+    truncation and rotation decisions to Tail._ensure_file_is_good.
+    """
+
+    def __init__(self, filename):
+        self.name = filename
+        self._file = io.open(filename, 'rb')
+        self._map = None
+        self._size = 0
+        self._position = 0
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def size(self):
+        return self._size
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            self._refresh()
+            offset += self._size
+        self._position = max(offset, 0)
+        return self._position
+
+    def read(self, size=-1):
+        self._refresh()
+        end = self._size
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        if self._map is None or self._position >= end:
+            return b''
+
+        data = self._map[self._position:end]
+        self._position = end
+        return data
+
+    def readline(self):
+        self._refresh()
+        if self._map is None or self._position >= self._size:
+            return b''
+
+        index = self._map.find(b'\n', self._position, self._size)
+        end = self._size if index == -1 else index + 1
+        data = self._map[self._position:end]
+        self._position = end
+        return data
+
+    def readlines(self, delimiter, limit=None):
+        """Returns every complete, delimiter-terminated line after the
+        current position and advances past the last delimiter found.
+
+        If limit is given, scanning stops once that many bytes were consumed.
+        """
+        self._refresh()
+        if self._map is None or self._position >= self._size:
+            return []
+
+        find = self._map.find
+        mapped = self._map
+        position = self._position
+        end = self._size
+        if limit:
+            stop = min(end, position + limit)
+        else:
+            stop = end
+        step = len(delimiter)
+
+        lines = []
+        append = lines.append
+        while position < stop:
+            index = find(delimiter, position, end)
+            if index == -1:
+                break
+            append(mapped[position:index])
+            position = index + step
+
+        self._position = position
+        return lines
+
+    def _refresh(self):
+        """Remaps the file if its size changed since the last read"""
+        if self._file is None:
+            return
+
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._size and self._map is not None:
+            return
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        self._size = size
+        if size > 0:
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import time
+
+
+class TailScheduler(object):
+    """Heap of tails ordered by the time they are next due to run
+
+    A tail that read data is due again after min_interval, or right away if
+    it still has data to process. Each pass without data doubles its
+    interval, up to max_interval. Popping the due tails only touches those
+    tails, so the cost of an iteration depends on the number of active
+    files, not on the total number of files.
+    """
+
+    def __init__(self, min_interval=0.1, max_interval=2.0):
+        self._min_interval = min_interval
+        self._max_interval = max(max_interval, min_interval)
+        self._heap = []
+        self._counter = itertools.count()
+        self._entries = {}
+        self._intervals = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, due=None):
+        """Schedules key at due, now by default, replacing any previous schedule"""
+        if due is None:
+            due = time.time()
+
+        seq = next(self._counter)
+        self._entries[key] = seq
+        self._intervals.setdefault(key, self._min_interval)
+        heapq.heappush(self._heap, (due, seq, key))
+
+    def done(self, key, active, pending=False, now=None, deadline=None):
+        """Reschedules key after a run, backing off while it stays idle,
+        but no later than deadline
+        """
+        now = now or time.time()
+        if active or pending:
+            interval = self._min_interval
+        else:
+            interval = min(self._intervals.get(key, self._min_interval) * 2, self._max_interval)
+
+        self._intervals[key] = interval
+        due = now if pending else now + interval
+        if deadline is not None:
+            due = min(due, deadline)
+        self.schedule(key, due)
+
+    def remove(self, key):
+        # The heap entry is skipped when it is popped.
+        self._entries.pop(key, None)
+        self._intervals.pop(key, None)
+
+    def pop_due(self, now=None):
+        """Removes and returns the keys due at now, earliest first"""
+        now = now or time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            if self._entries.get(key) == seq:
+                del self._entries[key]
+                due.append(key)
+
+        return due
+
+    def next_due(self):
+        """Returns the time the next key is due, or None if nothing is scheduled"""
+        while self._heap and self._entries.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+        if not self._heap:
+            return None
+
+        return self._heap[0][0]
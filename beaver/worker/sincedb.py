@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import collections
+import sqlite3
+import threading
+import time
+
+from beaver.base_log import BaseLog
+
+
+class SincedbStore(BaseLog):
+    """Single long-lived connection to the sincedb sqlite database
+
+    The database is opened in WAL mode. Position updates and removals are
+    kept in memory and written in a single transaction at most once per
+    flush_interval seconds; a flush_interval of 0 writes every change
+    through immediately. All rows are loaded with one query by load(), so
+    looking up start positions does not hit the database once per file.
+    A store can be shared by the threads starting tails.
+    """
+
+    def __init__(self, path, flush_interval=0, logger=None):
+        super(SincedbStore, self).__init__(logger=logger)
+        self._log_template = '[sincedb] - {0}'
+        self._path = path
+        self._flush_interval = flush_interval or 0
+        self._conn = None
+        self._entries = {}
+        self._last_flush = time.time()
+        self._pending = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, isolation_level=None, check_same_thread=False)
+            self._conn.execute('pragma journal_mode=wal')
+            self._init_schema()
+
+        return self._conn
+
+    def _init_schema(self):
+        """Creates the sincedb table, or adds the columns missing from older versions"""
+        conn = self._conn
+        if not conn.execute("select name from sqlite_master where type = 'table' and name = 'sincedb'").fetchall():
+            self._log_debug('initializing sincedb sqlite schema')
+            # Several producer processes may create the table at the same time.
+            conn.execute("""
+            create table if not exists sincedb (
+                fid         text primary key,
+                filename    text,
+                position    integer default 1,
+                byte_offset integer,
+                fingerprint text,
+                checkpoint  text
+            );
+            """)
+            return
+
+        columns = [row[1] for row in conn.execute('pragma table_info(sincedb)')]
+        for column, column_type in [('byte_offset', 'integer'), ('fingerprint', 'text'), ('checkpoint', 'text')]:
+            if column not in columns:
+                self._log_debug('adding {0} column to sincedb'.format(column))
+                try:
+                    conn.execute('alter table sincedb add column {0} {1}'.format(column, column_type))
+                except sqlite3.OperationalError, e:
+                    if 'duplicate column' not in str(e):
+                        raise
+
+    def load(self):
+        """Reads every entry into memory, for bulk lookups at startup"""
+        with self._lock:
+            self._entries = {}
+            cursor = self._connection().execute(
+                'select fid, filename, position, byte_offset, fingerprint, checkpoint from sincedb')
+            for fid, filename, position, offset, fingerprint, checkpoint in cursor:
+                self._entries[(fid, filename)] = (position, offset, fingerprint, checkpoint)
+
+            self._log_debug('loaded {0} entries'.format(len(self._entries)))
+
+    def get(self, fid, filename):
+        """Returns the (position, byte_offset, fingerprint, checkpoint) entry for a file, or None"""
+        with self._lock:
+            key = (fid, filename)
+            if key in self._pending:
+                return self._pending[key]
+
+            if key in self._entries:
+                return self._entries[key]
+
+            cursor = self._connection().execute(
+                'select position, byte_offset, fingerprint, checkpoint from sincedb where fid = :fid and filename = :filename', {
+                    'fid': fid,
+                    'filename': filename
+                })
+
+            entry = None
+            for row in cursor.fetchall():
+                entry = row
+
+            return entry
+
+    def update(self, fid, filename, position, offset, fingerprint, checkpoint=None):
+        with self._lock:
+            key = (fid, filename)
+            self._pending.pop(key, None)
+            self._pending[key] = (position, offset, fingerprint, checkpoint)
+            self.flush_if_due()
+
+    def remove(self, fid, filename):
+        with self._lock:
+            key = (fid, filename)
+            self._entries.pop(key, None)
+            self._pending.pop(key, None)
+            self._pending[key] = None
+            self.flush_if_due()
+
+    def flush_if_due(self, current_time=None):
+        current_time = current_time or time.time()
+        if current_time - self._last_flush < self._flush_interval:
+            return False
+
+        return self.flush(current_time=current_time)
+
+    def flush(self, current_time=None):
+        """Writes all pending changes in a single transaction"""
+        with self._lock:
+            self._last_flush = current_time or time.time()
+            if not self._pending:
+                return False
+
+            updates = []
+            removals = []
+            for (fid, filename), entry in self._pending.items():
+                if entry is None:
+                    removals.append({'fid': fid, 'filename': filename})
+                else:
+                    position, offset, fingerprint, checkpoint = entry
+                    updates.append({
+                        'fid': fid,
+                        'filename': filename,
+                        'position': position,
+                        'offset': offset,
+                        'fingerprint': fingerprint,
+                        'checkpoint': checkpoint,
+                    })
+
+            conn = self._connection()
+            conn.execute('begin')
+            try:
+                conn.executemany('delete from sincedb where fid = :fid and filename = :filename', removals)
+                conn.executemany('insert or replace into sincedb (fid, filename, position, byte_offset, fingerprint, checkpoint) '
+                                 'values (:fid, :filename, :position, :offset, :fingerprint, :checkpoint)', updates)
+            except sqlite3.Error:
+                conn.execute('rollback')
+                raise
+            conn.execute('commit')
+
+            for key, entry in self._pending.items():
+                if entry is not None:
+                    self._entries[key] = entry
+            self._pending.clear()
+
+            self._log_debug('flushed {0} updates and {1} removals'.format(len(updates), len(removals)))
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+
+            self.flush()
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import Queue
+import struct
+import threading
+import time
+
+from beaver.base_log import BaseLog
+from beaver.ring_queue import dumps, loads
+
+_HEADER = struct.Struct('=I')
+
+SEGMENT_PREFIX = 'spill-'
+
+
+class SpillQueue(BaseLog):
+    """Overflow stage between a producer and the interprocess queue
+
+    While the queue is filled below the high water mark, items are put in
+    it right away. Past the mark, or when the queue is full, items are
+    appended to segment files in path instead, so that files keep being
+    read while the consumers are behind. Once anything is spilled, every
+    item is spilled until the spill files are replayed, so items reach the
+    queue in order.
+
+    replay moves spilled items back to the queue, oldest first, while it is
+    below the high water mark. Segments are deleted once they are replayed,
+    and segments left by a previous run are replayed first. The offset in
+    the segment being replayed is not saved: after a crash, the items of
+    that segment are replayed again.
+
+    When the spill files reach max_bytes, put waits for the queue to take
+    spilled items, as it would wait for a full queue without spilling.
+
+    put and replay may be called from several threads, such as the threads
+    starting tails with tail_init_threads.
+    """
+
+    def __init__(self, path, put, queue_size=None, max_queue_size=0, high_water=0.9, max_bytes=0,
+                 segment_size=16777216, logger=None):
+        super(SpillQueue, self).__init__(logger=logger)
+        self._log_template = '[SpillQueue] - {0}'
+        self._path = path
+        self._put = put
+        self._queue_size = queue_size
+        self._high_water = max_queue_size * high_water if max_queue_size else 0
+        self._max_bytes = max_bytes
+        self._segment_size = segment_size
+        self._lock = threading.Lock()
+
+        # Numbers of the segments on disk, oldest first. Items are appended to
+        # the last one and replayed from the first one, at _read_offset.
+        self._segments = []
+        self._writer = None
+        self._reader = None
+        self._read_offset = 0
+        # Item read from the spill files that the queue had no room for yet
+        self._next = None
+
+        self._bytes = 0
+        self.spilled_bytes = 0
+        self.replayed_bytes = 0
+
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        for name in os.listdir(path):
+            if name.startswith(SEGMENT_PREFIX) and name[len(SEGMENT_PREFIX):].isdigit():
+                self._segments.append(int(name[len(SEGMENT_PREFIX):]))
+                self._bytes += os.path.getsize(self._segment_path(self._segments[-1]))
+        self._segments.sort()
+
+        if self._segments:
+            self._log_info('replaying {0} bytes spilled to {1} by a previous run'.format(self._bytes, path))
+
+    def __len__(self):
+        """Returns the number of bytes in the spill files"""
+        return self._bytes
+
+    def put(self, item):
+        """Puts item in the queue, or appends it to the spill files"""
+        with self._lock:
+            self._put_or_spill(item)
+
+    def replay(self):
+        """Moves spilled items to the queue while it is below the high water
+        mark. Returns the number of items moved
+        """
+        with self._lock:
+            return self._replay()
+
+    def close(self):
+        """Closes the spill files, leaving the items not replayed yet for the next run"""
+        with self._lock:
+            for handle in (self._writer, self._reader):
+                if handle is not None:
+                    handle.close()
+            self._writer = self._reader = None
+
+    def _put_or_spill(self, item):
+        if not self._segments and not self._above_high_water():
+            try:
+                self._put(item, False)
+                return
+            except Queue.Full:
+                pass
+
+        record = dumps(item)
+        while self._max_bytes and self._bytes + _HEADER.size + len(record) > self._max_bytes:
+            if not self._segments:
+                # The item alone does not fit in the spill files
+                self._put(item)
+                return
+
+            if not self._replay():
+                time.sleep(0.1)
+
+        self._append(record)
+
+    def _replay(self):
+        count = 0
+        while self._segments and not self._above_high_water():
+            if self._next is None:
+                self._next = self._read()
+                if self._next is None:
+                    continue
+
+            try:
+                self._put(self._next[0], False)
+            except Queue.Full:
+                break
+
+            self.replayed_bytes += self._next[1]
+            self._next = None
+            count += 1
+
+        return count
+
+    def _above_high_water(self):
+        if not self._queue_size or not self._high_water:
+            return False
+
+        try:
+            return self._queue_size() >= self._high_water
+        except NotImplementedError:
+            # qsize() is not available on every platform
+            self._queue_size = None
+            return False
+
+    def _segment_path(self, number):
+        return os.path.join(self._path, '{0}{1:010d}'.format(SEGMENT_PREFIX, number))
+
+    def _append(self, record):
+        if self._writer is not None and self._writer.tell() >= self._segment_size:
+            self._writer.close()
+            self._writer = None
+
+        if self._writer is None:
+            if not self._segments:
+                self._log_info('queue above its high water mark, spilling to {0}'.format(self._path))
+            number = self._segments[-1] + 1 if self._segments else 0
+            self._segments.append(number)
+            self._writer = open(self._segment_path(number), 'ab')
+
+        self._writer.write(_HEADER.pack(len(record)))
+        self._writer.write(record)
+        self._writer.flush()
+        self._bytes += _HEADER.size + len(record)
+        self.spilled_bytes += _HEADER.size + len(record)
+
+    def _read(self):
+        """Returns the next spilled (item, size), or None when the first
+        segment is replayed, which is then deleted
+        """
+        if self._reader is None:
+            self._reader = open(self._segment_path(self._segments[0]), 'rb')
+            self._read_offset = 0
+
+        self._reader.seek(self._read_offset)
+        header = self._reader.read(_HEADER.size)
+        if len(header) == _HEADER.size:
+            length, = _HEADER.unpack(header)
+            record = self._reader.read(length)
+            if len(record) == length:
+                self._read_offset += _HEADER.size + length
+                return loads(record), _HEADER.size + length
+
+        # End of the segment: a partial record is the tail of an interrupted write.
+        self._reader.close()
+        self._reader = None
+        if len(self._segments) == 1 and self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+        path = self._segment_path(self._segments.pop(0))
+        self._bytes -= os.path.getsize(path)
+        os.unlink(path)
+        if not self._segments:
+            self._log_info('replayed all spilled items, {0} bytes in all'.format(self.replayed_bytes))
+        return None
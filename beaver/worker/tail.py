@@ -2,22 +2,35 @@
 import collections
 import datetime
 import errno
-import gzip
+import hashlib
 import io
 import os
-import sqlite3
 import time
 
-from beaver.utils import IS_GZIPPED_FILE, REOPEN_FILES, multiline_merge
-from beaver.unicode_dammit import ENCODINGS
+from beaver.utils import IS_COMPRESSED_FILE, REOPEN_FILES, MultilineMerger, decode_line, ignoreline_filter, is_ascii_compatible
 from beaver.base_log import BaseLog
+from beaver.worker.backfill import read_range, split_ranges
+from beaver.worker.decompressors import DecompressingReader, DecompressionError
+from beaver.worker.discovery import glob_matches
+from beaver.worker.mmap_file import MmapFile
+from beaver.worker.sincedb import SincedbStore
+
+
+# Number of leading bytes hashed to recognise a file across restarts
+FINGERPRINT_SIZE = 1024
+
+
+def fingerprint(data):
+    """Returns the "<length>:<sha1>" fingerprint of the first bytes of a file"""
+    return '{0}:{1}'.format(len(data), hashlib.sha1(data).hexdigest())
 
 
 class Tail(BaseLog):
     """Follows a single file and outputs new lines from it to a callback
     """
 
-    def __init__(self, filename, callback, position="end", logger=None, beaver_config=None, file_config=None):
+    def __init__(self, filename, callback, position="end", logger=None, beaver_config=None, file_config=None, sincedb=None,
+                 backfill_pool=None, stat_sweep=False):
         super(Tail, self).__init__(logger=logger)
 
         self.active = False
@@ -25,13 +38,28 @@ class Tail(BaseLog):
         self._fid = None
         self._file = None
         self._filename = filename
+        # Position of the closed handle of a suspended file, None while it is open
+        self._suspended_position = None
+        # Time the file was found rotated, while the old file is read to its end,
+        # and the name it was renamed to, under which its position is saved
+        self._rotated_at = None
+        self._rotated_name = None
+        self._fingerprint = None
         self._last_sincedb_write = None
         self._last_file_mapping_update = None
         self._line_count = 0
         self._line_count_sincedb = 0
+        self._offset = 0
+        self._offset_sincedb = None
         self._log_template = '[' + self._filename + '] - {0}'
+        # With stat_sweep, the owner stats the path in its sweeps and hands the
+        # result to check_path(), and the periodic checks only fstat the handle.
+        self._stat_sweep = stat_sweep
 
         self._sincedb_path = beaver_config.get('sincedb_path')
+        self._sincedb = sincedb
+        if self._sincedb is None and self._sincedb_path:
+            self._sincedb = SincedbStore(self._sincedb_path, logger=logger)
 
         self._debug = beaver_config.get_field('debug', filename)  # TODO: Implement me
         self._encoding = beaver_config.get_field('encoding', filename)
@@ -43,15 +71,61 @@ class Tail(BaseLog):
         self._sincedb_write_interval = beaver_config.get_field('sincedb_write_interval', filename)
         self._start_position = beaver_config.get_field('start_position', filename)
         self._stat_interval = beaver_config.get_field('stat_interval', filename)
+        self._rotation_drain_timeout = beaver_config.get('rotation_drain_timeout', default=0)
+        self._globs = beaver_config.get('globs') or {}
+        self._folder = beaver_config.get('path')
         self._tail_lines = beaver_config.get_field('tail_lines', filename)
         self._tags = beaver_config.get_field('tags', filename)
         self._type = beaver_config.get_field('type', filename)
+        # Files are split as bytes and positions are byte offsets, unless the
+        # encoding cannot be split on an ASCII delimiter (utf-16, utf-32...),
+        # in which case they are read as text and positions are line counts.
+        # Compressed files are read through a streaming decompressor, and
+        # positions are offsets in the decompressed data. A file with corrupt
+        # compressed data is closed when it is met.
+        self._compressed = bool(IS_COMPRESSED_FILE.search(filename))
+        self._corrupt = False
+        self._decompress_buffer_size = beaver_config.get('decompress_buffer_size')
+        self._text_mode = not self._compressed and not is_ascii_compatible(self._encoding)
+        self._binary_pipeline = beaver_config.get('binary_pipeline') and not self._text_mode
+        self._use_mmap = beaver_config.get_field('use_mmap', filename) and not self._compressed \
+            and not self._text_mode
+        if self._text_mode:
+            self._offset = None
 
         self._file_read_blocksize = beaver_config.get('file_read_blocksize', default=4096)
+        self._file_read_max_blocksize = max(beaver_config.get('file_read_max_blocksize', default=0) or 0,
+                                            self._file_read_blocksize)
+        self._file_read_pass_budget = beaver_config.get('file_read_pass_budget', default=0)
+        self._weight = max(beaver_config.get_field('weight', filename) or 1, 1)
+
+        # The read size doubles while reads return full blocks, and halves
+        # when they come back less than half full.
+        self._read_size = self._file_read_blocksize
+        self._bytes_read = 0
+        self._reads = 0
+        self._budget_exhausted = 0
+        self._drained = True
+        self._last_pass_bytes = 0
+
+        # Ranges of a large unread file are read by the backfill pool, at most
+        # backfill_processes at a time, and shipped in file order.
+        self._backfill_pool = backfill_pool
+        self._backfill_processes = beaver_config.get('backfill_processes')
+        self._backfill_min_size = beaver_config.get('backfill_min_size')
+        self._backfill_chunk_size = beaver_config.get('backfill_chunk_size')
+        self._backfill_ranges = collections.deque([])
+        self._backfill_results = collections.deque([])
 
         self._buffered_lines_max_lines = beaver_config.get('buffered_lines_max_lines', default=0)
         self._buffered_lines_max_bytes = beaver_config.get('buffered_lines_max_bytes', default=0)
         self._buffered_lines_max_seconds = beaver_config.get('buffered_lines_max_seconds', default=0)
+        # Events read but not shipped yet. A partial batch is held across passes
+        # until it is full, or until buffered_lines_max_seconds after its first
+        # event, see batch_deadline().
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_start = None
 
         # The following is for the buffered tokenization
         # Store the specified delimiter
@@ -73,9 +147,20 @@ class Tail(BaseLog):
         self._last_activity = time.time()
         self._multiline_regex_after = beaver_config.get_field('multiline_regex_after', filename)
         self._multiline_regex_before = beaver_config.get_field('multiline_regex_before', filename)
+        self._multiline = None
+        if self._multiline_regex_after or self._multiline_regex_before:
+            self._multiline = MultilineMerger(
+                self._current_event,
+                re_after=self._multiline_regex_after,
+                re_before=self._multiline_regex_before,
+                max_lines=beaver_config.get_field('multiline_max_lines', filename),
+                max_bytes=beaver_config.get_field('multiline_max_bytes', filename))
 
         # Attribute for ignore-line events
-        self._ignoreline_regex = beaver_config.get_field('ignoreline_regex', filename)
+        ignoreline_regex = beaver_config.get_field('ignoreline_regex', filename)
+        self._ignoreline_regex = ([ignoreline_regex] if ignoreline_regex else []) + \
+            list(beaver_config.get_field('ignoreline_regexes', filename) or [])
+        self._ignoreline_dropped = [0] * len(self._ignoreline_regex)
 
 	# Size of the input buffer
         self._wait_before_send = beaver_config.get('wait_before_send', 0.1)
@@ -92,15 +177,16 @@ class Tail(BaseLog):
     def open(self, encoding=None):
         """Opens the file with the appropriate call"""
         try:
-            if IS_GZIPPED_FILE.search(self._filename):
-                _file = gzip.open(self._filename, 'rb')
+            if self._compressed:
+                _file = DecompressingReader(self._filename, buffer_size=self._decompress_buffer_size)
+            elif self._use_mmap:
+                _file = MmapFile(self._filename)
+            elif self._text_mode:
+                _file = io.open(self._filename, 'r', encoding=encoding or self._encoding, errors='replace')
             else:
-                if encoding:
-                    _file = io.open(self._filename, 'r', encoding=encoding, errors='replace')
-                elif self._encoding:
-                    _file = io.open(self._filename, 'r', encoding=self._encoding, errors='replace')
-                else:
-                    _file = io.open(self._filename, 'r', errors='replace')
+                # Lines are decoded after splitting, so that file positions
+                # stay byte offsets that can be stored in the sincedb.
+                _file = io.open(self._filename, 'rb')
         except IOError, e:
             self._log_warning(str(e))
             _file = None
@@ -114,34 +200,43 @@ class Tail(BaseLog):
             return
 
         self.active = False
+        self._suspended_position = None
+        self._rotated_at = None
+        self._backfill_ranges.clear()
+        self._backfill_results.clear()
+        if self._batch:
+            self._flush_batch()
         if self._file:
             self._file.close()
             self._sincedb_update_position(force_update=True)
 
         if remove_db_entry:
             self._sincedb_remove_entry()
+        self._rotated_name = None
 
         if self._current_event:
             event = '\n'.join(self._current_event)
 
             self._current_event.clear()
-            if self._ignoreline_regex:
-                # Ignoreline is enabled for this file.
-                self._log_debug("################ Ignore line regex is enabled")
-                if self._ignoreline_regex and self._ignoreline_regex.search(event):
-                    self._log_debug("ignore this line: "+event)
-                else:
-                    self._callback_wrapper([event])
-            else:
-                self._callback_wrapper([event])
+            events = self._filter_events([event])
+            if events:
+                self._callback_wrapper(events)
 
 
-    def run(self, once=False):
+    def run(self, once=False, force_check=False, budget=None):
+        """Tails the file until it is closed, or for a single pass with once.
+        budget overrides file_read_pass_budget for these passes.
+        Returns True if the last pass read any lines
+        """
+        if self._suspended_position is not None and not self._resume_if_changed():
+            self._last_pass_bytes = 0
+            return False
+
         while self.active:
             current_time = time.time()
-            self._run_pass()
+            self._run_pass(budget=budget)
 
-            self._ensure_file_is_good(current_time=current_time)
+            self._ensure_file_is_good(current_time=current_time, force=force_check)
 
             self._log_debug('Iteration took {0:.6f}'.format(time.time() - current_time))
             if once:
@@ -150,9 +245,105 @@ class Tail(BaseLog):
         if not once:
             self._log_debug('file closed')
 
+        return self._last_pass_bytes > 0
+
     def fid(self):
         return self._fid
 
+    def filename(self):
+        return self._filename
+
+    def is_open(self):
+        """Returns True if the file handle is open"""
+        return self._file is not None
+
+    def last_activity(self):
+        return self._last_activity
+
+    def suspend(self):
+        """Closes the handle of an idle file, keeping its fid and position so that
+        resume() can carry on where it stopped. Returns True if the file was suspended
+        """
+        if not self.active or not self._file or self._compressed or self._text_mode or self.pending() or \
+                self._rotated_at is not None or self._batch:
+            return False
+
+        self._sincedb_update_position(force_update=True)
+        self._suspended_position = self._file.tell()
+        self._file.close()
+        self._file = None
+        self._log_debug('suspended at position {0}'.format(self._suspended_position))
+        return True
+
+    def resume(self):
+        """Reopens a suspended file and seeks back to its position.
+        Returns True if the file is open again
+        """
+        if self._suspended_position is None:
+            return self.is_open()
+
+        position = self._suspended_position
+        self._suspended_position = None
+        _file = self.open()
+        if not _file:
+            return False
+
+        if self.get_file_id(os.fstat(_file.fileno())) != self._fid:
+            # The lines written to the old file after it was suspended are lost
+            _file.close()
+            self._log_info('file rotated while suspended')
+            self._switch_to_new_file()
+            return self.active
+
+        _file.seek(position, os.SEEK_SET)
+        self._file = _file
+        self._log_debug('resumed at position {0}'.format(position))
+        return True
+
+    def _resume_if_changed(self):
+        """Resumes a suspended file if a stat shows it changed since it was suspended"""
+        try:
+            st = os.stat(self._filename)
+        except EnvironmentError, err:
+            if err.errno == errno.ENOENT:
+                self._log_info('file removed')
+                self.close(remove_db_entry=True)
+                return False
+            raise
+
+        if st.st_size == self._suspended_position and self.get_file_id(st) == self._fid:
+            return False
+
+        return self.resume()
+
+    def weight(self):
+        return self._weight
+
+    def pass_bytes(self):
+        """Returns the number of bytes read by the last pass"""
+        return self._last_pass_bytes
+
+    def batch_deadline(self):
+        """Returns the time the partial batch held by the tail must be shipped, or None"""
+        if not self._batch:
+            return None
+
+        return self._batch_start + self._buffered_lines_max_seconds
+
+    def corrupt(self):
+        """Returns True if the tail was closed on corrupt compressed data"""
+        return self._corrupt
+
+    def rotating(self):
+        """Returns True while the rest of a rotated file is being read"""
+        return self._rotated_at is not None
+
+    def pending(self):
+        """Returns True if the file needs another pass even if it is not written to:
+        a backfill or a backlog is still being read, or a multi-line event is waiting
+        """
+        return bool(self._backfill_results) or not self._drained or bool(self._current_event)
+
     def _buffer_extract(self, data):
         """
         Extract takes an arbitrary string of input data and returns an array of
@@ -220,29 +411,70 @@ class Tail(BaseLog):
     def _buffer_empty(self):
         return len(self._input) > 0
 
-    def _ensure_file_is_good(self, current_time):
-        """Every N seconds, ensures that the file we are tailing is the file we expect to be tailing"""
-        if self._last_file_mapping_update and current_time - self._last_file_mapping_update <= self._stat_interval:
+    def _ensure_file_is_good(self, current_time, force=False):
+        """Every N seconds, ensures that the file we are tailing is the file we expect to be tailing.
+        With stat_sweep, only the open handle is checked, for removal and truncation,
+        unless force is set
+        """
+        if self._rotated_at is not None:
+            self._continue_rotation()
+            return
+
+        if not force and self._last_file_mapping_update and \
+                current_time - self._last_file_mapping_update <= self._stat_interval:
             return
 
         self._last_file_mapping_update = time.time()
 
-        try:
-            st = os.stat(self._filename)
-        except EnvironmentError, err:
-            if err.errno == errno.ENOENT:
-                self._log_info('file removed')
-                self.close(remove_db_entry=True)
+        if force or not self._stat_sweep:
+            try:
+                st = os.stat(self._filename)
+            except EnvironmentError, err:
+                if err.errno == errno.ENOENT:
+                    self._start_rotation(None)
+                    return
+                raise
+
+            self._check_stat(st)
+        else:
+            st = os.fstat(self._file.fileno())
+            if st.st_nlink == 0:
+                self._start_rotation(None)
                 return
-            raise
 
-        fid = self.get_file_id(st)
-        if fid != self._fid:
-            self._log_info('file rotated')
-            self.close(remove_db_entry=True)
-        elif self._file.tell() > st.st_size:
+            self._check_size(st)
+
+    def set_stat_sweep(self, stat_sweep):
+        """Sets whether the owner checks the path in its sweeps, see check_path"""
+        self._stat_sweep = stat_sweep
+
+    def check_path(self, st):
+        """Checks the file for rotation and truncation with a stat of its path
+        taken by the caller, or for removal if st is None. The periodic check
+        of _ensure_file_is_good is then not due for another stat_interval
+        """
+        if not self.active or self._rotated_at is not None:
+            return
+
+        self._last_file_mapping_update = time.time()
+        self._check_stat(st)
+
+    def _check_stat(self, st):
+        """Checks a stat of the path for rotation, removal if st is None, and truncation"""
+        if st is None or self.get_file_id(st) != self._fid:
+            self._start_rotation(st)
+            return
+
+        self._check_size(st)
+
+    def _check_size(self, st):
+        """Reloads the file if it was truncated, or on platforms that cache EOF"""
+        if self._file is None:
+            return
+
+        if not self._compressed and self._file.tell() > st.st_size:
             if st.st_size == 0 and self._ignore_truncate:
-                self._log_info("[{0}] - file size is 0 {1}. ".format(fid, self._filename) +
+                self._log_info("[{0}] - file size is 0 {1}. ".format(self._fid, self._filename) +
                                   "If you use another tool (i.e. logrotate) to truncate " +
                                   "the file, your application may continue to write to " +
                                   "the offset it last wrote later. In such a case, we'd " +
@@ -250,97 +482,357 @@ class Tail(BaseLog):
                 return
             self._log_info('file truncated')
             self._update_file(seek_to_end=False)
-        elif REOPEN_FILES:
+        elif REOPEN_FILES and not self._backfill_results:
             self._log_debug('file reloaded (non-linux)')
             position = self._file.tell()
             self._update_file(seek_to_end=False)
             if self.active:
                 self._file.seek(position, os.SEEK_SET)
 
-    def _run_pass(self):
+    def _start_rotation(self, st):
+        """Keeps the rotated or removed file open so that it is read to its end
+        before switching to the file now at its path, whose stat is st. The
+        new file is recorded in the sincedb at offset 0 first, so it is read
+        from its start even if beaver stops before the switch. The position in
+        the old file is saved under the name it was renamed to, if it is still
+        in the same directory, so that it is resumed after a restart if that
+        name is tailed.
+        """
+        self._rotated_at = time.time()
+        if st is None:
+            self._log_info('file removed, reading the rest of it')
+            return
+
+        self._log_info('file rotated, reading the rest of the old file')
+        if not self._sincedb_path or self._text_mode:
+            return
+
+        self._rotated_name = self._find_rotated_name()
+        if self._rotated_name is not None:
+            self._log_debug('saving position under {0}'.format(self._rotated_name))
+            self._sincedb_update_position(force_update=True)
+
+        fid = self.get_file_id(st)
+        if self._sincedb.get(fid, self._filename) is not None:
+            return
+
+        try:
+            with io.open(self._filename, 'rb') as _file:
+                if self.get_file_id(os.fstat(_file.fileno())) != fid:
+                    return
+                data = _file.read(FINGERPRINT_SIZE)
+        except IOError:
+            return
+
+        self._log_debug('recording handoff to {0} in sincedb'.format(fid))
+        self._sincedb.update(fid, self._filename, 0, 0, fingerprint(data))
+        self._sincedb.flush()
+
+    def _continue_rotation(self):
+        """Switches to the new file once the rotated one is read to its end, and
+        the new one was written to, or after rotation_drain_timeout seconds
+        """
+        timed_out = time.time() - self._rotated_at >= self._rotation_drain_timeout
+        if not timed_out and (self._last_pass_bytes or self.pending()):
+            return
+
+        try:
+            st = os.stat(self._filename)
+        except EnvironmentError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            st = None
+
+        if st is not None and self.get_file_id(st) == self._fid:
+            self._log_info('file is back at its path')
+            self._rotated_at = None
+            if self._rotated_name is not None:
+                self._sincedb.remove(self._fid, self._rotated_name)
+                self._rotated_name = None
+                self._sincedb_update_position(force_update=True)
+            return
+
+        if not timed_out and st is not None and st.st_size == 0:
+            # The writer may not have moved to the new file yet.
+            return
+
+        if timed_out:
+            self._log_warning('rotated file still not read to its end after {0} seconds'.format(
+                self._rotation_drain_timeout))
+
+        if st is None:
+            self._log_info('file removed')
+            self.close(remove_db_entry=True)
+            return
+
+        self._switch_to_new_file()
+
+    def _find_rotated_name(self):
+        """Returns the path the followed file was renamed to in its directory, or None"""
+        directory = os.path.dirname(self._filename)
+        try:
+            names = os.listdir(directory)
+        except EnvironmentError:
+            return None
+
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if self.get_file_id(os.stat(path)) == self._fid:
+                    return path
+            except EnvironmentError:
+                continue
+
+        return None
+
+    def _switch_to_new_file(self):
+        """Stops following the rotated file and opens the file now at its path from the start"""
+        self._log_info('switching to the new file')
+        self.close(remove_db_entry=True)
+        self._fid = None
+        self._line_count = 0
+        self._input.clear()
+        self._input_size = 0
+        self._update_file(seek_to_end=False)
+        if self.active:
+            self._sincedb_update_position(force_update=True)
+
+    def _run_pass(self, budget=None):
         """Read lines from a file and performs a callback against them"""
-        events = []
-        buffered_lines = 0
-        buffered_bytes = 0
-        run_start = time.time()
+        if self._backfill_results:
+            return self._run_backfill()
+
+        if budget is None:
+            budget = self._file_read_pass_budget
+
+        pass_bytes = 0
+        self._drained = True
 
         while self.active:
             try:
-                data = self._file.read(self._file_read_blocksize)
+                if self._use_mmap:
+                    position = self._file.tell()
+                    lines = self._decode_lines(self._file.readlines(self._delimiter, limit=self._read_size))
+                    data_size = self._file.tell() - position
+                else:
+                    data = self._file.read(self._read_size)
+                    data_size = len(data)
+                    lines = self._decode_lines(self._buffer_extract(data))
+                self._adapt_read_size(data_size)
+                if not self._text_mode:
+                    self._offset = self._file.tell() - sum(len(segment) for segment in self._input)
+            except DecompressionError, e:
+                self._close_corrupt(e)
+                return False
             except IOError, e:
                 if e.errno == errno.ESTALE:
                     self.active = False
                     # break so we can still try to flush the existing buffers.
                     break
-            lines = self._buffer_extract(data)
+                raise
 
             if not lines:
-                if time.time() - run_start < self._buffered_lines_max_seconds:
-                    # If we are here, then theres no new lines but we have a _buffered_lines_max_seconds value to
-                    # respect, so just keep polling for new lines, with a bit of a sleep to avoid starving everything else.
-                    time.sleep(0.1)
-                else:
-                    # Too much time without lines, flush what we've got so far.
-                    break
-            else:
-                self._last_activity = time.time()
-
-                # We for sure have lines here tho.
-                if self._multiline_regex_after or self._multiline_regex_before:
-                    # Multiline is enabled for this file.
-                    events += multiline_merge(
-                        lines,
-                        self._current_event,
-                        self._multiline_regex_after,
-                        self._multiline_regex_before)
-
-                else:
-                    events += lines
-
-                if self._ignoreline_regex:
-                    # Ignoreline is enabled for this file.
-                    self._log_debug("################ Ignore line regex is enabled")
-                    tmpevents = []
-                    for line in events:
-                        self._log_debug("check ignore line: "+line)
-                        if self._ignoreline_regex and self._ignoreline_regex.search(line):
-                            self._log_debug("ignore this line: "+line)
-                        else:
-                            tmpevents.append(line)
-
-                    events = tmpevents
-
-
-                buffered_lines = len(events)
-                buffered_bytes += len(data)
-
-                if events and (
-                    buffered_bytes >= self._buffered_lines_max_bytes or
-                    buffered_lines >= self._buffered_lines_max_lines or
-                    time.time() - run_start >= self._buffered_lines_max_seconds
-                ):
+                # No more lines for now. A partial batch is held until more
+                # lines fill it or its deadline passes, without waiting here.
+                break
 
-                    self._callback_wrapper(events)
-                    self._sincedb_update_position(lines=len(events))
+            self._last_activity = time.time()
 
-                    events = []
-                    buffered_lines = 0
-                    buffered_bytes = 0
-                    run_start = time.time()
+            # We for sure have lines here tho.
+            if self._multiline:
+                # Multiline is enabled for this file.
+                new_events = self._multiline.merge(lines)
+            else:
+                new_events = lines
+
+            # Only the events produced by this read are filtered, so every
+            # line is tested once no matter how many blocks are buffered.
+            if not self._batch:
+                self._batch_start = time.time()
+            self._batch.extend(self._filter_events(new_events))
+            self._batch_bytes += data_size
+
+            if self._batch and (
+                self._batch_bytes >= self._buffered_lines_max_bytes or
+                len(self._batch) >= self._buffered_lines_max_lines or
+                time.time() - self._batch_start >= self._buffered_lines_max_seconds
+            ):
+                self._flush_batch()
+
+            pass_bytes += data_size
+            if budget and pass_bytes >= budget:
+                # Leave the rest of the backlog for the next pass, so other files get their turn.
+                self._budget_exhausted += 1
+                self._drained = False
+                break
 
         # No more lines
         # Before returning, check if an event (maybe partial) is waiting for too long.
         if self._current_event and time.time() - self._last_activity > 1:
             event = '\n'.join(self._current_event)
             self._current_event.clear()
-            events += [event]
+            if not self._batch:
+                self._batch_start = time.time()
+            self._batch.extend(self._filter_events([event]))
+            self._flush_batch()
+        elif self._batch and (not self.active or time.time() >= self.batch_deadline()):
+            self._flush_batch()
+        elif not self._batch:
+            self._sincedb_update_position()
+
+        self._last_pass_bytes = pass_bytes
+        return True
 
+    def _close_corrupt(self, error):
+        """Closes a file that cannot be decompressed, keeping the lines read so far"""
+        self._log_warning('cannot decompress {0}, closing it: {1}'.format(self._filename, error))
+        self._corrupt = True
+        self.close()
+
+    def _flush_batch(self):
+        """Ships the batch of events held by the tail"""
+        events = self._batch
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_start = None
         if events:
             self._callback_wrapper(events)
 
         self._sincedb_update_position(lines=len(events))
+
+    def _start_backfill(self):
+        """Hands the unread part of a large file to the backfill pool"""
+        if not self._backfill_pool or self._text_mode or self._compressed:
+            return
+
+        start = self._file.tell()
+        end = os.fstat(self._file.fileno()).st_size
+        if end - start < max(self._backfill_min_size, 1):
+            return
+
+        encoding = None if self._binary_pipeline else self._encoding or 'utf_8'
+        ranges = split_ranges(self._filename, start, end, self._backfill_chunk_size, self._delimiter)
+        self._backfill_ranges.extend((self._filename, range_start, range_end, self._delimiter, encoding)
+                                     for range_start, range_end in ranges)
+        self._log_info('backfilling {0} bytes in {1} ranges'.format(end - start, len(ranges)))
+        self._submit_backfill_ranges()
+
+    def _submit_backfill_ranges(self):
+        while self._backfill_ranges and len(self._backfill_results) < max(self._backfill_processes, 1):
+            task = self._backfill_ranges.popleft()
+            self._backfill_results.append(self._backfill_pool.apply_async(read_range, task))
+
+    def _run_backfill(self):
+        """Ships the backfill ranges that are ready, in file order, without blocking"""
+        while self._backfill_results and self._backfill_results[0].ready():
+            result = self._backfill_results.popleft()
+            try:
+                offset, lines = result.get()
+            except Exception, e:
+                self._log_warning('backfill failed, reading sequentially from offset {0}: {1}'.format(self._offset, e))
+                self._backfill_ranges.clear()
+                self._backfill_results.clear()
+                self._file.seek(self._offset, os.SEEK_SET)
+                return True
+
+            self._submit_backfill_ranges()
+            self._last_activity = time.time()
+
+            if self._multiline:
+                events = self._multiline.merge(lines)
+            else:
+                events = lines
+
+            events = self._filter_events(events)
+            if events:
+                self._callback_wrapper(events)
+
+            self._offset = offset
+            self._sincedb_update_position(lines=len(events))
+
+        if not self._backfill_results:
+            self._log_info('backfill done at offset {0}'.format(self._offset))
+            self._file.seek(self._offset, os.SEEK_SET)
+            self._sincedb_update_position(force_update=True)
+
         return True
 
+    def _adapt_read_size(self, data_size):
+        self._reads += 1
+        self._bytes_read += data_size
+        if data_size >= self._read_size:
+            self._read_size = min(self._read_size * 2, self._file_read_max_blocksize)
+        elif data_size < self._read_size / 2:
+            self._read_size = max(self._read_size / 2, self._file_read_blocksize)
+
+    def metrics(self):
+        """Returns the current read size and the read counters of this file"""
+        return {
+            'filename': self._filename,
+            'read_size': self._read_size,
+            'bytes_read': self._bytes_read,
+            'reads': self._reads,
+            'budget_exhausted': self._budget_exhausted,
+            'ignoreline_dropped': self.ignoreline_stats(),
+        }
+
+    def _filter_events(self, events):
+        """Drops the events matching one of the ignoreline_regex patterns"""
+        if not self._ignoreline_regex:
+            return events
+
+        kept = ignoreline_filter(events, self._ignoreline_regex, self._ignoreline_dropped)
+        if len(kept) != len(events):
+            self._log_debug('ignored {0} of {1} lines'.format(len(events) - len(kept), len(events)))
+
+        return kept
+
+    def ignoreline_stats(self):
+        """Returns the number of lines dropped by each ignoreline_regex and ignoreline_regexes pattern"""
+        return dict((regex.pattern, dropped) for regex, dropped in zip(self._ignoreline_regex, self._ignoreline_dropped))
+
+    def _get_fingerprint(self, size=FINGERPRINT_SIZE):
+        """Returns a "<length>:<sha1>" fingerprint of the first bytes of the file,
+        or None if the file on disk is no longer the one being tailed
+        """
+        if size == FINGERPRINT_SIZE and self._fingerprint:
+            return self._fingerprint
+
+        try:
+            with io.open(self._rotated_name or self._filename, 'rb') as _file:
+                if self.get_file_id(os.fstat(_file.fileno())) != self._fid:
+                    return None
+                data = _file.read(size)
+        except IOError:
+            return None
+
+        result = fingerprint(data)
+        if len(data) == FINGERPRINT_SIZE:
+            self._fingerprint = result
+
+        return result
+
+    def _fingerprint_matches(self, fingerprint):
+        """Checks a stored fingerprint against the current file contents"""
+        try:
+            size = int(fingerprint.split(':', 1)[0])
+        except (AttributeError, ValueError):
+            return False
+
+        return self._get_fingerprint(size=size) == fingerprint
+
+    def _decode_lines(self, lines):
+        """Decodes raw lines read in binary mode with the file encoding,
+        or with the fallback ENCODINGS for lines it cannot decode.
+        With binary_pipeline the lines are shipped undecoded and the
+        transport decodes them when it formats them.
+        """
+        if self._text_mode or self._binary_pipeline:
+            return list(lines)
+
+        encoding = self._encoding or 'utf_8'
+        return [decode_line(line, encoding) for line in lines]
+
     def _callback_wrapper(self, lines):
         now = datetime.datetime.utcnow()
         timestamp = now.strftime("%Y-%m-%dT%H:%M:%S") + ".%03d" % (now.microsecond / 1000) + "Z"
@@ -365,46 +857,33 @@ class Tail(BaseLog):
     def _seek_to_end(self):
         self._log_debug('seek_to_end')
 
+        resumed = False
         if self._sincedb_path:
-            sincedb_start_position = self._sincedb_start_position()
-            if sincedb_start_position:
-                self._start_position = sincedb_start_position
+            resumed = self._sincedb_resume()
 
-        if self._start_position == 'beginning':
-            self._log_debug('no start_position specified')
-            return
-
-        line_count = 0
-
-        if str(self._start_position).isdigit():
-            self._log_debug('going to start position {0}'.format(self._start_position))
-            self._start_position = int(self._start_position)
-            for encoding in ENCODINGS:
-                line_count, encoded = self._seek_to_position(encoding=encoding, position=True)
-                if line_count is None and encoded is None:
-                    return
-
-                if encoded:
-                    break
-
-        if self._start_position == 'beginning':
-            self._log_debug('Bad start position specified')
-            return
-
-        if self._start_position == 'end':
-            self._log_debug('getting end position')
-            for encoding in ENCODINGS:
-                line_count, encoded = self._seek_to_position(encoding=encoding)
-                if line_count is None and encoded is None:
-                    return
+        if not resumed:
+            if self._start_position == 'beginning':
+                self._log_debug('no start_position specified')
+                return
 
-                if encoded:
-                    break
+            if str(self._start_position).isdigit():
+                self._log_debug('going to start position {0}'.format(self._start_position))
+                self._seek_to_line(int(self._start_position))
+            elif self._start_position == 'end' and self._text_mode:
+                # Positions in text mode are line counts, and seeking would
+                # lose the decoder state (the byte order of utf_16...).
+                self._log_debug('counting lines to the end position')
+                self._seek_to_line(None)
+            elif self._start_position == 'end':
+                self._log_debug('getting end position')
+                self._file.seek(0, os.SEEK_END)
 
         current_position = self._file.tell()
-        self._log_debug('line count {0}'.format(line_count))
+        if not self._text_mode:
+            self._offset = current_position
+        self._log_debug('line count {0}'.format(self._line_count))
         self._log_debug('current position {0}'.format(current_position))
-        self._sincedb_update_position(lines=line_count, force_update=True)
+        self._sincedb_update_position(force_update=True)
         # Reset this, so line added processed just after this initialization
         # will update the sincedb. Without this, if beaver run for less than
         # sincedb_write_interval it will always re-process the last lines.
@@ -414,87 +893,99 @@ class Tail(BaseLog):
             self._log_debug('tailing {0} lines'.format(self._tail_lines))
             lines = self.tail(self._filename, encoding=self._encoding, window=self._tail_lines, position=current_position)
             if lines:
-                if self._multiline_regex_after or self._multiline_regex_before:
+                lines = self._decode_lines(lines)
+                if self._multiline:
                     # Multiline is enabled for this file.
-                    events = multiline_merge(
-                            lines,
-                            self._current_event,
-                            self._multiline_regex_after,
-                            self._multiline_regex_before)
+                    events = self._multiline.merge(lines)
                 else:
                     events = lines
 
-                if self._ignoreline_regex:
-                    # Ignoreline is enabled for this file.
-                    self._log_debug("################ Ignore line regex is enabled")
-                    tmpevents = []
-                    for line in events:
-                        self._log_debug("check ignore line: "+line)
-                        if re_ignoreline and re_ignoreline.search(line):
-                            self._log_debug("ignore this line: "+line)
-                        else:
-                            tmpevents.append(line)
-
-
-                self._callback_wrapper(events)
+                events = self._filter_events(events)
+                if events:
+                    self._callback_wrapper(events)
 
         return
 
-    def _seek_to_position(self, encoding=None, position=None):
+    def _seek_to_line(self, position):
+        """Moves forward position lines from the start of the file, or to its
+        end if position is None. Only used for numeric start positions, files
+        read in text mode and legacy line-count sincedb entries.
+        """
         line_count = 0
-        encoded = False
-        try:
-            while self._file.readline():
-                line_count += 1
-                if position and line_count == self._start_position:
-                    encoded = True
-                    break
+        while (position is None or line_count < position) and self._file.readline():
+            line_count += 1
+
+        if position is not None and line_count != position:
+            self._log_debug('file at different position than {0}, assuming manual truncate'.format(position))
+            self._file.seek(0, os.SEEK_SET)
+            line_count = 0
+
+        self._line_count = line_count
+
+    def _sincedb_resume(self):
+        """Moves to the position stored in the sincedb for this file.
+        Returns a boolean representing whether or not a stored position was used
+        """
+        entry = self._sincedb_entry()
+        if not entry:
+            return False
 
+        position, offset, fingerprint, checkpoint = entry
+        if self._text_mode:
+            self._log_debug('resuming at line {0}'.format(position))
+            self._seek_to_line(position or 0)
+            return True
+
+        if offset is None:
+            # Line-count entry written by an older version. Counting the lines
+            # once is unavoidable, the byte offset is stored right after.
             if not position:
-                encoded = True
-        except UnicodeDecodeError:
-            self._log_debug('UnicodeDecodeError raised with encoding {0}'.format(self._encoding))
-            self._file = self.open(encoding=encoding)
-            self._encoding = encoding
+                return False
 
-        if not self._file:
-            return None, None
+            self._log_info('migrating sincedb line position {0} to a byte offset'.format(position))
+            self._seek_to_line(position)
+            return True
 
-        if position and line_count != self._start_position:
-            self._log_debug('file at different position than {0}, assuming manual truncate'.format(self._start_position))
-            self._file.seek(0, os.SEEK_SET)
-            self._start_position == 'beginning'
+        if not self._fingerprint_matches(fingerprint):
+            self._log_info('sincedb fingerprint does not match file contents, ignoring stored offset')
+            return False
 
-        return line_count, encoded
+        if self._compressed:
+            # Decompression restarts at the last member boundary before the
+            # offset instead of at the start of the file.
+            if checkpoint and self._file.restore(checkpoint):
+                self._log_debug('resuming decompression at checkpoint {0}'.format(checkpoint))
+        elif offset > os.fstat(self._file.fileno()).st_size:
+            self._log_debug('file smaller than offset {0}, assuming manual truncate'.format(offset))
+            offset = 0
+
+        self._log_debug('resuming at offset {0}'.format(offset))
+        self._file.seek(offset, os.SEEK_SET)
+        self._line_count = position or 0
+        return True
 
-    def _sincedb_init(self):
-        """Initializes the sincedb schema in an sqlite db"""
+    def _sincedb_remove_entry(self):
         if not self._sincedb_path:
             return
 
-        if not os.path.exists(self._sincedb_path):
-            self._log_debug('initializing sincedb sqlite schema')
-            conn = sqlite3.connect(self._sincedb_path, isolation_level=None)
-            conn.execute("""
-            create table sincedb (
-                fid      text primary key,
-                filename text,
-                position integer default 1
-            );
-            """)
-            conn.close()
-
-    def _sincedb_remove_entry(self):
         self._log_info('deleting from database with fid {0} and filename {1}'.format(self._fid, self._filename))
-        conn = sqlite3.connect(self._sincedb_path, isolation_level=None)
-        cursor = conn.cursor()
-        cursor.execute('delete from sincedb where fid = :fid and filename = :filename', {
-            'fid': self._fid,
-            'filename': self._filename
-        })
+        self._sincedb.remove(self._fid, self._filename)
+
+        # The position saved under the rotated name is only kept for the tail
+        # that will follow the file under that name.
+        if self._rotated_name is not None and not self._is_tailed_name(self._rotated_name):
+            self._log_debug('deleting position saved under {0}'.format(self._rotated_name))
+            self._sincedb.remove(self._fid, self._rotated_name)
+
+    def _is_tailed_name(self, path):
+        """Returns True if path matches a configured glob, or is in the tailed folder"""
+        if self._globs:
+            return glob_matches(path, self._globs)
+
+        return bool(self._folder) and os.path.dirname(path) == os.path.realpath(self._folder)
 
     def _sincedb_update_position(self, lines=0, force_update=False):
-        """Retrieves the starting position from the sincedb sql db for a given file
+        """Stores the current line count and byte offset in the sincedb sql db for a given file
         Returns a boolean representing whether or not it updated the record
         """
         if not self._sincedb_path:
@@ -509,56 +1000,43 @@ class Tail(BaseLog):
             if self._last_sincedb_write and current_time - self._last_sincedb_write <= self._sincedb_write_interval:
                 return False
 
-            if old_count == lines:
+            if old_count == lines and self._offset_sincedb == self._offset:
                 return False
 
-        self._sincedb_init()
-
         self._last_sincedb_write = current_time
 
-        self._log_debug('updating sincedb to {0}'.format(lines))
-
-        conn = sqlite3.connect(self._sincedb_path, isolation_level=None)
-        cursor = conn.cursor()
-        query = 'insert or ignore into sincedb (fid, filename) values (:fid, :filename);'
-        cursor.execute(query, {
-            'fid': self._fid,
-            'filename': self._filename
-        })
+        self._log_debug('updating sincedb to {0} (offset {1})'.format(lines, self._offset))
+        checkpoint = None
+        if self._compressed and self._file and self._offset is not None:
+            checkpoint = self._file.checkpoint(self._offset)
 
-        query = 'update sincedb set position = :position where fid = :fid and filename = :filename'
-        cursor.execute(query, {
-            'fid': self._fid,
-            'filename': self._filename,
-            'position': lines,
-        })
-        conn.close()
+        self._sincedb.update(self._fid, self._rotated_name or self._filename, lines, self._offset,
+                             self._get_fingerprint(), checkpoint)
 
         self._line_count_sincedb = lines
+        self._offset_sincedb = self._offset
 
         return True
 
-    def _sincedb_start_position(self):
-        """Retrieves the starting position from the sincedb sql db
+    def _sincedb_entry(self):
+        """Retrieves the (position, byte_offset, fingerprint, checkpoint) row from the sincedb sql db
         for a given file
         """
         if not self._sincedb_path:
             return None
 
-        self._sincedb_init()
         self._log_debug('retrieving start_position from sincedb')
-        conn = sqlite3.connect(self._sincedb_path, isolation_level=None)
-        cursor = conn.cursor()
-        cursor.execute('select position from sincedb where fid = :fid and filename = :filename', {
-            'fid': self._fid,
-            'filename': self._filename
-        })
+        return self._sincedb.get(self._fid, self._filename)
 
-        start_position = None
-        for row in cursor.fetchall():
-            start_position, = row
+    def _sincedb_start_position(self):
+        """Retrieves the starting line position from the sincedb sql db
+        for a given file
+        """
+        entry = self._sincedb_entry()
+        if entry is None:
+            return None
 
-        return start_position
+        return entry[0]
 
     def _update_file(self, seek_to_end=True):
         """Open the file for tailing"""
@@ -572,12 +1050,16 @@ class Tail(BaseLog):
                 return
 
             self.active = True
+            self._fingerprint = None
+            self._offset = None if self._text_mode else 0
             try:
                 st = os.stat(self._filename)
             except EnvironmentError, err:
                 if err.errno == errno.ENOENT:
                     self._log_info('file removed')
                     self.close(remove_db_entry=True)
+                    return
+                raise
 
             fid = self.get_file_id(st)
             if not self._fid:
@@ -587,30 +1069,28 @@ class Tail(BaseLog):
                 self._log_info('file rotated')
                 self.close(remove_db_entry=True)
             elif seek_to_end:
-                self._seek_to_end()
+                try:
+                    self._seek_to_end()
+                except DecompressionError, e:
+                    self._close_corrupt(e)
+                    return
+                self._start_backfill()
 
     def tail(self, fname, encoding, window, position=None):
         """Read last N lines from file fname."""
         if window <= 0:
             raise ValueError('invalid window %r' % window)
 
-        encodings = ENCODINGS
-        if encoding:
-            encodings = [encoding] + ENCODINGS
-
-        for enc in encodings:
-            try:
-                f = self.open(encoding=enc)
-                if f:
-                    return self.tail_read(f, window, position=position)
+        try:
+            f = self.open(encoding=encoding)
+            if f:
+                return self.tail_read(f, window, position=position)
 
-                return False
-            except IOError, err:
-                if err.errno == errno.ENOENT:
-                    return []
-                raise
-            except UnicodeDecodeError:
-                pass
+            return False
+        except IOError, err:
+            if err.errno == errno.ENOENT:
+                return []
+            raise
 
     @staticmethod
     def get_file_id(st):
@@ -618,7 +1098,15 @@ class Tail(BaseLog):
 
     @classmethod
     def tail_read(cls, f, window, position=None):
+        """Returns the last window lines before position, reading backwards.
+
+        Blocks are kept in a list and joined once at the end, and newlines are
+        only counted in the block just read, so the work is linear in the
+        number of bytes scanned. The block size doubles on every step, up to
+        MAX_BUFSIZ, so long lines need few seeks. Lines are returned undecoded.
+        """
         BUFSIZ = 1024
+        MAX_BUFSIZ = 1024 * 1024
         # open() was overridden and file was opened in text
         # mode; read() will return a string instead bytes.
         encoded = getattr(f, 'encoding', False)
@@ -628,25 +1116,19 @@ class Tail(BaseLog):
         if position is None:
             position = f.tell()
 
-        block = -1
-        exit = False
+        chunks = []
+        newlines = 0
         read = BUFSIZ
 
-        while not exit:
-            step = (block * BUFSIZ) + position
-            if step < 0:
-                step = 0
-                read = ((block + 1) * BUFSIZ) + position
-                exit = True
-
+        while position > 0 and newlines <= window:
+            step = max(position - read, 0)
             f.seek(step, os.SEEK_SET)
-            newdata = f.read(read)
-
-            data = newdata + data
-            if data.count(CR) > window:
-                break
-            else:
-                block -= 1
+            newdata = f.read(position - step)
 
-        return data.splitlines()[-window:]
+            chunks.append(newdata)
+            newlines += newdata.count(CR)
+            position = step
+            read = min(read * 2, MAX_BUFSIZ)
 
+        chunks.reverse()
+        return data.join(chunks).splitlines()[-window:]
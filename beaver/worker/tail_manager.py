@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
+import collections
 import errno
+import glob
 import os
 import stat
 import time
 import logging
 import multiprocessing
+import multiprocessing.pool
 import datetime
 
-from beaver.utils import eglob
 from beaver.base_log import BaseLog
+from beaver.worker import inotify
+from beaver.worker.discovery import GlobDiscovery
+from beaver.worker.hash_ring import HashRing
+from beaver.worker.scheduler import TailScheduler
+from beaver.worker.sincedb import SincedbStore
+from beaver.worker.spill_queue import SpillQueue
 from beaver.worker.tail import Tail
 
 
 class TailManager(multiprocessing.Process, BaseLog):
-    def __init__(self, beaver_config, queue_consumer_function, callback, logger=None, consumer_refresh_interval=5.0):
+    def __init__(self, beaver_config, queue_consumer_function, callback, logger=None, consumer_refresh_interval=5.0,
+                 shard=0, number_of_shards=1, shards_alive=None, queue_size=None):
         super(TailManager, self).__init__()
         self._logger = logger
         if not self._logger:
@@ -23,15 +32,88 @@ class TailManager(multiprocessing.Process, BaseLog):
         self._callback = callback
         self._create_queue_consumer = queue_consumer_function
         self._discover_interval = beaver_config.get('discover_interval', 15)
+        self._metrics_interval = beaver_config.get('metrics_interval', 0)
+        self._metrics_time = time.time()
         self._log_template = "[TailManager] - {0}"
 
+        # With several producer processes, files are spread across shards by a
+        # consistent hash of their fid, among the shards flagged in shards_alive.
+        # Shard 0 also runs the consumers.
+        self._shard = shard
+        self._shards_alive = shards_alive
+        self._alive = None
+        self._ring = None
+        if number_of_shards > 1:
+            self._log_template = "[TailManager {0}] - {{0}}".format(shard)
+            self._ring = HashRing(number_of_shards)
+            self._alive = tuple(range(number_of_shards))
+
         self._number_of_consumer_processes = int(self._beaver_config.get('number_of_consumer_processes'))
         self._queue_consumer_function = queue_consumer_function
         self._consumer_refresh_interval = consumer_refresh_interval
 
+        self._backfill_pool = None
+        self._sincedb = None
+
+        # With tail_init_threads, tails are created in a thread pool, and added
+        # as soon as each of them is ready. _starting maps the paths being
+        # started to their result, _init_batch the startup metrics of the
+        # current batch: [start time, count, slowest path, slowest duration].
+        self._init_threads = beaver_config.get('tail_init_threads', 0)
+        self._init_pool = None
+        self._starting = {}
+        self._init_batch = None
         self._tails = {}
         self._update_time = None
 
+        # Glob discovery only looks at directories that changed, unless a full
+        # pass is requested because tails were closed or files changed shard.
+        # Files skipped for their age, and files whose tail did not start, are
+        # checked again on every pass. Files closed on corrupt compressed data
+        # are left alone until their size or mtime changes.
+        self._discovery = None
+        self._discover_full = False
+        self._old_files = set()
+        self._retry_files = set()
+        self._corrupt_files = {}
+
+        # When polling, tails run when they are due: right away while they have
+        # data, then less and less often while they stay idle.
+        self._scheduler = TailScheduler(max_interval=beaver_config.get('poll_max_interval', 1.0))
+
+        # inotify backend state: watched directories, the tails to run again
+        # without waiting for an event, and the time of the last full sweep.
+        self._watcher = None
+        self._directory_wds = {}
+        self._watched_directories = {}
+        self._fids_by_filename = {}
+        self._pending_fids = set()
+        # Tails to run on the next iteration, without cutting the wait for events short
+        self._deferred_fids = set()
+        self._sweep_time = time.time()
+        self._watch_dirty = True
+
+        # Read budgets are shared by deficit round-robin: every run adds
+        # file_read_pass_budget times the weight of the file to its deficit,
+        # which the bytes read are taken from. When the queue is filled past
+        # queue_pressure_threshold, only the files of the highest weight are read.
+        self._quantum = beaver_config.get('file_read_pass_budget', 0)
+        self._deficits = {}
+        self._max_weight = 1
+        self._queue_size = queue_size
+        self._max_queue_size = beaver_config.get('max_queue_size', 0)
+        self._queue_pressure_threshold = beaver_config.get('queue_pressure_threshold', 0)
+        self._throttled = False
+
+        # Fids of the tails with an open handle, least recently active first.
+        # Beyond max_open_files, the least recently active tails are suspended.
+        self._max_open_files = beaver_config.get('max_open_files', 0)
+        self._open_fids = collections.OrderedDict()
+
+        # With spill_path, batches go to spill files while the queue is past
+        # spill_high_water, and are replayed in order once it drains.
+        self._spill = None
+
         self._shutdown_requested = multiprocessing.Event()
 
     def listdir(self):
@@ -45,44 +127,509 @@ class TailManager(multiprocessing.Process, BaseLog):
             if self._shutdown_requested.is_set():
                 break
 
-            tail = Tail(
-                filename=path,
-                beaver_config=self._beaver_config,
-                callback=self._callback,
-                logger=self._logger
-            )
+            if path in self._starting:
+                continue
+
+            if self._init_batch is None:
+                self._init_batch = [time.time(), 0, None, 0]
+
+            if self._init_pool is not None:
+                self._starting[path] = self._init_pool.apply_async(self._start_tail, (path,))
+                continue
+
+            tail, duration = self._start_tail(path)
+            self._record_start(path, duration)
+            self._add_tail(tail)
+
+        if not self._starting:
+            self._log_startup_metrics()
+
+    def _start_tail(self, path):
+        """Creates the Tail of path, in a thread of the init pool if there is one.
+        Returns the tail and the time its initialization took
+        """
+        start = time.time()
+        tail = Tail(
+            filename=path,
+            beaver_config=self._beaver_config,
+            callback=self._callback,
+            logger=self._logger,
+            sincedb=self._sincedb,
+            backfill_pool=self._backfill_pool,
+            # inotify events tell when a path must be checked, polled tails
+            # check their path every stat_interval.
+            stat_sweep=self._watcher is not None
+        )
+        return tail, time.time() - start
+
+    def _add_tail(self, tail):
+        if tail.corrupt():
+            self._skip_corrupt_file(tail.filename())
+            return
+
+        if not tail.active:
+            self._retry_files.add(tail.filename())
+            return
+
+        self._tails[tail.fid()] = tail
+        self._fids_by_filename[tail.filename()] = tail.fid()
+        self._max_weight = max(self._max_weight, tail.weight())
+        self._scheduler.schedule(tail.fid())
+        self._pending_fids.add(tail.fid())
+        self._watch_dirty = True
+        if tail.is_open():
+            self._touch_open_file(tail.fid())
+            self._evict_open_files()
+
+    def _collect_started_tails(self):
+        """Adds the tails whose initialization finished in the init pool, so
+        they run without waiting for the others. Logs the startup time of each
+        batch of files once it is complete
+        """
+        if not self._starting:
+            return
+
+        for path, result in self._starting.items():
+            if not result.ready():
+                continue
+
+            del self._starting[path]
+            try:
+                tail, duration = result.get()
+            except Exception, e:
+                self._log_warning('cannot start tailing {0}: {1}'.format(path, e))
+                self._retry_files.add(path)
+                continue
+
+            self._record_start(path, duration)
+            if tail.active and (tail.fid() in self._tails or not self.owns(tail.fid())):
+                tail.close()
+                continue
 
-            if tail.active:
-                self._tails[tail.fid()] = tail
+            self._add_tail(tail)
+
+        if not self._starting:
+            self._log_startup_metrics()
+
+    def _record_start(self, path, duration):
+        self._init_batch[1] += 1
+        if duration > self._init_batch[3]:
+            self._init_batch[2:] = [path, duration]
+
+    def _log_startup_metrics(self):
+        """Logs how long the last batch of new files took to start"""
+        if self._init_batch is None:
+            return
+
+        start, count, slowest, slowest_duration = self._init_batch
+        self._init_batch = None
+        if count:
+            self._log_info('started {0} tails in {1:.3f}s, slowest was {2} in {3:.3f}s'.format(
+                count, time.time() - start, slowest, slowest_duration))
 
     def run(self, interval=0.1, shutdown_timeout=60.0):
-        consumer_manager = ConsumerManager(self._queue_consumer_function,
-                                           number_of_consumer_processes=self._number_of_consumer_processes,
-                                           interval=self._consumer_refresh_interval,
-                                           logger=self._logger)
-        consumer_manager.start()
+        self._scheduler = TailScheduler(min_interval=interval,
+                                        max_interval=self._beaver_config.get('poll_max_interval', 1.0))
+        for fid in self._tails:
+            self._scheduler.schedule(fid)
 
-        try:
-            while not self._shutdown_requested.is_set():
-                for fid in self._tails.keys():
+        consumer_manager = None
+        if self._shard == 0:
+            consumer_manager = ConsumerManager(self._queue_consumer_function,
+                                               number_of_consumer_processes=self._number_of_consumer_processes,
+                                               interval=self._consumer_refresh_interval,
+                                               logger=self._logger)
+            consumer_manager.start()
 
-                    self.update_files()
+        if self._beaver_config.get('backfill_processes') > 0:
+            self._backfill_pool = multiprocessing.Pool(self._beaver_config.get('backfill_processes'))
 
-                    self._log_debug("Processing {0}".format(fid))
-                    if self._shutdown_requested.is_set():
-                        break
+        # The sqlite connection must be opened in this process, not the parent.
+        if self._beaver_config.get('sincedb_path'):
+            self._sincedb = SincedbStore(self._beaver_config.get('sincedb_path'),
+                                         flush_interval=self._beaver_config.get('sincedb_flush_interval'),
+                                         logger=self._logger)
+            self._sincedb.load()
 
-                    self._tails[fid].run(once=True)
+        # The other shards hand over the files of this one once it reports ready.
+        if self._shards_alive is not None:
+            self._shards_alive[self._shard] = 1
 
-                    if not self._tails[fid].active:
-                        self._tails[fid].close()
-                        del self._tails[fid]
+        if self._init_threads > 0:
+            self._init_pool = multiprocessing.pool.ThreadPool(self._init_threads)
+
+        if self._beaver_config.get('spill_path'):
+            self._spill = SpillQueue(os.path.join(self._beaver_config.get('spill_path'), 'shard-{0}'.format(self._shard)),
+                                     self._callback,
+                                     queue_size=self._queue_size,
+                                     max_queue_size=self._max_queue_size,
+                                     high_water=self._beaver_config.get('spill_high_water'),
+                                     max_bytes=self._beaver_config.get('spill_max_bytes'),
+                                     segment_size=self._beaver_config.get('spill_segment_size'),
+                                     logger=self._logger)
+            self._callback = self._spill.put
+
+        self._watcher = self._create_watcher()
+
+        try:
+            while not self._shutdown_requested.is_set():
+                self.rebalance()
+                if self._spill is not None:
+                    self._spill.replay()
+                self._collect_started_tails()
+                self._check_queue_pressure()
+                if self._watcher:
+                    self._run_watched(interval)
+                else:
+                    self._run_scheduled()
 
                 self.update_files()
-                self._shutdown_requested.wait(interval)
+                if self._sincedb:
+                    self._sincedb.flush_if_due()
+                self.log_metrics()
+                if not self._watcher:
+                    self._shutdown_requested.wait(self._scheduled_wait(interval))
 
         finally:
-            consumer_manager.stop(shutdown_timeout)
+            for fid in self._tails:
+                self._tails[fid].close()
+            if self._watcher:
+                self._watcher.close()
+            if self._sincedb:
+                self._sincedb.close()
+            if self._spill is not None:
+                self._spill.close()
+            if self._init_pool:
+                self._init_pool.terminate()
+            if self._backfill_pool:
+                self._backfill_pool.terminate()
+                self._backfill_pool.join()
+            if self._shards_alive is not None:
+                self._shards_alive[self._shard] = 0
+            if consumer_manager:
+                consumer_manager.stop(shutdown_timeout)
+
+    def _create_watcher(self):
+        """Returns an Inotify instance, or None to poll every file"""
+        backend = self._beaver_config.get('watch_backend')
+        if backend == 'poll':
+            return None
+
+        if not inotify.is_supported():
+            if backend == 'inotify':
+                self._log_warning('inotify is not available on this platform, polling files instead')
+            return None
+
+        try:
+            watcher = inotify.Inotify()
+        except OSError, e:
+            self._log_warning('cannot initialize inotify, polling files instead: {0}'.format(e))
+            return None
+
+        self._log_debug('watching files with inotify')
+        return watcher
+
+    def _run_tail(self, fid, force_check=False):
+        """Gives a tail a pass within its deficit round-robin budget.
+        Returns whether it read anything, or None if it was throttled
+        """
+        tail = self._tails.get(fid)
+        if tail is None:
+            return
+
+        if self._throttled and tail.weight() < self._max_weight and not force_check:
+            return None
+
+        budget = None
+        if self._quantum:
+            budget = max(self._deficits.get(fid, 0) + self._quantum * tail.weight(), 1)
+
+        active = tail.run(once=True, force_check=force_check, budget=budget)
+
+        if budget is not None and tail.pending():
+            self._deficits[fid] = budget - tail.pass_bytes()
+        else:
+            # Files without a backlog do not save up budget.
+            self._deficits.pop(fid, None)
+
+        if not tail.active:
+            self._remove_tail(fid)
+        elif tail.fid() != fid:
+            self._switch_tail(fid, tail)
+        elif tail.is_open() and (active or fid not in self._open_fids):
+            self._touch_open_file(fid)
+            self._evict_open_files()
+
+        return active
+
+    def _switch_tail(self, old_fid, tail):
+        """Files a tail that switched to the new file at its path under its new fid"""
+        del self._tails[old_fid]
+        self._deficits.pop(old_fid, None)
+        self._pending_fids.discard(old_fid)
+        self._deferred_fids.discard(old_fid)
+        self._open_fids.pop(old_fid, None)
+        self._scheduler.remove(old_fid)
+
+        fid = tail.fid()
+        if fid in self._tails or not self.owns(fid):
+            # The new file is followed elsewhere, from its sincedb entry.
+            self._log_debug('releasing {0}'.format(tail.filename()))
+            tail.close()
+            if self._fids_by_filename.get(tail.filename()) == old_fid:
+                del self._fids_by_filename[tail.filename()]
+            self._discover_full = True
+            return
+
+        self._tails[fid] = tail
+        self._fids_by_filename[tail.filename()] = fid
+        self._pending_fids.add(fid)
+        self._scheduler.schedule(fid)
+        self._touch_open_file(fid)
+
+    def _check_queue_pressure(self):
+        """Throttles the files below the highest weight while the queue is filled past queue_pressure_threshold"""
+        throttled = False
+        if self._queue_size and self._max_queue_size and self._queue_pressure_threshold:
+            try:
+                throttled = self._queue_size() >= self._max_queue_size * self._queue_pressure_threshold
+            except NotImplementedError:
+                # qsize() is not available on every platform
+                self._queue_size = None
+
+        if throttled != self._throttled:
+            self._log_info('queue pressure {0}, {1} files below weight {2}'.format(
+                'high' if throttled else 'back to normal', 'throttling' if throttled else 'resuming',
+                self._max_weight))
+            self._throttled = throttled
+
+    def _touch_open_file(self, fid):
+        """Marks the handle of fid as the most recently active one"""
+        self._open_fids.pop(fid, None)
+        self._open_fids[fid] = True
+
+    def _evict_open_files(self):
+        """Suspends the least recently active tails while more than max_open_files handles are open"""
+        if not self._max_open_files:
+            return
+
+        busy = []
+        while self._open_fids and len(self._open_fids) + len(busy) > self._max_open_files:
+            fid, _ = self._open_fids.popitem(last=False)
+            tail = self._tails.get(fid)
+            if tail is None or not tail.is_open():
+                continue
+
+            if tail.suspend():
+                self._log_debug('closed the handle of {0}'.format(tail.filename()))
+            else:
+                # Tails with data waiting keep their handle
+                busy.append(fid)
+
+        for fid in busy:
+            self._open_fids[fid] = True
+
+    def _remove_tail(self, fid):
+        tail = self._tails.pop(fid)
+        tail.close()
+        if self._fids_by_filename.get(tail.filename()) == fid:
+            del self._fids_by_filename[tail.filename()]
+        self._pending_fids.discard(fid)
+        self._deferred_fids.discard(fid)
+        self._deficits.pop(fid, None)
+        self._open_fids.pop(fid, None)
+        self._scheduler.remove(fid)
+        self._discover_full = True
+        if tail.corrupt():
+            self._skip_corrupt_file(tail.filename())
+
+    def _skip_corrupt_file(self, filename):
+        """Leaves a file that cannot be decompressed alone until it changes"""
+        try:
+            st = os.stat(filename)
+        except EnvironmentError:
+            return
+
+        self._corrupt_files[filename] = (st.st_size, st.st_mtime)
+
+    def owns(self, fid):
+        """Returns True if this shard should tail the file with this fid"""
+        if self._ring is None:
+            return True
+
+        return self._ring.get(fid, self._alive) == self._shard
+
+    def rebalance(self):
+        """Follows changes in the set of alive shards: files now owned by another
+        shard are released, with their position saved to the sincedb, and the
+        files this shard takes over are discovered and resumed from the sincedb
+        """
+        if self._ring is None or self._shards_alive is None:
+            return
+
+        alive = tuple(shard for shard in range(len(self._shards_alive))
+                      if self._shards_alive[shard] or shard == self._shard)
+        if alive == self._alive:
+            return
+
+        self._log_info('alive shards changed from {0} to {1}'.format(self._alive, alive))
+        self._alive = alive
+        for fid in self._tails.keys():
+            if not self.owns(fid):
+                self._log_debug('releasing {0}'.format(self._tails[fid].filename()))
+                self._remove_tail(fid)
+
+        if self._sincedb:
+            # Publish the released positions, and pick up the ones saved by other shards.
+            self._sincedb.flush()
+            self._sincedb.load()
+        else:
+            self._log_warning('without a sincedb, the files taken over start at their start_position')
+
+        self._update_time = None
+        self._discover_full = True
+
+    def _run_scheduled(self):
+        """Runs the tails that are due, and schedules their next run"""
+        for fid in self._scheduler.pop_due():
+            self._log_debug("Processing {0}".format(fid))
+            if self._shutdown_requested.is_set():
+                break
+
+            active = self._run_tail(fid)
+
+            tail = self._tails.get(fid)
+            if tail is not None:
+                self._scheduler.done(fid, active, pending=active is not None and tail.pending(),
+                                     deadline=tail.batch_deadline())
+
+    def _scheduled_wait(self, interval):
+        """Returns how long to wait for the next tail to be due, at most interval seconds"""
+        next_due = self._scheduler.next_due()
+        if next_due is None:
+            return interval
+
+        return min(max(next_due - time.time(), 0), interval)
+
+    def _run_watched(self, interval):
+        """Waits up to interval seconds for inotify events, and only runs the
+        tails whose files were modified, moved or deleted, along with the ones
+        that still had data to process. Every discover_interval seconds, all
+        tails get a pass as a safety net for missed events.
+        """
+        self._watch_directories()
+        if not self._watcher:
+            return
+
+        timeout = 0 if self._pending_fids else interval
+        fids, check_fids = self._read_watch_events(timeout)
+        fids.update(self._pending_fids)
+        fids.update(self._deferred_fids)
+        self._pending_fids = set()
+        self._deferred_fids = set()
+
+        if time.time() - self._sweep_time >= self._discover_interval:
+            self._sweep_time = time.time()
+            fids.update(self._tails.keys())
+
+        for fid in fids:
+            if self._shutdown_requested.is_set():
+                break
+
+            active = self._run_tail(fid, force_check=fid in check_fids)
+
+            tail = self._tails.get(fid)
+            if tail is None:
+                continue
+            elif active is None:
+                self._deferred_fids.add(fid)
+            elif tail.pending():
+                self._pending_fids.add(fid)
+            elif tail.rotating() or tail.batch_deadline() is not None:
+                # The renamed file gets no event under its old name, and a
+                # partial batch is shipped on time even if no event comes.
+                self._deferred_fids.add(fid)
+
+    def _read_watch_events(self, timeout):
+        """Returns the fids of the tails to run, and of those whose file
+        must be checked for rotation, removal or truncation
+        """
+        fids = set()
+        check_fids = set()
+        for wd, mask, cookie, name in self._watcher.read_events(timeout):
+            if mask & inotify.IN_Q_OVERFLOW:
+                self._log_warning('inotify event queue overflowed, checking every file')
+                self._update_time = None
+                return set(self._tails.keys()), set(self._tails.keys())
+
+            directory = self._watched_directories.get(wd)
+            if directory is None:
+                continue
+
+            if mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_IGNORED):
+                self._log_debug('directory {0} removed or moved'.format(directory))
+                self._unwatch_directory(wd)
+                for filename, fid in self._fids_by_filename.items():
+                    if os.path.dirname(filename) == directory:
+                        fids.add(fid)
+                        check_fids.add(fid)
+                continue
+
+            if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                # A new file may match a glob, discover it right away.
+                self._update_time = None
+
+            fid = self._fids_by_filename.get(os.path.join(directory, name))
+            if fid is None:
+                continue
+
+            fids.add(fid)
+            if mask & ~inotify.IN_MODIFY:
+                check_fids.add(fid)
+
+        return fids, check_fids
+
+    def _watch_directories(self):
+        """Adds an inotify watch on every directory holding a tailed file or
+        matched by a glob, so new files are noticed as soon as they appear
+        """
+        if not self._watch_dirty:
+            return
+
+        self._watch_dirty = False
+        directories = set(os.path.dirname(filename) for filename in self._fids_by_filename)
+        if len(self._beaver_config.get('globs')) > 0:
+            for name in self._beaver_config.get('globs'):
+                directory = os.path.dirname(name)
+                if directory and not glob.has_magic(directory):
+                    directories.add(os.path.realpath(directory))
+        elif self._folder:
+            directories.add(os.path.realpath(self._folder))
+
+        for directory in directories:
+            if directory in self._directory_wds:
+                continue
+
+            try:
+                wd = self._watcher.add_watch(directory)
+            except OSError, e:
+                if e.errno == errno.ENOENT:
+                    continue
+                self._log_warning('cannot watch {0}, polling files instead: {1}'.format(directory, e))
+                self._watcher.close()
+                self._watcher = None
+                for tail in self._tails.values():
+                    tail.set_stat_sweep(False)
+                return
+
+            self._directory_wds[directory] = wd
+            self._watched_directories[wd] = directory
+
+    def _unwatch_directory(self, wd):
+        directory = self._watched_directories.pop(wd, None)
+        self._directory_wds.pop(directory, None)
+        self._watcher.rm_watch(wd)
+        self._watch_dirty = True
 
     def update_files(self):
         """Ensures all files are properly loaded.
@@ -98,10 +645,21 @@ class TailManager(multiprocessing.Process, BaseLog):
         possible_files = []
         files = []
         if len(self._beaver_config.get('globs')) > 0:
+            if self._discovery is None:
+                self._discovery = GlobDiscovery(self._beaver_config.get('globs'))
+
+            full, self._discover_full = self._discover_full, False
             extend_files = files.extend
-            for name, exclude in self._beaver_config.get('globs').items():
-                globbed = [os.path.realpath(filename) for filename in eglob(name, exclude)]
-                extend_files(globbed)
+            for name, globbed in self._discovery.discover(full=full).items():
+                extend_files(os.path.realpath(filename) for filename in globbed)
+
+            # Every consumer learns the file config of every match, including
+            # consumers respawned since the matches were first found, so the
+            # full cached match list is sent on each pass.
+            for name, globbed in self._discovery.matches().items():
+                if not globbed:
+                    continue
+                globbed = [os.path.realpath(filename) for filename in globbed]
                 self._beaver_config.addglob(name, globbed)
                 self._callback(("addglob", (name, globbed)))
         else:
@@ -109,29 +667,86 @@ class TailManager(multiprocessing.Process, BaseLog):
             for name in self.listdir():
                 append_files(os.path.realpath(os.path.join(self._folder, name)))
 
+        # Every path is statted once per sweep, and the stat of a tailed file
+        # is also its rotation check.
+        files.extend(self._old_files)
+        files.extend(self._retry_files)
+        files.extend(self._corrupt_files)
+        files.extend(self._fids_by_filename)
+        self._old_files = set()
+        self._retry_files = set()
+
+        statted = set()
         for absname in files:
+            if absname in statted:
+                continue
+            statted.add(absname)
+
             try:
                 st = os.stat(absname)
             except EnvironmentError, err:
                 if err.errno != errno.ENOENT:
                     raise
+                self._corrupt_files.pop(absname, None)
+                self._check_path(absname, None)
             else:
+                self._check_path(absname, st)
+                if absname in self._corrupt_files:
+                    if self._corrupt_files[absname] == (st.st_size, st.st_mtime):
+                        continue
+                    del self._corrupt_files[absname]
+
                 if not stat.S_ISREG(st.st_mode):
                     continue
                 elif (int(self._beaver_config.get('ignore_old_files_days')) > 0 or \
                      int(self._beaver_config.get('ignore_old_files_hours')) > 0 or \
                      int(self._beaver_config.get('ignore_old_files_minutes')) > 0 \
                      ) and datetime.datetime.fromtimestamp(st.st_mtime) < (datetime.datetime.today() - datetime.timedelta(days=int(self._beaver_config.get('ignore_old_files_days')), hours=int(self._beaver_config.get('ignore_old_files_hours')), minutes=int(self._beaver_config.get('ignore_old_files_minutes')))): 
+                    self._old_files.add(absname)
                     self._logger.debug('[{0}] - file {1} older then {2} days {3} hours {4} minutes so ignoring it'.format(self.get_file_id(st), absname, self._beaver_config.get('ignore_old_files_days'), self._beaver_config.get('ignore_old_files_hours'), self._beaver_config.get('ignore_old_files_minutes')))
                     continue
                 append_possible_files = possible_files.append
                 fid = self.get_file_id(st)
+                if not self.owns(fid):
+                    continue
                 append_possible_files((fid, absname))
 
         # add new ones
-        new_files = [fname for fid, fname in possible_files if fid not in self._tails]
+        # A path still followed by a tail is a rotated file being read to its end,
+        # the tail switches to the new file itself.
+        new_files = [fname for fid, fname in possible_files
+                     if fid not in self._tails and fname not in self._fids_by_filename]
         self.watch(new_files)
 
+    def _check_path(self, filename, st):
+        """Hands a stat of filename to the tail following it, if any"""
+        fid = self._fids_by_filename.get(filename)
+        tail = self._tails.get(fid)
+        if tail is None:
+            return
+
+        tail.check_path(st)
+        if not tail.active:
+            self._remove_tail(fid)
+
+    def log_metrics(self):
+        """Every metrics_interval seconds, logs the read metrics of every file"""
+        if not self._metrics_interval or time.time() - self._metrics_time < self._metrics_interval:
+            return
+
+        self._metrics_time = time.time()
+        if self._spill is not None:
+            self._log_debug('spill_bytes={0} spilled_bytes={1} replayed_bytes={2}'.format(
+                len(self._spill), self._spill.spilled_bytes, self._spill.replayed_bytes))
+
+        for fid in self._tails:
+            metrics = self._tails[fid].metrics()
+            self._log_debug('[{0}] - read_size={1} bytes_read={2} reads={3} budget_exhausted={4} '
+                            'ignoreline_dropped={5}'.format(metrics['filename'], metrics['read_size'],
+                                                            metrics['bytes_read'], metrics['reads'],
+                                                            metrics['budget_exhausted'],
+                                                            metrics['ignoreline_dropped']))
+
     def close(self, signalnum=None, frame=None):
         """Closes all currently open Tail objects"""
         self._log_info("Closing all tail objects")
@@ -149,7 +764,7 @@ class ConsumerManager(multiprocessing.Process, BaseLog):
         """
         Separate process who's sole responsibility is to monitor and respawn consumer processes.
         We keep this logic in a separate simple process to avoid accidental memory leaks while forking.
-        :param queue_consumer_function: The function to call to create a queue consumer.
+        :param queue_consumer_function: The function to call to create a queue consumer, with the consumer number.
         :param number_of_consumer_processes: The number of queue consumers to run in parallel
         :param interval: How often to check and refresh consumers that have died.
         :param logger: An optional logger.
@@ -196,5 +811,9 @@ class ConsumerManager(multiprocessing.Process, BaseLog):
     def _create_queue_consumer_if_required(self):
         for n in range(0, self._number_of_consumer_processes):
             if not (self._proc[n] and self._proc[n].is_alive()):
+                if self._proc[n] and not self.stop_flag.is_set():
+                    # With consumer_routing set to file, the new process takes
+                    # over the queue of the dead one, and so its files.
+                    self._log_info("consumer process {0} died, replacing it".format(n))
                 self._log_debug("creating consumer process: {0}".format(n))
-                self._proc[n] = self._start_consumer()
+                self._proc[n] = self._start_consumer(n)
@@ -0,0 +1,62 @@
+# ~*~ encoding: utf-8 ~*~
+"""Compares the throughput of the ipc channels between a producer and a consumer process,
+with and without the file registry.
+
+    python -m tests.benchmark_ipc [batches] [lines per batch]
+"""
+import multiprocessing
+import sys
+import time
+
+from beaver.file_registry import FileRegistry
+from beaver.ring_queue import RingQueue
+
+
+def _produce(queue, registry, batches, lines_per_batch):
+    lines = [u'127.0.0.1 - - [01/Jan/2016:00:00:00 +0000] "GET /index.html HTTP/1.1" 200 {0}'.format(i)
+             for i in range(lines_per_batch)]
+    pack = registry.pack if registry is not None else lambda item: item
+    for i in range(batches):
+        queue.put(pack(('callback', {
+            'fields': {'environment': 'production', 'role': 'web'},
+            'filename': '/var/log/nginx/access-{0}.log'.format(i % 16),
+            'format': None,
+            'ignore_empty': False,
+            'lines': lines,
+            'timestamp': '2016-01-01T00:00:00.000Z',
+            'tags': ['nginx', 'access'],
+            'type': 'nginx',
+        })))
+    queue.put(('exit', ()))
+
+
+def benchmark(queue, registry, batches, lines_per_batch):
+    producer = multiprocessing.Process(target=_produce, args=(queue, registry, batches, lines_per_batch))
+    start = time.time()
+    producer.start()
+    while True:
+        item = queue.get()
+        if item[0] == 'exit':
+            break
+        if registry is not None:
+            registry.unpack(item)
+    elapsed = time.time() - start
+    producer.join()
+    return elapsed
+
+
+def main(batches=20000, lines_per_batch=10):
+    channels = [
+        ('queue', lambda: multiprocessing.JoinableQueue(100)),
+        ('ring', lambda: RingQueue(64 * 1024 * 1024, 100)),
+    ]
+    for name, create_queue in channels:
+        for registry in (None, FileRegistry(1024 * 1024)):
+            elapsed = benchmark(create_queue(), registry, batches, lines_per_batch)
+            print('{0:>16}: {1} batches of {2} lines in {3:.3f}s, {4:.0f} lines/s'.format(
+                name + (' + registry' if registry is not None else ''), batches, lines_per_batch, elapsed,
+                batches * lines_per_batch / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
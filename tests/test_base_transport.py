@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import json
+import logging
+import mock
+import tempfile
+
+from beaver.config import BeaverConfig
+from beaver.transports.base_transport import BaseTransport
+
+
+class BaseTransportFormatTests(unittest.TestCase):
+
+    def _get_transport(self, format):
+        empty_conf = tempfile.NamedTemporaryFile(delete=True)
+        beaver_config = BeaverConfig(mock.Mock(config=empty_conf.name))
+        beaver_config.set('logstash_version', 1)
+        beaver_config.set('format', format)
+        return BaseTransport(beaver_config, logger=logging.getLogger(__name__))
+
+    def test_format_unicode_line(self):
+        transport = self._get_transport('raw')
+        self.assertEqual(u'caf\xe9', transport.format('/tmp/a.log', u'caf\xe9\n', '2016-01-01T00:00:00.000Z', fields={}))
+
+    def test_format_raw_ascii_bytes_are_not_decoded(self):
+        transport = self._get_transport('raw')
+        formatted = transport.format('/tmp/a.log', 'plain ascii \n', '2016-01-01T00:00:00.000Z', fields={})
+        self.assertIsInstance(formatted, str)
+        self.assertEqual('plain ascii', formatted)
+
+    def test_format_bytes_are_decoded_once(self):
+        transport = self._get_transport('raw')
+        self.assertEqual(u'caf\xe9', transport.format('/tmp/a.log', 'caf\xc3\xa9', '2016-01-01T00:00:00.000Z', fields={}))
+        # Lines the file encoding cannot decode fall back to the other ENCODINGS.
+        self.assertEqual(u'caf\xe9', transport.format('/tmp/a.log', 'caf\xe9', '2016-01-01T00:00:00.000Z', fields={}))
+
+        transport = self._get_transport('json')
+        formatted = transport.format('/tmp/a.log', 'caf\xc3\xa9', '2016-01-01T00:00:00.000Z', fields={})
+        self.assertEqual(u'caf\xe9', json.loads(formatted)['message'])
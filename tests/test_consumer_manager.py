@@ -33,6 +33,29 @@ class TestConsumerManager(unittest.TestCase):
             # Graceful shutdown por favor.
             self.assertFalse(thread.is_alive())
 
+    def test_dead_consumer_is_replaced_on_its_queue(self):
+        queue_consumer_func = Mock()
+        manager = ConsumerManager(queue_consumer_func, number_of_consumer_processes=2, interval=0.1)
+        thread = threading.Thread(target=manager.run)
+        thread.daemon = True
+        manager.join = lambda *args, **kwargs: thread.join(*args, **kwargs)
+
+        # The second consumer dies once.
+        first, second, replacement = Mock(), Mock(), Mock()
+        first.is_alive.return_value = True
+        second.is_alive.side_effect = [False, True]
+        replacement.is_alive.return_value = True
+        queue_consumer_func.side_effect = [first, second, replacement]
+
+        try:
+            thread.start()
+            self._assert_eventually(lambda: queue_consumer_func.call_count == 3, 2.0)
+        finally:
+            manager.stop(2.0)
+            self.assertFalse(thread.is_alive())
+
+        self.assertEqual([((0,), {}), ((1,), {}), ((1,), {})], queue_consumer_func.call_args_list)
+
     def _assert_eventually(self, condition, timeout):
         start_time = time.time()
         while time.time() - start_time < timeout:
@@ -0,0 +1,82 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import bz2
+import gzip
+import io
+import os
+import tempfile
+
+from beaver.worker.decompressors import DecompressingReader, DecompressionError
+
+
+class TestDecompressingReader(unittest.TestCase):
+
+    def setUp(self):
+        self.members = [''.join('member{0} line{1}\n'.format(m, i) for i in range(200)) for m in range(3)]
+        self.data = ''.join(self.members)
+
+    def _gzip_member(self, data):
+        buf = io.BytesIO()
+        gz = gzip.GzipFile(fileobj=buf, mode='wb')
+        gz.write(data)
+        gz.close()
+        return buf.getvalue()
+
+    def _write(self, suffix, compress):
+        filename = tempfile.NamedTemporaryFile(delete=False, suffix=suffix).name
+        self.addCleanup(os.unlink, filename)
+        with open(filename, 'wb') as f:
+            for member in self.members:
+                f.write(compress(member))
+        return filename
+
+    def _assert_reads_members(self, filename):
+        reader = DecompressingReader(filename, buffer_size=100)
+        self.assertEqual(self.data[:10], reader.read(10))
+        self.assertEqual(self.data[10:], reader.read())
+        self.assertEqual('', reader.read(10))
+        self.assertEqual(len(self.data), reader.tell())
+
+        # One checkpoint per member, at its decompressed offset.
+        checkpoint = reader.checkpoint(len(self.data) - 1)
+        compressed_offset, offset = [int(value) for value in checkpoint.split(':')]
+        self.assertEqual(len(self.members[0]) + len(self.members[1]), offset)
+
+        # Decompression restarts at the checkpoint, not at the start of the file.
+        reader = DecompressingReader(filename, buffer_size=100)
+        self.assertTrue(reader.restore(checkpoint))
+        self.assertEqual(offset, reader.tell())
+        reader.seek(offset + 7)
+        self.assertEqual(self.data[offset + 7:], reader.read())
+
+    def test_gzip_members(self):
+        self._assert_reads_members(self._write('.gz', self._gzip_member))
+
+    def test_bz2_streams(self):
+        self._assert_reads_members(self._write('.bz2', bz2.compress))
+
+    def test_readline_and_seek(self):
+        reader = DecompressingReader(self._write('.gz', self._gzip_member), buffer_size=64)
+        self.assertEqual('member0 line0\n', reader.readline())
+        reader.seek(0, os.SEEK_END)
+        self.assertEqual(len(self.data), reader.tell())
+        reader.seek(len(self.members[0]))
+        self.assertEqual('member1 line0\n', reader.readline())
+        self.assertEqual('member1 line1\n', reader.readline())
+
+    def test_restore_rejects_invalid_checkpoints(self):
+        reader = DecompressingReader(self._write('.gz', self._gzip_member))
+        self.assertFalse(reader.restore(None))
+        self.assertFalse(reader.restore('garbage'))
+        self.assertFalse(reader.restore('{0}:10'.format(10 ** 9)))
+
+    def test_corrupt_data_raises_decompression_error(self):
+        filename = self._write('.gz', lambda member: self._gzip_member(member)[:10] + 'x' * 100)
+        reader = DecompressingReader(filename)
+        with self.assertRaises(DecompressionError):
+            reader.read()
@@ -0,0 +1,84 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import mock
+import os
+import shutil
+import tempfile
+import time
+
+from beaver.utils import eglob
+from beaver.worker.discovery import GlobDiscovery, glob_matches
+
+
+class TestGlobDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        for path in ['a.log', 'b.log', 'c.txt', '.hidden.log', 'app/x.log', 'app/y.err', 'app/deep/z.log',
+                     'web/access.log', 'web/error.log', 'web/old/access.log', 'db1/q.log', 'db2/q.log']:
+            self._touch(path)
+
+    def _touch(self, path):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'a'):
+            pass
+
+    def _settle(self, mtime=1000000000):
+        # Move the mtime of recently modified directories past the settle delay.
+        for directory, _, _ in os.walk(self.root):
+            if os.stat(directory).st_mtime > time.time() - 60:
+                os.utime(directory, (mtime, mtime))
+
+    def _globs(self):
+        return {
+            os.path.join(self.root, '*.log'): '',
+            os.path.join(self.root, 'app/**/*.log'): '',
+            os.path.join(self.root, 'web/{access,error}.log'): 'error',
+            os.path.join(self.root, 'db?/q.log'): '',
+        }
+
+    def test_matches_eglob(self):
+        globs = self._globs()
+        matches = GlobDiscovery(globs).discover()
+        for name, exclude in globs.items():
+            self.assertEqual(sorted(eglob(name, exclude)), sorted(matches[name]), name)
+
+    def test_lists_changed_directories_only(self):
+        discovery = GlobDiscovery(self._globs())
+        self._settle()
+        discovery.discover()
+        self.assertEqual([], sum(discovery.discover().values(), []))
+
+        self._touch('app/deep/new.log')
+        self._touch('app/deep/new.txt')
+        self._settle(mtime=1000000001)
+        with_listing = []
+        original = discovery._list
+        discovery._list = lambda directory: with_listing.append(directory) or original(directory)
+        # The matches of the changed directory are returned again, along with the new file.
+        self.assertEqual([os.path.join(self.root, 'app/deep', name) for name in ['new.log', 'z.log']],
+                         sorted(sum(discovery.discover().values(), [])))
+        self.assertEqual([os.path.join(self.root, 'app/deep')], with_listing)
+
+        # A full pass returns every match without listing anything again.
+        self.assertEqual(8, len(sum(discovery.discover(full=True).values(), [])))
+        self.assertEqual(1, len(with_listing))
+
+        # So does matches, without any stat.
+        with mock.patch('os.stat') as stat:
+            self.assertEqual(8, len(sum(discovery.matches().values(), [])))
+        self.assertFalse(stat.called)
+
+    def test_glob_matches(self):
+        globs = self._globs()
+        for path, expected in [('a.log', True), ('c.txt', False), ('.hidden.log', False), ('app/deep/z.log', True),
+                               ('web/access.log', True), ('web/error.log', False), ('db1/q.log', True)]:
+            self.assertEqual(expected, glob_matches(os.path.join(self.root, path), globs), path)
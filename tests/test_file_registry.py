@@ -0,0 +1,78 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import multiprocessing
+
+from beaver.file_registry import FileRegistry
+
+
+def _callback(filename, lines, **kwargs):
+    data = {
+        'fields': {'env': 'test'},
+        'filename': filename,
+        'format': None,
+        'ignore_empty': False,
+        'lines': lines,
+        'timestamp': '2016-01-01T00:00:00.000Z',
+        'tags': ['a', 'b'],
+        'type': 'file',
+    }
+    data.update(kwargs)
+    return ('callback', data)
+
+
+def _produce(registry, queue, filename):
+    queue.put(registry.pack(_callback(filename, ['line'])))
+
+
+class FileRegistryTests(unittest.TestCase):
+
+    def test_pack_sends_the_file_id(self):
+        registry = FileRegistry(4096)
+        command, data = registry.pack(_callback('/a.log', ['a1']))
+
+        self.assertEqual(command, 'callback')
+        self.assertEqual(data, (0, '2016-01-01T00:00:00.000Z', ['a1']))
+        self.assertEqual(registry.unpack((command, data)), _callback('/a.log', ['a1']))
+
+    def test_file_id_changes_with_metadata(self):
+        registry = FileRegistry(4096)
+        first = registry.pack(_callback('/a.log', ['a1']))[1][0]
+        second = registry.pack(_callback('/a.log', ['a2']))[1][0]
+        third = registry.pack(_callback('/a.log', ['a3'], tags=['c']))[1][0]
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, third)
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.unpack(('callback', (third, None, [])))[1]['tags'], ['c'])
+
+    def test_consumer_resolves_ids_registered_by_other_processes(self):
+        registry = FileRegistry(4096)
+        queue = multiprocessing.Queue()
+        for filename in ('/a.log', '/b.log', '/a.log'):
+            proc = multiprocessing.Process(target=_produce, args=(registry, queue, filename))
+            proc.start()
+            proc.join()
+
+        items = [registry.unpack(queue.get(timeout=5)) for _ in range(3)]
+
+        self.assertEqual([data['filename'] for _, data in items], ['/a.log', '/b.log', '/a.log'])
+        self.assertEqual(len(registry), 2)
+
+    def test_full_registry_sends_metadata(self):
+        registry = FileRegistry(64)
+        item = registry.pack(_callback('/a.log', ['a1']))
+
+        self.assertEqual(item, _callback('/a.log', ['a1']))
+        self.assertEqual(registry.unpack(item), item)
+
+    def test_other_commands_are_unchanged(self):
+        registry = FileRegistry(4096)
+        item = ('addglob', ('/c/*.log', ['/c/1.log']))
+
+        self.assertEqual(registry.pack(item), item)
+        self.assertEqual(registry.unpack(item), item)
@@ -0,0 +1,79 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import mock
+import os
+import shutil
+import tempfile
+import time
+
+from beaver.config import BeaverConfig
+from beaver.worker import inotify
+from beaver.worker.tail_manager import TailManager
+
+
+@unittest.skipUnless(inotify.is_supported(), 'inotify is not available')
+class TestInotify(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _path(self, name):
+        return os.path.join(os.path.realpath(self.directory), name)
+
+    def test_directory_events(self):
+        watcher = inotify.Inotify()
+        self.addCleanup(watcher.close)
+        wd = watcher.add_watch(self.directory)
+        self.assertEqual([], watcher.read_events())
+
+        with open(self._path('a.log'), 'w') as f:
+            f.write('line\n')
+        os.rename(self._path('a.log'), self._path('b.log'))
+
+        events = [(event_wd, mask & (inotify.IN_CREATE | inotify.IN_MODIFY | inotify.IN_MOVED_FROM |
+                                     inotify.IN_MOVED_TO), name)
+                  for event_wd, mask, cookie, name in watcher.read_events(1)]
+        self.assertIn((wd, inotify.IN_CREATE, 'a.log'), events)
+        self.assertIn((wd, inotify.IN_MODIFY, 'a.log'), events)
+        self.assertIn((wd, inotify.IN_MOVED_FROM, 'a.log'), events)
+        self.assertIn((wd, inotify.IN_MOVED_TO, 'b.log'), events)
+
+    def test_tail_manager_runs_modified_files_only(self):
+        for name in ['a.log', 'b.log']:
+            with open(self._path(name), 'w') as f:
+                f.write('')
+
+        empty_conf = tempfile.NamedTemporaryFile(delete=True)
+        beaver_config = BeaverConfig(mock.Mock(config=empty_conf.name))
+        beaver_config.set('wait_before_send', 0)
+        callback = mock.Mock()
+        manager = TailManager(beaver_config, queue_consumer_function=mock.Mock(), callback=callback,
+                              logger=mock.Mock())
+        manager._watcher = inotify.Inotify()
+        self.addCleanup(manager._watcher.close)
+        manager.watch([self._path('a.log'), self._path('b.log')])
+        manager._run_watched(0)
+
+        with open(self._path('b.log'), 'a') as f:
+            f.write('new line\n')
+
+        tails = dict((tail.filename(), tail) for tail in manager._tails.values())
+        with mock.patch.object(tails[self._path('a.log')], 'run') as run_a:
+            manager._run_watched(1)
+            self.assertFalse(run_a.called)
+
+        callback.assert_called_once()
+        self.assertEqual([u'new line'], callback.call_args[0][0][1]['lines'])
+
+        # Creating a file in the watched directory triggers discovery right away.
+        manager._update_time = int(time.time())
+        with open(self._path('c.log'), 'w') as f:
+            f.write('')
+        manager._run_watched(1)
+        self.assertEqual(None, manager._update_time)
@@ -0,0 +1,76 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import collections
+import random
+import re
+
+from beaver.utils import MultilineMerger, multiline_merge
+
+
+class TestMultilineMerger(unittest.TestCase):
+
+    def _corpus(self, seed, count=500):
+        rand = random.Random(seed)
+        choices = [
+            'Exception in thread "main" java.lang.RuntimeException',
+            '\tat com.example.Foo.bar(Foo.java:42)',
+            '\tat com.example.Foo.main(Foo.java:7)',
+            'Caused by: java.io.IOException \\',
+            '2016-01-01 12:00:00 INFO started',
+            'continued line \\',
+            '',
+        ]
+        return [rand.choice(choices) for _ in range(count)]
+
+    def _merge_blocks(self, merge, lines, seed):
+        rand = random.Random(seed)
+        events = []
+        start = 0
+        while start < len(lines):
+            end = start + rand.randint(0, 20)
+            events += merge(lines[start:end])
+            start = end
+        return events
+
+    def _assert_identical(self, re_after, re_before):
+        for seed in range(5):
+            lines = self._corpus(seed)
+
+            expected_event = collections.deque([])
+            expected = self._merge_blocks(
+                lambda block: multiline_merge(block, expected_event, re_after, re_before), lines, seed)
+
+            current_event = collections.deque([])
+            merger = MultilineMerger(current_event, re_after=re_after, re_before=re_before)
+            events = self._merge_blocks(merger.merge, lines, seed)
+
+            self.assertEqual(expected, events)
+            self.assertEqual(list(expected_event), list(current_event))
+
+    def test_identical_to_multiline_merge_before(self):
+        self._assert_identical(None, re.compile(r'(\tat |Caused by)'))
+
+    def test_identical_to_multiline_merge_after(self):
+        self._assert_identical(re.compile(r'.*\\$'), None)
+
+    def test_identical_to_multiline_merge_both(self):
+        self._assert_identical(re.compile(r'.*\\$'), re.compile(r'\s'))
+
+    def test_max_lines(self):
+        current_event = collections.deque([])
+        merger = MultilineMerger(current_event, re_before=re.compile(r'\s'), max_lines=3)
+        events = merger.merge(['start', ' 1', ' 2', ' 3', ' 4', 'next'])
+        self.assertEqual(['start\n 1\n 2', ' 3\n 4'], events)
+        self.assertEqual(['next'], list(current_event))
+
+    def test_max_bytes(self):
+        current_event = collections.deque([])
+        merger = MultilineMerger(current_event, re_before=re.compile(r'\s'), max_bytes=10)
+        events = merger.merge(['start', ' 1', ' 2', ' 3', 'next'])
+        self.assertEqual(['start\n 1', ' 2\n 3'], events)
+        self.assertEqual(['next'], list(current_event))
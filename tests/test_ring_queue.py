@@ -0,0 +1,115 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import multiprocessing
+import Queue
+
+from beaver.ring_queue import RingQueue
+
+
+def _callback(filename, lines, **kwargs):
+    data = {
+        'fields': {'env': 'test'},
+        'filename': filename,
+        'format': None,
+        'ignore_empty': False,
+        'lines': lines,
+        'timestamp': '2016-01-01T00:00:00.000Z',
+        'tags': ['a', 'b'],
+        'type': 'file',
+    }
+    data.update(kwargs)
+    return ('callback', data)
+
+
+def _produce(queue, count):
+    for i in range(count):
+        queue.put(_callback('/var/log/{0}.log'.format(i % 3), [u'line {0}'.format(i)]))
+    queue.put(('exit', ()))
+
+
+class TestRingQueue(unittest.TestCase):
+
+    def test_round_trip(self):
+        queue = RingQueue(4096)
+        self.assertTrue(queue.empty())
+        item = _callback('/var/log/a.log', [u'caf\xe9', 'raw bytes'])
+        queue.put(item)
+        queue.put(('addglob', ('/var/log/*.log', ['/var/log/a.log'])))
+        self.assertEqual(2, queue.qsize())
+
+        self.assertEqual(item, queue.get())
+        self.assertEqual(('addglob', ('/var/log/*.log', ['/var/log/a.log'])), queue.get())
+        self.assertTrue(queue.empty())
+        self.assertRaises(Queue.Empty, queue.get, timeout=0.01)
+
+    def test_wraps_around_and_fills_up(self):
+        queue = RingQueue(256)
+        for i in range(100):
+            queue.put(('callback', {'filename': 'x', 'timestamp': None, 'lines': [str(i) * (i % 7)]}))
+            self.assertEqual([str(i) * (i % 7)], queue.get()[1]['lines'])
+
+        while True:
+            try:
+                queue.put_nowait(('addglob', ('x', ['y' * 20])))
+            except Queue.Full:
+                break
+        self.assertEqual(('addglob', ('x', ['y' * 20])), queue.get())
+        self.assertRaises(ValueError, queue.put, ('addglob', ('x', ['y' * 200])))
+
+    def test_splits_batches_larger_than_half_the_ring(self):
+        queue = RingQueue(16384)
+        lines = [u'line {0}'.format(i) for i in range(300)]
+        timestamps = ['2016-01-01T00:00:{0:02d}.000Z'.format(i % 60) for i in range(300)]
+        queue.put(_callback('/var/log/a.log', lines, timestamps=timestamps))
+        self.assertLess(1, queue.qsize())
+
+        items = [queue.get() for _ in range(queue.qsize())]
+        self.assertEqual(lines, sum((data['lines'] for command, data in items), []))
+        self.assertEqual(timestamps, sum((data['timestamps'] for command, data in items), []))
+        self.assertEqual(set(['/var/log/a.log']), set(data['filename'] for command, data in items))
+
+        # Batches packed by the FileRegistry too.
+        queue.put(('callback', (3, '2016-01-01T00:00:00.000Z', lines * 3)))
+        items = [queue.get() for _ in range(queue.qsize())]
+        self.assertLess(1, len(items))
+        self.assertEqual(lines * 3, sum((data[2] for command, data in items), []))
+        self.assertEqual(set([3]), set(data[0] for command, data in items))
+
+        # A single line larger than half the ring cannot be split.
+        self.assertRaises(ValueError, queue.put, _callback('/var/log/a.log', ['x' * 9000]))
+        self.assertTrue(queue.empty())
+
+    def test_maxsize(self):
+        queue = RingQueue(4096, maxsize=2)
+        queue.put(('exit', ()))
+        queue.put(('exit', ()))
+        self.assertTrue(queue.full())
+        self.assertRaises(Queue.Full, queue.put, ('exit', ()), timeout=0.01)
+        queue.get()
+        self.assertFalse(queue.full())
+        self.assertEqual(1, queue.qsize())
+
+    def test_between_processes(self):
+        queue = RingQueue(1024)
+        producers = [multiprocessing.Process(target=_produce, args=(queue, 500)) for _ in range(2)]
+        for producer in producers:
+            producer.start()
+
+        lines = []
+        exits = 0
+        while exits < 2:
+            command, data = queue.get(timeout=10)
+            if command == 'exit':
+                exits += 1
+            else:
+                self.assertEqual({'env': 'test'}, data['fields'])
+                lines.extend(data['lines'])
+
+        for producer in producers:
+            producer.join()
+        self.assertEqual(sorted([u'line {0}'.format(i) for i in range(500)] * 2), sorted(lines))
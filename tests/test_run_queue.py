@@ -0,0 +1,145 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import json
+import mock
+import multiprocessing
+import os
+import tempfile
+
+from beaver.config import BeaverConfig
+from beaver.run_queue import coalesce, run_queue
+from beaver.transports.base_transport import BaseTransport
+from beaver.worker.tail import Tail
+
+
+def _callback(filename, lines, **kwargs):
+    data = {
+        'fields': {'env': 'test'},
+        'filename': filename,
+        'format': None,
+        'ignore_empty': False,
+        'lines': lines,
+        'timestamp': '2016-01-01T00:00:00.000Z',
+        'tags': ['a', 'b'],
+        'type': 'file',
+    }
+    data.update(kwargs)
+    return ('callback', data)
+
+
+class RunQueueTests(unittest.TestCase):
+
+    def test_coalesce_merges_batches_of_a_file(self):
+        items = coalesce([
+            _callback('/a.log', ['a1']),
+            _callback('/b.log', ['b1']),
+            _callback('/a.log', ['a2', 'a3']),
+        ])
+
+        self.assertEqual([data['filename'] for _, data in items], ['/a.log', '/b.log'])
+        self.assertEqual(items[0][1]['lines'], ['a1', 'a2', 'a3'])
+
+    def test_coalesce_keeps_the_timestamp_of_every_line(self):
+        items = coalesce([
+            _callback('/a.log', ['a1']),
+            _callback('/a.log', ['a2', 'a3'], timestamp='2016-01-01T00:00:01.000Z'),
+        ])
+
+        self.assertEqual(1, len(items))
+        self.assertEqual(['a1', 'a2', 'a3'], items[0][1]['lines'])
+        self.assertEqual(['2016-01-01T00:00:00.000Z', '2016-01-01T00:00:01.000Z', '2016-01-01T00:00:01.000Z'],
+                         items[0][1]['timestamps'])
+
+    def test_coalesce_merges_batches_of_a_tail(self):
+        filename = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(os.unlink, filename)
+        empty_conf = tempfile.NamedTemporaryFile(delete=True)
+        beaver_config = BeaverConfig(mock.Mock(config=empty_conf.name))
+        beaver_config.set('logstash_version', 1)
+        beaver_config.set('format', 'json')
+        produced = []
+        tail = Tail(filename, produced.append, beaver_config=beaver_config)
+        for i in range(5):
+            with open(filename, 'a') as logfile:
+                logfile.write('line {0}\n'.format(i))
+            tail._run_pass()
+        tail.close()
+
+        timestamps = [data['timestamp'] for _, data in produced]
+        self.assertEqual(5, len(set(timestamps)))
+        items = coalesce([(command, dict(data)) for command, data in produced])
+        self.assertEqual(1, len(items))
+        self.assertEqual([u'line {0}'.format(i) for i in range(5)], items[0][1]['lines'])
+
+        # Transports ship every line with the timestamp of the batch it was read in.
+        transport = BaseTransport(beaver_config, logger=mock.Mock())
+        kwargs = dict(items[0][1])
+        lines = kwargs.pop('lines')
+        filename = kwargs.pop('filename')
+        events = [json.loads(transport.format(filename, line, timestamp, **kwargs))
+                  for line, timestamp in transport.timestamped_lines(lines, kwargs.pop('timestamp'), kwargs)]
+        self.assertEqual(timestamps, [event['@timestamp'] for event in events])
+        self.assertNotIn('timestamps', kwargs)
+
+    def test_coalesce_keeps_batches_with_other_metadata(self):
+        items = coalesce([
+            _callback('/a.log', ['a1']),
+            _callback('/a.log', ['a2'], tags=['c']),
+            _callback('/a.log', ['a3'], fields={'env': 'prod'}),
+        ])
+
+        self.assertEqual([data['lines'] for _, data in items], [['a1'], ['a2'], ['a3']])
+
+    def test_coalesce_does_not_merge_across_commands(self):
+        items = coalesce([
+            _callback('/a.log', ('a1',)),
+            ('addglob', ('/c/*.log', {})),
+            _callback('/a.log', ('a2',)),
+        ])
+
+        self.assertEqual([command for command, _ in items], ['callback', 'addglob', 'callback'])
+        self.assertEqual(items[0][1]['lines'], ['a1'])
+        self.assertEqual(items[2][1]['lines'], ['a2'])
+
+    def test_run_queue_ships_merged_batches(self):
+        empty_conf = tempfile.NamedTemporaryFile(delete=True)
+        beaver_config = BeaverConfig(mock.Mock(config=empty_conf.name))
+        beaver_config.set('queue_coalesce_max_items', 10)
+        beaver_config.set('queue_coalesce_max_wait_ms', 1000)
+        queue = multiprocessing.Queue()
+        for i in range(3):
+            queue.put(_callback('/a.log', ['line {0}'.format(i)]))
+        queue.put(('exit', ()))
+
+        transport = mock.Mock()
+        transport.valid.return_value = True
+        with mock.patch('beaver.run_queue.create_transport', return_value=transport):
+            with mock.patch('beaver.run_queue.signal'):
+                run_queue(queue, beaver_config, logger=mock.Mock())
+
+        self.assertEqual(transport.callback.call_count, 1)
+        self.assertEqual(transport.callback.call_args[1]['lines'], ['line 0', 'line 1', 'line 2'])
+
+    def test_run_queue_drops_the_timestamps_of_empty_lines(self):
+        empty_conf = tempfile.NamedTemporaryFile(delete=True)
+        beaver_config = BeaverConfig(mock.Mock(config=empty_conf.name))
+        beaver_config.set('queue_coalesce_max_items', 10)
+        queue = multiprocessing.Queue()
+        queue.put(_callback('/a.log', ['a1', ''], ignore_empty=True))
+        queue.put(_callback('/a.log', ['a2'], ignore_empty=True, timestamp='2016-01-01T00:00:01.000Z'))
+        queue.put(('exit', ()))
+
+        transport = mock.Mock()
+        transport.valid.return_value = True
+        with mock.patch('beaver.run_queue.create_transport', return_value=transport):
+            with mock.patch('beaver.run_queue.signal'):
+                run_queue(queue, beaver_config, logger=mock.Mock())
+
+        self.assertEqual(['a1', 'a2'], transport.callback.call_args[1]['lines'])
+        self.assertEqual(['2016-01-01T00:00:00.000Z', '2016-01-01T00:00:01.000Z'],
+                         transport.callback.call_args[1]['timestamps'])
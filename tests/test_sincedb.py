@@ -0,0 +1,77 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import sqlite3
+import tempfile
+import threading
+
+from beaver.worker.sincedb import SincedbStore
+
+
+class TestSincedbStore(unittest.TestCase):
+
+    def setUp(self):
+        self.sincedb_path = tempfile.NamedTemporaryFile(delete=True).name
+
+    def _rows(self):
+        conn = sqlite3.connect(self.sincedb_path, isolation_level=None)
+        return conn.execute('select fid, filename, position, byte_offset from sincedb order by fid').fetchall()
+
+    def test_updates_are_batched_until_flush(self):
+        store = SincedbStore(self.sincedb_path, flush_interval=3600)
+        store.load()
+        store.update('fid1', '/a.log', 1, 10, None)
+        store.update('fid2', '/b.log', 2, 20, None)
+        store.update('fid1', '/a.log', 3, 30, None)
+
+        self.assertEqual([], self._rows())
+        self.assertEqual((3, 30, None, None), store.get('fid1', '/a.log'))
+
+        self.assertTrue(store.flush())
+        self.assertEqual([('fid1', '/a.log', 3, 30), ('fid2', '/b.log', 2, 20)], self._rows())
+        self.assertFalse(store.flush())
+
+    def test_wal_mode_and_bulk_load(self):
+        store = SincedbStore(self.sincedb_path)
+        store.update('fid1', '/a.log', 1, 10, '10:abc', '0:0')
+        store.close()
+
+        conn = sqlite3.connect(self.sincedb_path, isolation_level=None)
+        self.assertEqual('wal', conn.execute('pragma journal_mode').fetchone()[0])
+
+        store = SincedbStore(self.sincedb_path)
+        store.load()
+        conn.execute('delete from sincedb')
+        self.assertEqual((1, 10, '10:abc', '0:0'), store.get('fid1', '/a.log'))
+
+    def test_remove(self):
+        store = SincedbStore(self.sincedb_path, flush_interval=3600)
+        store.update('fid1', '/a.log', 1, 10, None)
+        store.flush()
+        store.remove('fid1', '/a.log')
+        self.assertEqual(None, store.get('fid1', '/a.log'))
+        store.close()
+        self.assertEqual([], self._rows())
+
+    def test_shared_between_threads(self):
+        store = SincedbStore(self.sincedb_path)
+        store.load()
+
+        def update(thread):
+            for i in range(50):
+                store.update('fid{0}'.format(thread), '/{0}.log'.format(thread), i, i * 10, None)
+                store.get('missing{0}'.format(i), '/missing.log')
+
+        threads = [threading.Thread(target=update, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        store.close()
+        self.assertEqual([('fid{0}'.format(thread), '/{0}.log'.format(thread), 49, 490) for thread in range(4)],
+                         self._rows())
@@ -0,0 +1,134 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+
+from beaver.worker.spill_queue import SpillQueue
+
+
+class _BoundedQueue(object):
+    """Queue.Queue with the put signature of the dispatcher callback, whose
+    blocking puts give up after a short timeout
+    """
+
+    def __init__(self, maxsize):
+        self.queue = Queue.Queue(maxsize)
+
+    def put(self, item, block=True):
+        self.queue.put(item, block, 0.1)
+
+    def drain(self):
+        items = []
+        while not self.queue.empty():
+            items.append(self.queue.get())
+        return items
+
+
+def _callback(i):
+    return ('callback', {'filename': '/a.log', 'lines': [u'line {0}'.format(i)]})
+
+
+class SpillQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _spill_queue(self, queue, **kwargs):
+        return SpillQueue(os.path.join(self.path, 'shard-0'), queue.put, queue_size=queue.queue.qsize,
+                          max_queue_size=queue.queue.maxsize, logger=None, **kwargs)
+
+    def test_spilled_items_are_replayed_in_order(self):
+        queue = _BoundedQueue(10)
+        spill = self._spill_queue(queue, high_water=0.5, segment_size=64)
+        for i in range(20):
+            spill.put(_callback(i))
+
+        self.assertEqual(5, queue.queue.qsize())
+        self.assertGreater(len(spill), 0)
+        self.assertGreater(len(os.listdir(os.path.join(self.path, 'shard-0'))), 1)
+
+        items = queue.drain()
+        while len(spill):
+            spill.replay()
+            items.extend(queue.drain())
+
+        self.assertEqual([_callback(i) for i in range(20)], items)
+        self.assertEqual(spill.spilled_bytes, spill.replayed_bytes)
+        self.assertEqual([], os.listdir(os.path.join(self.path, 'shard-0')))
+
+    def test_items_are_spilled_until_the_spill_is_replayed(self):
+        queue = _BoundedQueue(2)
+        spill = self._spill_queue(queue)
+        for i in range(3):
+            spill.put(_callback(i))
+        queue.drain()
+
+        spill.put(_callback(3))
+
+        self.assertEqual([], queue.drain())
+        spill.replay()
+        self.assertEqual([_callback(2), _callback(3)], queue.drain())
+
+    def test_spilled_items_are_replayed_by_the_next_run(self):
+        queue = _BoundedQueue(2)
+        spill = self._spill_queue(queue)
+        for i in range(4):
+            spill.put(_callback(i))
+        spill.close()
+        queue.drain()
+
+        spill = self._spill_queue(queue)
+        spill.put(_callback(4))
+        spill.replay()
+        items = queue.drain()
+        spill.replay()
+        items.extend(queue.drain())
+
+        self.assertEqual([_callback(i) for i in range(2, 5)], items)
+
+    def test_full_spill_waits_for_the_queue(self):
+        queue = _BoundedQueue(1)
+        spill = self._spill_queue(queue, max_bytes=1)
+        spill.put(_callback(0))
+
+        with self.assertRaises(Queue.Full):
+            # The item does not fit in the spill files, so put blocks on the queue.
+            spill.put(_callback(1))
+
+        self.assertEqual(0, len(spill))
+
+    def test_concurrent_puts_and_replays_keep_every_item(self):
+        queue = _BoundedQueue(4)
+        spill = self._spill_queue(queue, high_water=0.5, segment_size=256)
+
+        def put(start):
+            for i in range(start, start + 200):
+                spill.put(_callback(i))
+
+        threads = [threading.Thread(target=put, args=(start,)) for start in (0, 1000)]
+        for thread in threads:
+            thread.start()
+
+        items = []
+        deadline = time.time() + 10
+        while (any(thread.is_alive() for thread in threads) or len(spill)) and time.time() < deadline:
+            spill.replay()
+            items.extend(queue.drain())
+        items.extend(queue.drain())
+
+        lines = [data['lines'][0] for _, data in items]
+        for start in (0, 1000):
+            self.assertEqual([u'line {0}'.format(i) for i in range(start, start + 200)],
+                             [line for line in lines if start <= int(line.split()[1]) < start + 200])
@@ -5,15 +5,53 @@ if sys.version_info < (2, 7):
 else:
     import unittest
 
+import gzip
+import io
 import mock
+import multiprocessing
+import os
+import re
 import tempfile
 import time
 from datetime import datetime
 
 from beaver.config import BeaverConfig
 from beaver.worker.tail import  Tail
+from beaver.worker.backfill import split_ranges
+from beaver.worker.mmap_file import MmapFile
 import sqlite3
 
+class _ScannedBytes(str):
+    """String that reports how many bytes were searched for newlines"""
+
+    def __new__(cls, value, owner):
+        obj = str.__new__(cls, value)
+        obj.owner = owner
+        return obj
+
+    def count(self, sub):
+        self.owner.scanned += len(self)
+        return str.count(self, sub)
+
+
+class _CountingFile(object):
+
+    def __init__(self, data):
+        self._file = io.BytesIO(data)
+        self.reads = 0
+        self.scanned = 0
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size):
+        self.reads += 1
+        return _ScannedBytes(self._file.read(size), self)
+
+
 class TestTail(unittest.TestCase):
 
     def setUp(self):
@@ -135,11 +173,18 @@ class TestTail(unittest.TestCase):
             # Write to the file
             logfile.write('\n'.join(lines) + '\n')
 
-        start_time = datetime.utcnow()
+        # The partial batch is held without blocking, and shipped by the first pass after its deadline.
+        start_time = time.time()
         self.tail._run_pass()
-        called_time = datetime.strptime(self.callback.call_args[0][0][1]['timestamp'],
-                                        '%Y-%m-%dT%H:%M:%S.%fZ')
-        self.assertLessEqual(flush_seconds, (called_time - start_time).total_seconds())
+        self.assertGreaterEqual(0.1, time.time() - start_time)
+        self.callback.assert_not_called()
+        self.assertLessEqual(start_time + flush_seconds, self.tail.batch_deadline())
+
+        time.sleep(self.tail.batch_deadline() - time.time())
+        self.tail._run_pass()
+        self.callback.assert_called_once()
+        self.assertIsNone(self.tail.batch_deadline())
+        self.assertEqual(lines, self.callback.call_args[0][0][1]['lines'])
         self.assertEqual(3, self.tail._sincedb_update_position.call_count)
 
         # check sincedb is correct
@@ -179,13 +224,357 @@ class TestTail(unittest.TestCase):
             # Write to the file
             logfile.write('\n'.join(lines) + '\n')
 
-        start_time = datetime.utcnow()
+        # The partial batch is held without blocking, and shipped by the first pass after its deadline.
+        start_time = time.time()
         self.tail._run_pass()
-        called_time = datetime.strptime(self.callback.call_args[0][0][1]['timestamp'],
-                                        '%Y-%m-%dT%H:%M:%S.%fZ')
-        self.assertLessEqual(flush_seconds, (called_time - start_time).total_seconds())
+        self.assertGreaterEqual(0.1, time.time() - start_time)
+        self.callback.assert_not_called()
+        self.assertLessEqual(start_time + flush_seconds, self.tail.batch_deadline())
+
+        time.sleep(self.tail.batch_deadline() - time.time())
+        self.tail._run_pass()
+        self.callback.assert_called_once()
+        self.assertIsNone(self.tail.batch_deadline())
+        self.assertEqual(lines, self.callback.call_args[0][0][1]['lines'])
         self.assertEqual(3, self.tail._sincedb_update_position.call_count)
 
         # check sincedb is correct
         self.tail._sincedb_update_position(force_update=True)
         self.assertEqual(4, self.tail._sincedb_start_position())
+
+    def _set_file_config(self, **kwargs):
+        file_config = dict(self.beaver_config._section_defaults)
+        file_config.update(kwargs)
+        self.beaver_config._files[os.path.realpath(self.filename)] = file_config
+
+    def test_runtail_mmap(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('')
+        self._set_file_config(use_mmap=True)
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+        self.assertTrue(isinstance(self.tail._file, MmapFile))
+
+        lines = ['test', 'test2']
+        with open(self.filename, 'a') as logfile:
+            logfile.write('\n'.join(lines) + '\npartial')
+
+        self.tail._run_pass()
+        self.callback.assert_called_once()
+        self.assertEqual(lines, self.callback.call_args[0][0][1]['lines'])
+
+        # The map grows with the file and the partial line is completed.
+        self.callback.reset_mock()
+        with open(self.filename, 'a') as logfile:
+            logfile.write(' line\ntest3\n')
+
+        self.tail._run_pass()
+        self.assertEqual([u'partial line', u'test3'], self.callback.call_args[0][0][1]['lines'])
+
+        # Truncation resets the reader to the start of the file.
+        self.callback.reset_mock()
+        with open(self.filename, 'w') as logfile:
+            logfile.write('new\n')
+
+        self.tail._ensure_file_is_good(current_time=time.time() + 60)
+        self.assertTrue(self.tail.active)
+        self.tail._run_pass()
+        self.assertEqual([u'new'], self.callback.call_args[0][0][1]['lines'])
+
+    def _write_and_ship(self, lines):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('\n'.join(lines) + '\n')
+        self.tail._run_pass()
+        self.tail.close()
+
+    def test_sincedb_resumes_at_byte_offset(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('')
+        self.tail._update_file()
+        self._write_and_ship(['test', 'test2'])
+
+        conn = sqlite3.connect(self.sincedb_path, isolation_level=None)
+        row = conn.execute('select position, byte_offset, fingerprint from sincedb').fetchone()
+        self.assertEqual((2, 11), row[:2])
+        self.assertTrue(row[2].startswith('11:'))
+
+        with open(self.filename, 'a') as logfile:
+            logfile.write('test3\n')
+
+        self.callback.reset_mock()
+        with mock.patch.object(Tail, '_seek_to_line') as seek_to_line:
+            self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+            self.assertFalse(seek_to_line.called)
+        self.tail._run_pass()
+        self.assertEqual([u'test3'], self.callback.call_args[0][0][1]['lines'])
+
+    def test_sincedb_migrates_line_positions(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('test\ntest2\n')
+        self.tail._update_file()
+        self.tail.close()
+
+        # Point at a database written by an older version.
+        self.sincedb_path = tempfile.NamedTemporaryFile(delete=True).name
+        self.beaver_config.set('sincedb_path', self.sincedb_path)
+        conn = sqlite3.connect(self.sincedb_path, isolation_level=None)
+        conn.execute('create table sincedb (fid text primary key, filename text, position integer default 1)')
+        conn.execute('insert into sincedb values (?, ?, ?)', (self.tail.fid(), self.filename, 1))
+
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+        self.tail._run_pass()
+        self.assertEqual([u'test2'], self.callback.call_args[0][0][1]['lines'])
+        self.tail.close()
+
+        row = conn.execute('select position, byte_offset from sincedb').fetchone()
+        self.assertEqual((2, 11), row)
+
+    def test_sincedb_ignores_offset_on_fingerprint_mismatch(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('')
+        self.tail._update_file()
+        self._write_and_ship(['test', 'test2'])
+
+        # Same inode, different contents: the stored offset must not be trusted.
+        with open(self.filename, 'r+') as logfile:
+            logfile.write('TEST')
+
+        self.callback.reset_mock()
+        self.beaver_config._section_defaults['start_position'] = 'beginning'
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+        self.tail._run_pass()
+        self.assertEqual([u'TEST', u'test2'], self.callback.call_args[0][0][1]['lines'])
+
+    def test_runtail_non_ascii_compatible_encoding(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write(u'caf\xe9\ntest2\n'.encode('utf_16'))
+        self._set_file_config(encoding='utf_16', start_position='beginning')
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+
+        self.tail._run_pass()
+        self.assertEqual([u'caf\xe9', u'test2'], self.callback.call_args[0][0][1]['lines'])
+        self.tail.close()
+        self.assertEqual((2, None), self.tail._sincedb_entry()[:2])
+
+    def _assert_text_mode_resumes(self, encoding, append_encoding):
+        with open(self.filename, 'wb') as logfile:
+            logfile.write(u''.join(u'line {0}\n'.format(i) for i in range(100)).encode(encoding))
+        self._set_file_config(encoding=encoding, start_position='end')
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+
+        with open(self.filename, 'ab') as logfile:
+            logfile.write(u'new 1\n'.encode(append_encoding))
+        self.tail._run_pass()
+        self.assertEqual([u'new 1'], self.callback.call_args[0][0][1]['lines'])
+        self.tail.close()
+        self.assertEqual((101, None), self.tail._sincedb_entry()[:2])
+
+        with open(self.filename, 'ab') as logfile:
+            logfile.write(u'new 2\n'.encode(append_encoding))
+        self.callback.reset_mock()
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+        self.tail._run_pass()
+        self.assertEqual(1, self.callback.call_count)
+        self.assertEqual([u'new 2'], self.callback.call_args[0][0][1]['lines'])
+
+    def test_runtail_utf_16_end_and_restart(self):
+        self._assert_text_mode_resumes('utf_16', 'utf_16_le' if sys.byteorder == 'little' else 'utf_16_be')
+
+    def test_runtail_utf_16_le_end_and_restart(self):
+        self._assert_text_mode_resumes('utf_16_le', 'utf_16_le')
+
+    def test_runtail_falls_back_to_other_encodings(self):
+        self._set_file_config(start_position='beginning')
+        with open(self.filename, 'a') as logfile:
+            logfile.write('caf\xc3\xa9\ncaf\xe9\n')
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+
+        self.tail._run_pass()
+        self.assertEqual([u'caf\xe9', u'caf\xe9'], self.callback.call_args[0][0][1]['lines'])
+
+    def test_tail_read(self):
+        data = ''.join('line{0}\n'.format(i) for i in range(100))
+        self.assertEqual(['line97', 'line98', 'line99'], Tail.tail_read(io.BytesIO(data), 3))
+        self.assertEqual(['line0', 'line1'], Tail.tail_read(io.BytesIO(data), 5, position=12))
+        self.assertEqual([], Tail.tail_read(io.BytesIO(''), 5))
+
+    def test_tail_read_scales_linearly(self):
+        line = 'x' * 1000 + '\n'
+        for lines in [64, 1024, 8192]:
+            data = line * lines
+            f = _CountingFile(data)
+            self.assertEqual(lines, len(Tail.tail_read(f, lines)))
+            # Every byte is searched for newlines exactly once ...
+            self.assertEqual(len(data), f.scanned)
+            # ... and the growing block size keeps the number of reads small.
+            self.assertLessEqual(f.reads, 20)
+
+    def test_runtail_ignoreline_regex(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('')
+        self._set_file_config(ignoreline_regex=re.compile('^DEBUG'),
+                              ignoreline_regexes=[re.compile('^TRACE'), re.compile('^WARN')])
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+
+        with open(self.filename, 'a') as logfile:
+            logfile.write('DEBUG a\nINFO b\nTRACE c\nDEBUG d\nINFO e\n')
+
+        self.tail._run_pass()
+        self.assertEqual([u'INFO b', u'INFO e'], self.callback.call_args[0][0][1]['lines'])
+        self.assertEqual({'^DEBUG': 2, '^TRACE': 1, '^WARN': 0}, self.tail.ignoreline_stats())
+
+    def test_ignoreline_regex_is_a_single_pattern(self):
+        conf = tempfile.NamedTemporaryFile(delete=True)
+        conf.write('[beaver]\n\n[{0}]\nignoreline_regex: ^DEBUG\n  |^TRACE\n'
+                   'ignoreline_regexes: ^WARN\n  ^INFO\n'.format(self.filename))
+        conf.flush()
+        beaver_config = BeaverConfig(mock.Mock(config=conf.name))
+        beaver_config.addglob(self.filename, [os.path.realpath(self.filename)])
+
+        self.assertEqual('^DEBUG\n|^TRACE', beaver_config.get_field('ignoreline_regex', self.filename).pattern)
+        self.assertEqual(['^WARN', '^INFO'],
+                         [regex.pattern for regex in beaver_config.get_field('ignoreline_regexes', self.filename)])
+
+    def test_runtail_binary_pipeline(self):
+        with open(self.filename, 'a') as logfile:
+            logfile.write('')
+        self.beaver_config.set('binary_pipeline', True)
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+
+        with open(self.filename, 'a') as logfile:
+            logfile.write('caf\xc3\xa9\ntest2\n')
+
+        self.tail._run_pass()
+        lines = self.callback.call_args[0][0][1]['lines']
+        self.assertEqual(['caf\xc3\xa9', 'test2'], lines)
+        self.assertIsInstance(lines[0], str)
+
+    def test_split_ranges(self):
+        with open(self.filename, 'w') as logfile:
+            logfile.write(''.join('line{0}\n'.format(i) for i in range(100)) + 'partial')
+        size = os.path.getsize(self.filename)
+
+        ranges = split_ranges(self.filename, 6, size, 50, '\n')
+        self.assertEqual(6, ranges[0][0])
+        self.assertEqual(size, ranges[-1][1])
+        with open(self.filename, 'rb') as logfile:
+            data = logfile.read()
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual('\n', data[end - 1])
+
+    def test_runtail_backfill(self):
+        lines = ['line{0}'.format(i) for i in range(1000)]
+        with open(self.filename, 'w') as logfile:
+            logfile.write('\n'.join(lines) + '\npartial')
+
+        self.beaver_config.set('backfill_processes', 2)
+        self.beaver_config.set('backfill_min_size', 1)
+        self.beaver_config.set('backfill_chunk_size', 500)
+        self.beaver_config.set('wait_before_send', 0)
+        self._set_file_config(start_position='beginning')
+        pool = multiprocessing.Pool(2)
+        try:
+            self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config, backfill_pool=pool)
+            self.assertTrue(self.tail._backfill_results)
+            while self.tail._backfill_results:
+                self.tail._run_pass()
+                time.sleep(0.01)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        shipped = []
+        for call in self.callback.call_args_list:
+            shipped += call[0][0][1]['lines']
+        self.assertEqual(lines, shipped)
+        self.assertEqual((1000, os.path.getsize(self.filename) - len('partial')), self.tail._sincedb_entry()[:2])
+
+        # Live tailing takes over at the end of the backfilled data.
+        self.callback.reset_mock()
+        with open(self.filename, 'a') as logfile:
+            logfile.write(' line\n')
+        self.tail._run_pass()
+        self.assertEqual([u'partial line'], self.callback.call_args[0][0][1]['lines'])
+
+    def test_runtail_gzip_resumes_at_checkpoint(self):
+        filename = tempfile.NamedTemporaryFile(delete=True, suffix='.gz').name
+        self.addCleanup(os.unlink, filename)
+
+        def append_member(lines):
+            with open(filename, 'ab') as f:
+                gz = gzip.GzipFile(fileobj=f, mode='wb')
+                gz.write('\n'.join(lines) + '\n')
+                gz.close()
+
+        append_member(['first', 'second'])
+        self.beaver_config._files[os.path.realpath(filename)] = dict(
+            self.beaver_config._section_defaults, start_position='beginning')
+        self.tail = Tail(filename, self.callback, beaver_config=self.beaver_config)
+        self.tail._run_pass()
+        self.assertEqual([u'first', u'second'], self.callback.call_args[0][0][1]['lines'])
+
+        append_member(['third'])
+        self.tail._run_pass()
+        self.tail.close()
+        compressed_size = os.path.getsize(filename)
+        append_member(['fourth'])
+
+        # The stored checkpoint points at the second member.
+        position, offset, fingerprint, checkpoint = self.tail._sincedb_entry()
+        self.assertEqual((3, 19), (position, offset))
+        self.assertNotEqual('0:0', checkpoint)
+        self.assertEqual('13', checkpoint.split(':')[1])
+        self.assertLess(int(checkpoint.split(':')[0]), compressed_size)
+
+        self.callback.reset_mock()
+        self.tail = Tail(filename, self.callback, beaver_config=self.beaver_config)
+        self.tail._run_pass()
+        self.assertEqual([u'fourth'], self.callback.call_args[0][0][1]['lines'])
+
+    def test_runtail_closes_corrupt_compressed_files(self):
+        filename = tempfile.NamedTemporaryFile(delete=True, suffix='.gz').name
+        self.addCleanup(os.unlink, filename)
+        with open(filename, 'wb') as f:
+            f.write('\x1f\x8b\x08\x00' + 'x' * 100)
+
+        logger = mock.Mock()
+        self.beaver_config._files[os.path.realpath(filename)] = dict(
+            self.beaver_config._section_defaults, start_position='beginning')
+        self.tail = Tail(filename, self.callback, beaver_config=self.beaver_config, logger=logger)
+        self.assertTrue(self.tail.active)
+        self.tail._run_pass()
+
+        self.assertFalse(self.tail.active)
+        self.assertTrue(self.tail.corrupt())
+        self.assertFalse(self.callback.called)
+        self.assertIn('cannot decompress', logger.warning.call_args[0][0])
+
+    def test_runtail_adaptive_read_size(self):
+        lines = ['x' * 99] * 30000
+        with open(self.filename, 'w') as logfile:
+            logfile.write('\n'.join(lines) + '\n')
+
+        self.beaver_config.set('file_read_pass_budget', 1024 * 1024)
+        self.beaver_config.set('wait_before_send', 0)
+        self._set_file_config(start_position='beginning')
+        self.tail = Tail(self.filename, self.callback, beaver_config=self.beaver_config)
+
+        # The first pass stops at the budget, with reads grown past the minimum.
+        self.tail._run_pass()
+        metrics = self.tail.metrics()
+        self.assertEqual(1, metrics['budget_exhausted'])
+        self.assertGreater(metrics['read_size'], 4096)
+        self.assertLess(self.tail._offset, len(lines) * 100)
+        self.assertLess(metrics['reads'], 1024 * 1024 / 4096)
+
+        while self.tail._offset < len(lines) * 100:
+            self.tail._run_pass()
+        shipped = []
+        for call in self.callback.call_args_list:
+            shipped += call[0][0][1]['lines']
+        self.assertEqual(len(lines), len(shipped))
+
+        # Short reads shrink the read size back down.
+        for _ in range(10):
+            self.tail._run_pass()
+        self.assertEqual(4096, self.tail.metrics()['read_size'])
@@ -0,0 +1,473 @@
+# ~*~ encoding: utf-8 ~*~
+import sys
+if sys.version_info < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import mock
+import multiprocessing
+import multiprocessing.pool
+import os
+import shutil
+import tempfile
+import time
+
+from beaver.config import BeaverConfig
+from beaver.worker.hash_ring import HashRing
+from beaver.worker.scheduler import TailScheduler
+from beaver.worker.sincedb import SincedbStore
+from beaver.worker.tail_manager import TailManager
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_only_keys_of_dead_shards_move(self):
+        ring = HashRing(4)
+        keys = ['{0:x}g{1:x}'.format(801, inode) for inode in range(2000)]
+        owners = dict((key, ring.get(key)) for key in keys)
+        self.assertEqual(set(range(4)), set(owners.values()))
+
+        alive = (0, 1, 3)
+        for key in keys:
+            owner = ring.get(key, alive)
+            self.assertIn(owner, alive)
+            if owners[key] != 2:
+                self.assertEqual(owners[key], owner)
+
+        self.assertEqual(None, ring.get(keys[0], ()))
+
+
+class TestTailScheduler(unittest.TestCase):
+
+    def test_idle_keys_back_off(self):
+        scheduler = TailScheduler(min_interval=0.1, max_interval=1.0)
+        scheduler.schedule('idle', due=0)
+        scheduler.schedule('busy', due=0)
+        self.assertEqual(['idle', 'busy'], scheduler.pop_due(now=10))
+
+        scheduler.done('idle', False, now=10)
+        scheduler.done('busy', True, pending=True, now=10)
+        self.assertEqual(['busy'], scheduler.pop_due(now=10))
+        self.assertEqual(10.2, scheduler.next_due())
+
+        # Each idle run doubles the interval, up to max_interval.
+        now = 10
+        intervals = []
+        for _ in range(6):
+            due = scheduler.next_due()
+            intervals.append(round(due - now, 3))
+            self.assertEqual(['idle'], scheduler.pop_due(now=due))
+            now = due
+            scheduler.done('idle', False, now=now)
+        self.assertEqual([0.2, 0.4, 0.8, 1.0, 1.0, 1.0], intervals)
+
+        # Activity resets it.
+        scheduler.pop_due(now=scheduler.next_due())
+        scheduler.done('idle', True, now=now)
+        self.assertEqual(now + 0.1, scheduler.next_due())
+
+    def test_deadline_brings_next_run_forward(self):
+        scheduler = TailScheduler(min_interval=0.1, max_interval=1.0)
+        scheduler.schedule('batch', due=0)
+        scheduler.pop_due(now=10)
+        scheduler.done('batch', False, now=10, deadline=10.05)
+        self.assertEqual(10.05, scheduler.next_due())
+
+        # A later deadline does not delay the run.
+        scheduler.pop_due(now=10.05)
+        scheduler.done('batch', True, now=10.05, deadline=20)
+        self.assertEqual(10.15, round(scheduler.next_due(), 3))
+
+    def test_removed_keys_are_not_returned(self):
+        scheduler = TailScheduler()
+        scheduler.schedule('a', due=1)
+        scheduler.schedule('b', due=2)
+        scheduler.schedule('a', due=3)
+        scheduler.remove('b')
+        self.assertEqual([], scheduler.pop_due(now=2))
+        self.assertEqual(3, scheduler.next_due())
+        self.assertEqual(['a'], scheduler.pop_due(now=3))
+        self.assertEqual(None, scheduler.next_due())
+        self.assertEqual(0, len(scheduler))
+
+
+class TestTailManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.conf = tempfile.NamedTemporaryFile(delete=True)
+        self.conf.write('[beaver]\nsincedb_path: {0}\n\n[{1}]\ntype: test\n'.format(
+            os.path.join(self.directory, 'sincedb.db'), os.path.join(self.directory, '*.log')))
+        self.conf.flush()
+        self.beaver_config = BeaverConfig(mock.Mock(config=self.conf.name))
+
+        self.filenames = []
+        for i in range(20):
+            filename = os.path.join(os.path.realpath(self.directory), '{0}.log'.format(i))
+            with open(filename, 'w') as f:
+                f.write('')
+            self.filenames.append(filename)
+
+    def _manager(self, **kwargs):
+        manager = TailManager(self.beaver_config, queue_consumer_function=mock.Mock(), callback=mock.Mock(),
+                              logger=mock.Mock(), **kwargs)
+        self.addCleanup(manager.close)
+        return manager
+
+    def _filenames(self, manager):
+        return set(tail.filename() for tail in manager._tails.values())
+
+    def test_shards_split_files_and_rebalance(self):
+        shards_alive = multiprocessing.Array('b', [1, 1])
+        managers = [self._manager(shard=shard, number_of_shards=2, shards_alive=shards_alive) for shard in range(2)]
+        for manager in managers:
+            manager.update_files()
+
+        owned = [self._filenames(manager) for manager in managers]
+        self.assertTrue(owned[0] and owned[1])
+        self.assertEqual(set(), owned[0] & owned[1])
+        self.assertEqual(set(self.filenames), owned[0] | owned[1])
+
+        # Shard 1 dies: shard 0 takes over all of its files.
+        shards_alive[1] = 0
+        managers[0].rebalance()
+        managers[0].update_files()
+        self.assertEqual(set(self.filenames), self._filenames(managers[0]))
+
+        # Shard 1 is back: shard 0 releases exactly the files it took over.
+        shards_alive[1] = 1
+        managers[0].rebalance()
+        self.assertEqual(owned[0], self._filenames(managers[0]))
+
+    def test_shard_flags_itself_alive_once_ready(self):
+        shards_alive = multiprocessing.Array('b', [1, 0])
+        manager = self._manager(shard=1, number_of_shards=2, shards_alive=shards_alive)
+        flags = []
+        manager._create_watcher = lambda: flags.append(('ready', shards_alive[1]))
+        manager._shutdown_requested.set()
+        with mock.patch.object(SincedbStore, 'load', side_effect=lambda: flags.append(('load', shards_alive[1]))):
+            manager.run()
+
+        # The positions are loaded before the other shards hand over the files.
+        self.assertEqual([('load', 0), ('ready', 1)], flags)
+        self.assertEqual(0, shards_alive[1])
+
+    def test_rebalance_without_sincedb_warns(self):
+        self.beaver_config.set('sincedb_path', None)
+        shards_alive = multiprocessing.Array('b', [1, 1])
+        manager = self._manager(shard=0, number_of_shards=2, shards_alive=shards_alive)
+        manager.update_files()
+
+        shards_alive[1] = 0
+        manager.rebalance()
+        self.assertIn('without a sincedb', manager._logger.warning.call_args[0][0])
+
+    def test_every_discover_pass_sends_all_matches(self):
+        manager = self._manager()
+        for _ in range(2):
+            manager._callback.reset_mock()
+            manager.update_files()
+            manager._update_time = None
+            addglobs = [args[0][0][1] for args in manager._callback.call_args_list if args[0][0][0] == 'addglob']
+            self.assertEqual(1, len(addglobs))
+            self.assertEqual(set(self.filenames), set(addglobs[0][1]))
+
+    def test_single_shard_owns_everything(self):
+        manager = self._manager()
+        manager.rebalance()
+        manager.update_files()
+        self.assertEqual(set(self.filenames), self._filenames(manager))
+
+    def test_scheduled_run_skips_idle_files(self):
+        self.beaver_config.set('wait_before_send', 0)
+        manager = self._manager()
+        manager.update_files()
+        tails = dict((tail.filename(), tail) for tail in manager._tails.values())
+
+        # First pass: every file is due, and none has data.
+        manager._run_scheduled()
+        self.assertEqual(0, len(manager._scheduler.pop_due(now=time.time())))
+
+        with open(self.filenames[0], 'a') as f:
+            f.write('line\n')
+
+        with mock.patch.object(tails[self.filenames[1]], 'run') as run:
+            time.sleep(0.21)
+            manager._run_scheduled()
+            self.assertEqual(1, run.call_count)
+            # The idle file backs off, the active one is due again soon.
+            manager._run_scheduled()
+            self.assertEqual(1, run.call_count)
+
+        self.assertEqual('callback', manager._callback.call_args[0][0][0])
+        self.assertEqual([u'line'], manager._callback.call_args[0][0][1]['lines'])
+
+    def test_max_open_files_suspends_least_recently_active(self):
+        self.beaver_config.set('wait_before_send', 0)
+        self.beaver_config.set('max_open_files', 5)
+        manager = self._manager()
+        manager.update_files()
+        self.assertEqual(20, len(manager._tails))
+        self.assertEqual(5, len([tail for tail in manager._tails.values() if tail.is_open()]))
+
+        tails = dict((tail.filename(), tail) for tail in manager._tails.values())
+        suspended = [filename for filename in self.filenames if not tails[filename].is_open()]
+        with open(suspended[0], 'a') as f:
+            f.write('line\n')
+
+        # The suspended file is reopened once it grows, and resumes at its position.
+        manager._run_tail(tails[suspended[0]].fid())
+        self.assertTrue(tails[suspended[0]].is_open())
+        self.assertEqual([u'line'], manager._callback.call_args[0][0][1]['lines'])
+        self.assertEqual(5, len([tail for tail in manager._tails.values() if tail.is_open()]))
+
+        # Idle suspended files stay closed.
+        manager._run_tail(tails[suspended[1]].fid())
+        self.assertFalse(tails[suspended[1]].is_open())
+
+    def test_polled_tails_check_their_path(self):
+        manager = self._manager()
+        manager.update_files()
+        tail = [tail for tail in manager._tails.values() if tail.filename() == self.filenames[0]][0]
+
+        os.rename(self.filenames[0], self.filenames[0] + '.1')
+        with open(self.filenames[0], 'w') as f:
+            f.write('')
+
+        tail._ensure_file_is_good(current_time=time.time() + 60)
+        self.assertTrue(tail.rotating())
+
+    def test_sweep_stat_detects_rotation(self):
+        self.beaver_config.set('wait_before_send', 0)
+        manager = self._manager()
+        manager._watcher = mock.Mock()
+        manager.update_files()
+        tail = [tail for tail in manager._tails.values() if tail.filename() == self.filenames[0]][0]
+
+        os.rename(self.filenames[0], self.filenames[0] + '.1')
+        with open(self.filenames[0], 'w') as f:
+            f.write('')
+
+        # With inotify, periodic checks only fstat the open handle, which is still good.
+        tail._ensure_file_is_good(current_time=time.time() + 60)
+        self.assertFalse(tail.rotating())
+
+        manager._update_time = None
+        manager.update_files()
+        self.assertTrue(tail.rotating())
+        # The new file is left to the tail of the rotated one.
+        self.assertEqual(20, len(manager._tails))
+
+    def test_sweep_stat_detects_truncation(self):
+        self.beaver_config.set('wait_before_send', 0)
+        self.beaver_config.set('start_position', 'beginning')
+        manager = self._manager()
+        manager.update_files()
+        tail = [tail for tail in manager._tails.values() if tail.filename() == self.filenames[0]][0]
+        with open(self.filenames[0], 'a') as f:
+            f.write('first\nsecond\n')
+        tail.run(once=True)
+
+        with open(self.filenames[0], 'w') as f:
+            f.write('new\n')
+        manager._update_time = None
+        with mock.patch.object(tail, '_update_file', wraps=tail._update_file) as update_file:
+            manager.update_files()
+            self.assertEqual(1, update_file.call_count)
+
+        # The sweep's stat stands in for the tail's own, which is not due again yet.
+        with mock.patch('os.stat', side_effect=AssertionError('stat')):
+            tail._ensure_file_is_good(current_time=time.time())
+        tail.run(once=True)
+        self.assertEqual([u'new'], manager._callback.call_args[0][0][1]['lines'])
+
+    def test_rotation_drains_old_file_before_switching(self):
+        self.beaver_config.set('wait_before_send', 0)
+        manager = self._manager()
+        manager._sincedb = SincedbStore(os.path.join(self.directory, 'sincedb.db'))
+        manager.update_files()
+        tail = [tail for tail in manager._tails.values() if tail.filename() == self.filenames[0]][0]
+        old_fid = tail.fid()
+
+        os.rename(self.filenames[0], self.filenames[0] + '.1')
+        with open(self.filenames[0], 'w') as f:
+            f.write('')
+        manager._update_time = None
+        manager.update_files()
+        new_fid = manager.get_file_id(os.stat(self.filenames[0]))
+        # The handoff is recorded, so the new file is read from its start after a restart.
+        self.assertEqual(0, manager._sincedb.get(new_fid, self.filenames[0])[1])
+
+        # The writer still appends to the old file.
+        with open(self.filenames[0] + '.1', 'a') as f:
+            f.write('old\n')
+        manager._run_tail(old_fid)
+        self.assertEqual([u'old'], manager._callback.call_args[0][0][1]['lines'])
+        manager._run_tail(old_fid)
+        self.assertTrue(tail.rotating())
+
+        # Once the writer moved to the new file, the tail switches to it and reads it from the start.
+        with open(self.filenames[0], 'a') as f:
+            f.write('new\n')
+        manager._run_tail(old_fid)
+        self.assertFalse(tail.rotating())
+        self.assertEqual(new_fid, tail.fid())
+        self.assertIs(tail, manager._tails[new_fid])
+        self.assertNotIn(old_fid, manager._tails)
+        self.assertIsNone(manager._sincedb.get(old_fid, self.filenames[0]))
+        # No glob matches the rotated name, so the position saved under it is dropped.
+        self.assertIsNone(manager._sincedb.get(old_fid, self.filenames[0] + '.1'))
+
+        manager._run_tail(new_fid)
+        self.assertEqual([u'new'], manager._callback.call_args[0][0][1]['lines'])
+
+    def test_restart_during_rotation_resumes_the_renamed_file(self):
+        self.beaver_config.set('wait_before_send', 0)
+        sincedb_path = os.path.join(self.directory, 'sincedb.db')
+        manager = self._manager()
+        manager._sincedb = SincedbStore(sincedb_path)
+        manager.update_files()
+        with open(self.filenames[0], 'a') as f:
+            f.write('first\n')
+        old_fid = manager._fids_by_filename[self.filenames[0]]
+        manager._run_tail(old_fid)
+
+        rotated = self.filenames[0][:-len('.log')] + '-1.log'
+        os.rename(self.filenames[0], rotated)
+        with open(self.filenames[0], 'w') as f:
+            f.write('')
+        manager._update_time = None
+        manager.update_files()
+        self.assertEqual(6, manager._sincedb.get(old_fid, rotated)[1])
+
+        # Beaver stops before the rotated file is read to its end.
+        with open(rotated, 'a') as f:
+            f.write('second\n')
+        manager.close()
+        manager._sincedb.close()
+
+        restarted = self._manager()
+        restarted._sincedb = SincedbStore(sincedb_path)
+        restarted._sincedb.load()
+        restarted.update_files()
+        restarted._run_tail(old_fid)
+        self.assertEqual([u'second'], restarted._callback.call_args[0][0][1]['lines'])
+
+    def test_tails_start_in_init_pool(self):
+        manager = self._manager()
+        manager._sincedb = SincedbStore(os.path.join(self.directory, 'sincedb.db'))
+        manager._init_pool = multiprocessing.pool.ThreadPool(4)
+        self.addCleanup(manager._init_pool.terminate)
+
+        manager.update_files()
+        self.assertEqual(20, len(manager._starting) + len(manager._tails))
+        # Files being started are not started twice.
+        manager._update_time = None
+        manager.update_files()
+        self.assertEqual(20, len(manager._starting) + len(manager._tails))
+
+        for result in manager._starting.values():
+            result.wait()
+        manager._collect_started_tails()
+        self.assertEqual({}, manager._starting)
+        self.assertEqual(set(self.filenames), self._filenames(manager))
+        self.assertIsNone(manager._init_batch)
+
+    def test_failed_tail_starts_are_retried(self):
+        # Without a sincedb in it, the directory is not listed again on the next pass.
+        self.beaver_config.set('sincedb_path', None)
+        os.utime(self.directory, (time.time() - 60, time.time() - 60))
+        manager = self._manager()
+        manager._init_pool = multiprocessing.pool.ThreadPool(4)
+        self.addCleanup(manager._init_pool.terminate)
+        start_tail = manager._start_tail
+
+        def failing_start_tail(path):
+            if path == self.filenames[0]:
+                raise IOError('cannot open')
+            return start_tail(path)
+
+        with mock.patch.object(manager, '_start_tail', side_effect=failing_start_tail):
+            manager.update_files()
+            for result in manager._starting.values():
+                result.wait()
+            manager._collect_started_tails()
+        self.assertEqual(set(self.filenames[1:]), self._filenames(manager))
+
+        # Its directory did not change, but the file is checked again on the next pass.
+        manager._update_time = None
+        manager.update_files()
+        for result in manager._starting.values():
+            result.wait()
+        manager._collect_started_tails()
+        self.assertEqual(set(self.filenames), self._filenames(manager))
+
+    def test_corrupt_compressed_files_wait_for_a_change(self):
+        filename = os.path.join(os.path.realpath(self.directory), 'corrupt.log.gz')
+        with open(filename, 'wb') as f:
+            f.write('\x1f\x8b\x08\x00' + 'x' * 100)
+        self.conf.seek(0)
+        self.conf.truncate()
+        self.conf.write('[beaver]\n\n[{0}]\ntype: test\n'.format(os.path.join(self.directory, '*.gz')))
+        self.conf.flush()
+        self.beaver_config = BeaverConfig(mock.Mock(config=self.conf.name))
+        manager = self._manager()
+
+        manager.update_files()
+        self.assertEqual({}, manager._tails)
+        self.assertIn(filename, manager._corrupt_files)
+
+        with mock.patch.object(manager, '_start_tail', wraps=manager._start_tail) as start_tail:
+            manager._update_time = None
+            manager.update_files()
+            self.assertFalse(start_tail.called)
+
+            with open(filename, 'ab') as f:
+                f.write('x')
+            manager._update_time = None
+            manager.update_files()
+            self.assertTrue(start_tail.called)
+
+    def _weighted_manager(self):
+        self.conf.seek(0)
+        self.conf.truncate()
+        self.conf.write('[beaver]\n\n[{0}]\ntype: test\nexclude: /1\\.log$\n\n[{1}]\ntype: audit\nweight: 3\n'.format(
+            os.path.join(self.directory, '*.log'), self.filenames[1]))
+        self.conf.flush()
+        self.beaver_config = BeaverConfig(mock.Mock(config=self.conf.name))
+        self.beaver_config.set('wait_before_send', 0)
+        self.beaver_config.set('file_read_blocksize', 1024)
+        self.beaver_config.set('file_read_max_blocksize', 1024)
+        self.beaver_config.set('file_read_pass_budget', 1024)
+
+        manager = self._manager(queue_size=mock.Mock(return_value=0))
+        manager.update_files()
+        for filename in self.filenames[:2]:
+            with open(filename, 'a') as f:
+                f.write('x' * 99 + '\n' * 1 + ('y' * 99 + '\n') * 200)
+        return manager, dict((tail.filename(), tail) for tail in manager._tails.values())
+
+    def test_weights_share_read_budget(self):
+        manager, tails = self._weighted_manager()
+        self.assertEqual(3, tails[self.filenames[1]].weight())
+
+        for i in range(3):
+            for filename in self.filenames[:2]:
+                manager._run_tail(tails[filename].fid())
+
+        self.assertEqual(3 * tails[self.filenames[0]].metrics()['bytes_read'],
+                         tails[self.filenames[1]].metrics()['bytes_read'])
+
+    def test_queue_pressure_throttles_low_weights(self):
+        manager, tails = self._weighted_manager()
+        manager._queue_size.return_value = 90
+        manager._check_queue_pressure()
+
+        self.assertIsNone(manager._run_tail(tails[self.filenames[0]].fid()))
+        self.assertTrue(manager._run_tail(tails[self.filenames[1]].fid()))
+
+        manager._queue_size.return_value = 10
+        manager._check_queue_pressure()
+        self.assertTrue(manager._run_tail(tails[self.filenames[0]].fid()))